@@ -0,0 +1,162 @@
+"""
+Benchmarks the daily pipeline offline, against generated archives in the fake s3 bucket:
+- compaction (combine_csv_files_for_month) of a day's hourly parts into the month, both at the
+  start of a month (1d: no month file yet) and at its end (1m: a month file of the days before);
+- building the rollups of every month file without them (backfill_rollups), for 1 and 12 months.
+Prints the results as JSON, or writes them to --json.
+
+    python bench_daily.py --plants 51 --spans 1d,1m --format parquet
+"""
+
+import argparse
+from datetime import datetime, timedelta
+from os import environ
+
+import offline
+
+offline.use_component('daily_pipeline')
+
+import archive_files  # pylint: disable=wrong-import-position
+import backfill_rollups  # pylint: disable=wrong-import-position
+import manifest  # pylint: disable=wrong-import-position
+import s3_data_management  # pylint: disable=wrong-import-position
+
+
+COMPONENT = 'daily_pipeline'
+DEFAULT_PLANTS = '51'
+DEFAULT_STEP_MINUTES = 10
+DEFAULT_REPEATS = 3
+ARCHIVE_YEAR = 2023
+SPAN_MONTHS = {'1d': 0, '1m': 1, '12m': 12}
+COMPACTION_SPANS = ['1d', '1m']
+BACKFILL_SPANS = ['1m', '12m']
+
+
+def put_archive_file(s3_client, key: str, df, entries: dict) -> None:
+    """Writes the recordings to the key as an archive file, adding its manifest entry to entries."""
+    archive_format = archive_files.get_key_format(key)
+    df = df.sort_values(['plant_id', 'datetime'])
+    plant_offsets = {}
+    if archive_format == 'csv':
+        body = archive_files.get_indexed_csv_body(df, plant_offsets)
+    else:
+        body = archive_files.get_file_body(df, archive_format)
+    response = s3_client.put_object(Body=body, Bucket=offline.BUCKET_NAME, Key=key,
+                                    Metadata=archive_files.SORTED_METADATA)
+    indexed = archive_files.save_plant_offsets(s3_client, offline.BUCKET_NAME, key,
+                                               response['ETag'], plant_offsets)
+    entries[key] = manifest.get_file_entry(key, len(df), len(body), response['ETag'],
+                                           df['datetime'].min(), df['datetime'].max(), indexed)
+
+
+def create_month_to_compact(span: str, plants: int, step_minutes: int,
+                            archive_format: str) -> tuple[offline.FakeS3Client, int]:
+    """
+    Returns a bucket holding a month's last day of hourly part files (for 1m, after a month file of
+    the rest of the month; for 1d, the month's first day, with no month file), and its rows.
+    """
+    day = datetime(ARCHIVE_YEAR, 1, 31 if span == '1m' else 1)
+    s3_client = offline.FakeS3Client()
+    entries = {}
+    rows = 0
+    if span == '1m':
+        month_df = offline.get_recordings(datetime(ARCHIVE_YEAR, 1, 1), day, plants, step_minutes)
+        put_archive_file(s3_client, f'{ARCHIVE_YEAR}/1/recording.{archive_format}', month_df,
+                         entries)
+        rows += len(month_df)
+
+    for hour in range(24):
+        start = day + timedelta(hours=hour)
+        part_df = offline.get_recordings(start, start + timedelta(hours=1), plants,
+                                         step_minutes, rows + 1)
+        run_time = start + timedelta(hours=25)
+        put_archive_file(s3_client, f'{ARCHIVE_YEAR}/1/recording_{day.day}/'
+                         f'{run_time:%Y%m%d%H%M%S%f}.{archive_format}', part_df, entries)
+        rows += len(part_df)
+
+    manifest.save_manifest(s3_client, {'files': entries}, offline.BUCKET_NAME)
+    return s3_client, rows
+
+
+def create_months_without_rollups(months: int, plants: int, step_minutes: int,
+                                  archive_format: str) -> tuple[offline.FakeS3Client, int]:
+    """Returns a bucket holding months month files of recordings (with no rollups), and its rows."""
+    s3_client = offline.FakeS3Client()
+    entries = {}
+    rows = 0
+    for month in range(1, months + 1):
+        month_start = datetime(ARCHIVE_YEAR, month, 1)
+        month_end = datetime(ARCHIVE_YEAR + month // 12, month % 12 + 1, 1)
+        df = offline.get_recordings(month_start, month_end, plants, step_minutes, rows + 1)
+        put_archive_file(s3_client, f'{ARCHIVE_YEAR}/{month}/recording.{archive_format}', df,
+                         entries)
+        rows += len(df)
+    manifest.save_manifest(s3_client, {'files': entries}, offline.BUCKET_NAME)
+    return s3_client, rows
+
+
+def get_bucket_copy(s3_client: offline.FakeS3Client) -> offline.FakeS3Client:
+    """Returns a new bucket holding the same objects, so every run starts from the same archive."""
+    copy = offline.FakeS3Client(s3_client.latency)
+    copy.objects = dict(s3_client.objects)
+    return copy
+
+
+def bench_compaction(span: str, plants: int, step_minutes: int, archive_format: str,
+                     repeats: int) -> dict:
+    """Measures compacting the last day of a month's parts into its month file."""
+    s3_client, rows = create_month_to_compact(span, plants, step_minutes, archive_format)
+    day = 31 if span == '1m' else 1
+    # The day compacted is the day before yesterday's, so none of its parts are live
+    s3_data_management.DAY_BEFORE_YESTERDAY = datetime(ARCHIVE_YEAR, 1, day)
+    s3_data_management.YESTERDAY = datetime(ARCHIVE_YEAR, 1, day) + timedelta(days=1)
+    return offline.measure(
+        lambda bucket: s3_data_management.combine_csv_files_for_month(bucket,
+                                                                      offline.BUCKET_NAME),
+        rows, repeats, setup=lambda: get_bucket_copy(s3_client))
+
+
+def bench_backfill(span: str, plants: int, step_minutes: int, archive_format: str,
+                   repeats: int) -> dict:
+    """Measures building the rollups of every month file of the archive."""
+    s3_client, rows = create_months_without_rollups(SPAN_MONTHS[span], plants, step_minutes,
+                                                    archive_format)
+    return offline.measure(
+        lambda bucket: backfill_rollups.backfill_rollups(bucket, offline.BUCKET_NAME),
+        rows, repeats, setup=lambda: get_bucket_copy(s3_client))
+
+
+def run_benchmarks(plant_counts: list[int], spans: list[str], step_minutes: int,
+                   archive_format: str, repeats: int) -> list[dict]:
+    """Returns the results of every stage at every number of plants and span of the archive."""
+    environ['ARCHIVE_FORMAT'] = archive_format
+    results = []
+    for plants in plant_counts:
+        for span in spans:
+            scale = {'plants': plants, 'span': span, 'step_minutes': step_minutes,
+                     'format': archive_format}
+            if span in COMPACTION_SPANS:
+                results.append(offline.get_result(COMPONENT, 'compaction', scale, bench_compaction(
+                    span, plants, step_minutes, archive_format, repeats)))
+            if span in BACKFILL_SPANS:
+                results.append(offline.get_result(COMPONENT, 'backfill_rollups', scale,
+                                                  bench_backfill(span, plants, step_minutes,
+                                                                 archive_format, repeats)))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--plants', type=offline.get_int_list, default=DEFAULT_PLANTS,
+                        help='comma separated numbers of plants')
+    parser.add_argument('--spans', type=lambda text: text.split(','), default='1d,1m,12m',
+                        help=f'comma separated spans of archive, of {list(SPAN_MONTHS)}')
+    parser.add_argument('--step-minutes', type=int, default=DEFAULT_STEP_MINUTES,
+                        help='minutes between the generated recordings of a plant')
+    parser.add_argument('--format', choices=archive_files.ARCHIVE_FORMATS, default='csv')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS)
+    parser.add_argument('--json', help='file to write the results to')
+    args = parser.parse_args()
+
+    offline.write_results(run_benchmarks(args.plants, args.spans, args.step_minutes, args.format,
+                                         args.repeats), args.json)
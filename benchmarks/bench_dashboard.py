@@ -0,0 +1,203 @@
+"""
+Benchmarks the dashboard's loaders offline:
+- reading a span (1d, 1m or 12m, ending with the archive) of recordings from the fake s3 bucket,
+  for every plant and for one, both from the month files and from their rollups (at the
+  resolution the dashboard would chart the span at);
+- filling the rolling 24 hour window from SQLite, refreshing it a minute later, and reading each
+  plant's latest recording, at each number of plants.
+Prints the results as JSON, or writes them to --json.
+
+    python bench_dashboard.py --archive-plants 51 --spans 1d,1m,12m --window-plants 51,1000
+"""
+
+import argparse
+from datetime import date, datetime, timedelta
+from os import environ
+from types import SimpleNamespace
+
+import pandas as pd
+
+import offline
+
+offline.use_component('dashboard')
+
+import archive_files  # pylint: disable=wrong-import-position
+import db_functions  # pylint: disable=wrong-import-position
+import manifest  # pylint: disable=wrong-import-position
+import rollups  # pylint: disable=wrong-import-position
+import s3_data_extraction  # pylint: disable=wrong-import-position
+import tables  # pylint: disable=wrong-import-position
+
+
+COMPONENT = 'dashboard'
+DEFAULT_ARCHIVE_PLANTS = '51'
+DEFAULT_WINDOW_PLANTS = '51,1000'
+DEFAULT_STEP_MINUTES = 10
+DEFAULT_SAMPLE_MINUTES = 10  # The dashboard's default sample rate
+DEFAULT_REPEATS = 3
+ARCHIVE_YEAR = 2023
+ARCHIVE_END = date(ARCHIVE_YEAR, 12, 31)
+SPAN_START = {'1d': ARCHIVE_END, '1m': date(ARCHIVE_YEAR, 12, 1), '12m': date(ARCHIVE_YEAR, 1, 1)}
+
+
+def put_archive_file(s3_client, key: str, df: pd.DataFrame, entries: dict,
+                     raw_range: tuple = None, resolution: str = None) -> None:
+    """
+    Writes the rows (sorted by plant and time) to the key as an archive file, adding its manifest
+    entry to entries; a rollup's entry gets the datetime range of the rows it rolls up.
+    """
+    archive_format = archive_files.get_key_format(key)
+    plant_offsets = {}
+    if resolution:
+        body = rollups.get_rollup_body(df, archive_format, plant_offsets)
+    elif archive_format == 'csv':
+        body = archive_files.get_indexed_csv_body(df, plant_offsets)
+    else:
+        body = archive_files.get_file_body(df, archive_format)
+    response = s3_client.put_object(Body=body, Bucket=offline.BUCKET_NAME, Key=key)
+    indexed = archive_files.save_plant_offsets(s3_client, offline.BUCKET_NAME, key,
+                                               response['ETag'], plant_offsets)
+    min_datetime, max_datetime = raw_range or (df['datetime'].min(), df['datetime'].max())
+    entries[key] = manifest.get_file_entry(key, len(df), len(body), response['ETag'],
+                                           min_datetime, max_datetime, indexed, resolution)
+
+
+def create_archive(plants: int, step_minutes: int, archive_format: str) -> offline.FakeS3Client:
+    """Returns a bucket holding a year of month files of recordings, and their rollups."""
+    s3_client = offline.FakeS3Client()
+    entries = {}
+    first_id = 1
+    for month in range(1, 13):
+        month_start = datetime(ARCHIVE_YEAR, month, 1)
+        month_end = datetime(ARCHIVE_YEAR + month // 12, month % 12 + 1, 1)
+        df = offline.get_recordings(month_start, month_end, plants, step_minutes, first_id)
+        df = df.sort_values(['plant_id', 'datetime'], ignore_index=True)
+        first_id += len(df)
+        put_archive_file(s3_client, f'{ARCHIVE_YEAR}/{month}/recording.{archive_format}', df,
+                         entries)
+
+        raw_range = (df['datetime'].min(), df['datetime'].max())
+        month_rollups = rollups.get_rollups([rollups.get_partial_rollup(df, '10min')])
+        for resolution, rollup in month_rollups.items():
+            put_archive_file(s3_client, rollups.get_rollup_key(resolution, 'recording',
+                                                               ARCHIVE_YEAR, month,
+                                                               archive_format),
+                             rollup, entries, raw_range, resolution)
+    manifest.save_manifest(s3_client, {'files': entries}, offline.BUCKET_NAME)
+    return s3_client
+
+
+def bench_archive_reads(s3_client: offline.FakeS3Client, span: str, plant_id: int,
+                        repeats: int) -> tuple[dict, dict]:
+    """Measures reading the span's recordings, and its rollups at the resolution charted."""
+    range_start = SPAN_START[span]
+    raw_rows = len(s3_data_extraction.get_s3_data_for_type_and_date_ranges(
+        s3_client, 'recording', range_start, ARCHIVE_END, offline.BUCKET_NAME, plant_id=plant_id))
+    raw = offline.measure(
+        lambda _: s3_data_extraction.get_s3_data_for_type_and_date_ranges(
+            s3_client, 'recording', range_start, ARCHIVE_END, offline.BUCKET_NAME,
+            plant_id=plant_id), raw_rows, repeats)
+
+    range_minutes = (ARCHIVE_END - range_start + timedelta(days=1)) / timedelta(minutes=1)
+    resolution = rollups.get_resolution(rollups.get_chart_minutes(range_minutes,
+                                                                  DEFAULT_SAMPLE_MINUTES))
+    rolled_up = offline.measure(
+        lambda _: s3_data_extraction.get_s3_rollups_for_type_and_date_ranges(
+            s3_client, 'recording', resolution, range_start, ARCHIVE_END, offline.BUCKET_NAME,
+            plant_id), raw_rows, repeats)
+    rolled_up['resolution'] = resolution
+    return raw, rolled_up
+
+
+def get_window_database(plants: int, now: datetime) -> SimpleNamespace:
+    """
+    Returns a stand-in for the dashboard's database object, connected to a database holding 24
+    hours of minute recordings, and each plant's latest.
+    """
+    engine = offline.create_sqlite_engine(tables.metadata)
+    df = offline.get_recordings(now - timedelta(hours=24), now, plants, 1)
+    latest = df.drop_duplicates('plant_id', keep='last').drop(columns='id')
+    connection = engine.connect()
+    connection.execute(tables.recording.insert(), df.to_dict('records'))
+    connection.execute(tables.latest_recording.insert(), latest.to_dict('records'))
+    connection.commit()
+    return SimpleNamespace(engine=engine, connection=connection)
+
+
+def add_minute_of_recordings(database: SimpleNamespace, plants: int, now: datetime) -> None:
+    """Inserts the next minute's recordings, as the minute pipeline would."""
+    df = offline.get_recordings(now, now + timedelta(minutes=1), plants, 1).drop(columns='id')
+    database.connection.execute(tables.recording.insert(), df.to_dict('records'))
+    database.connection.commit()
+
+
+def bench_window(plants: int, repeats: int) -> tuple[dict, dict, dict]:
+    """
+    Measures filling the rolling window, refreshing it a minute later, and reading the latest
+    readings.
+    """
+    now = datetime.now().replace(second=0, microsecond=0)
+    database = get_window_database(plants, now)
+
+    fill = offline.measure(lambda window: window.refresh(now), plants * 24 * 60, repeats,
+                           setup=lambda: db_functions.RollingWindow('recording', database))
+
+    def get_filled_window():
+        database.connection.execute(tables.recording.delete().where(
+            tables.recording.c.datetime >= now))
+        database.connection.commit()
+        window = db_functions.RollingWindow('recording', database)
+        window.refresh(now)
+        add_minute_of_recordings(database, plants, now)
+        return window
+
+    refresh = offline.measure(lambda window: window.refresh(now + timedelta(minutes=1)), plants,
+                              repeats, setup=get_filled_window)
+    latest = offline.measure(lambda _: db_functions.get_latest_recordings(database), plants,
+                             repeats)
+    return fill, refresh, latest
+
+
+def run_benchmarks(archive_plants: list[int], spans: list[str], window_plants: list[int],
+                   step_minutes: int, archive_format: str, repeats: int) -> list[dict]:
+    """Returns the results of every loader at every scale."""
+    environ['ARCHIVE_FORMAT'] = archive_format
+    results = []
+    for plants in archive_plants:
+        s3_client = create_archive(plants, step_minutes, archive_format)
+        for span in spans:
+            for plant_id in (None, 0):
+                scale = {'plants': plants, 'span': span, 'step_minutes': step_minutes,
+                         'format': archive_format, 'one_plant': plant_id is not None}
+                raw, rolled_up = bench_archive_reads(s3_client, span, plant_id, repeats)
+                results.append(offline.get_result(COMPONENT, 'read_archive', scale, raw))
+                results.append(offline.get_result(COMPONENT, 'read_rollups', scale, rolled_up))
+
+    for plants in window_plants:
+        scale = {'plants': plants}
+        fill, refresh, latest = bench_window(plants, repeats)
+        results.append(offline.get_result(COMPONENT, 'rolling_window_fill', scale, fill))
+        results.append(offline.get_result(COMPONENT, 'rolling_window_refresh', scale, refresh))
+        results.append(offline.get_result(COMPONENT, 'latest_readings', scale, latest))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--archive-plants', type=offline.get_int_list,
+                        default=DEFAULT_ARCHIVE_PLANTS,
+                        help='comma separated numbers of plants in the archive')
+    parser.add_argument('--spans', type=lambda text: text.split(','), default='1d,1m,12m',
+                        help=f'comma separated spans to read, of {list(SPAN_START)}')
+    parser.add_argument('--window-plants', type=offline.get_int_list,
+                        default=DEFAULT_WINDOW_PLANTS,
+                        help='comma separated numbers of plants in the database')
+    parser.add_argument('--step-minutes', type=int, default=DEFAULT_STEP_MINUTES,
+                        help='minutes between the archive\'s recordings of a plant')
+    parser.add_argument('--format', choices=archive_files.ARCHIVE_FORMATS, default='csv')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS)
+    parser.add_argument('--json', help='file to write the results to')
+    args = parser.parse_args()
+
+    offline.write_results(run_benchmarks(args.archive_plants, args.spans, args.window_plants,
+                                         args.step_minutes, args.format, args.repeats), args.json)
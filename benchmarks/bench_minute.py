@@ -0,0 +1,121 @@
+"""
+Benchmarks the minute pipeline's stages offline, at each number of plants: extract (against the
+stub plant API), transform, load (into SQLite) and archival (from SQLite to the fake s3 bucket, of
+the hour of recordings and waterings an hourly run moves). Prints the results as JSON, or writes
+them to --json; run_benchmarks.py runs this with the other components' benchmarks.
+
+    python bench_minute.py --plants 51,1000 --repeats 3
+"""
+
+import argparse
+from datetime import datetime, timedelta
+
+import offline
+
+offline.use_component('minute_pipeline')
+
+import extract  # pylint: disable=wrong-import-position
+import load  # pylint: disable=wrong-import-position
+import rds_to_s3  # pylint: disable=wrong-import-position
+import tables  # pylint: disable=wrong-import-position
+from transform import transform  # pylint: disable=wrong-import-position
+
+
+COMPONENT = 'minute_pipeline'
+DEFAULT_PLANTS = '51,1000,10000'
+DEFAULT_REPEATS = 5
+ARCHIVE_MINUTES = 60  # Archival runs hourly, so moves an hour of rows
+
+
+def bench_extract(plants: int, repeats: int, api_latency: float) -> dict:
+    """Measures extracting every plant's reading from the stub API."""
+    with offline.StubPlantAPI(api_latency) as api:
+        extract.BASE_URL = api.url
+        return offline.measure(lambda _: extract.extract_within_deadline(range(plants)),
+                               plants, repeats)
+
+
+def bench_transform(extracted: tuple, repeats: int) -> dict:
+    """Measures transforming the extracted readings."""
+    return offline.measure(lambda frames: transform(*frames), len(extracted[0]), repeats,
+                           setup=lambda: (extracted[0].copy(), extracted[1].copy()))
+
+
+def bench_load(transformed: tuple, repeats: int) -> dict:
+    """Measures loading the transformed readings into an empty database."""
+    def run(engine):
+        with engine.connect() as connection:
+            load.load(*transformed, connection)
+
+    return offline.measure(run, len(transformed[0]), repeats,
+                           setup=lambda: offline.create_sqlite_engine(tables.metadata))
+
+
+def get_archive_database(plants: int, now: datetime):
+    """
+    Returns an engine of a database holding an hour of recordings and waterings older than 24
+    hours, and a minute of new ones.
+    """
+    engine = offline.create_sqlite_engine(tables.metadata)
+    old = offline.get_recordings(now - timedelta(hours=24, minutes=ARCHIVE_MINUTES),
+                                 now - timedelta(hours=24), plants, 1)
+    new = offline.get_recordings(now - timedelta(minutes=1), now, plants, 1, len(old) + 1)
+    with engine.connect() as connection:
+        for df in (old, new):
+            connection.execute(tables.recording.insert(), df.to_dict('records'))
+            waterings = df[df['datetime'] == df['datetime'].min()][['plant_id', 'datetime']]
+            connection.execute(tables.watering.insert(), waterings.to_dict('records'))
+        connection.commit()
+    return engine
+
+
+def bench_archive(plants: int, repeats: int) -> dict:
+    """Measures moving the old rows of both tables from the database to the fake bucket."""
+    now = datetime.now()
+
+    def run(state):
+        engine, s3_client = state
+        with engine.connect() as connection:
+            for data_type in ['recording', 'watering']:
+                rds_to_s3.archive_old_records(data_type, connection, s3_client,
+                                              now - timedelta(hours=24), now,
+                                              bucket_name=offline.BUCKET_NAME)
+
+    return offline.measure(run, plants * (ARCHIVE_MINUTES + 1), repeats,
+                           setup=lambda: (get_archive_database(plants, now),
+                                          offline.FakeS3Client()))
+
+
+def run_benchmarks(plant_counts: list[int], repeats: int, api_latency: float) -> list[dict]:
+    """Returns the results of every stage at every number of plants."""
+    results = []
+    for plants in plant_counts:
+        scale = {'plants': plants}
+        results.append(offline.get_result(COMPONENT, 'extract', scale,
+                                          bench_extract(plants, repeats, api_latency)))
+
+        with offline.StubPlantAPI(api_latency) as api:
+            extract.BASE_URL = api.url
+            extracted = extract.extract_within_deadline(range(plants))[:2]
+        results.append(offline.get_result(COMPONENT, 'transform', scale,
+                                          bench_transform(extracted, repeats)))
+
+        transformed = transform(extracted[0].copy(), extracted[1].copy())
+        results.append(offline.get_result(COMPONENT, 'load', scale,
+                                          bench_load(transformed, repeats)))
+        results.append(offline.get_result(COMPONENT, 'archive', scale,
+                                          bench_archive(plants, repeats)))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--plants', type=offline.get_int_list, default=DEFAULT_PLANTS,
+                        help='comma separated numbers of plants')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS)
+    parser.add_argument('--api-latency', type=float, default=0,
+                        help='seconds the stub API takes to answer each request')
+    parser.add_argument('--json', help='file to write the results to')
+    args = parser.parse_args()
+
+    offline.write_results(run_benchmarks(args.plants, args.repeats, args.api_latency), args.json)
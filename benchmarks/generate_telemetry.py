@@ -0,0 +1,405 @@
+"""
+Script to generate synthetic plant telemetry at any scale (plants x days), a chunk at a time, so
+hundreds of millions of rows can be written without holding them in memory. Each plant's
+temperature follows a daily cycle around its own base, and its soil moisture dries out (faster
+when warmer) until it falls to the plant's watering threshold, when it's watered back up; every
+watering is recorded as a watering event.
+
+With --target archive, the rows are written in the s3 archive's layout: month files
+({year}/{month}/{data_type}-{version}.{format}) up to the last --part-days days, which are written
+as the hourly part files the minute pipeline leaves for compaction
+({year}/{month}/{data_type}_{day}/...), with the manifest (and, with --rollups, the months' rollup
+files). Files are written by the daily pipeline's own compaction writer, to the --bucket given or
+to a directory mirroring one.
+With --target database, the rows are written as csv files of the recording, watering and
+latest_recording tables (with ids in insertion order), ready for bulk loading.
+
+    python generate_telemetry.py --plants 10000 --days 90 --part-days 2 --output-dir mock_archive
+    python generate_telemetry.py --plants 1000 --days 365 --format parquet --bucket load-test-bucket
+    python generate_telemetry.py --target database --plants 10000 --days 1 --output-dir mock_tables
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import hashlib
+from io import BytesIO
+from os import environ, makedirs, path, remove
+import shutil
+import sys
+
+from botocore.exceptions import ClientError
+import numpy as np
+import pandas as pd
+
+import offline
+
+offline.use_component('daily_pipeline')
+
+import archive_files  # pylint: disable=wrong-import-position
+import compaction  # pylint: disable=wrong-import-position
+import manifest  # pylint: disable=wrong-import-position
+import rollups  # pylint: disable=wrong-import-position
+import s3_data_management  # pylint: disable=wrong-import-position
+
+
+DEFAULT_PLANTS = 51
+DEFAULT_DAYS = 1
+DEFAULT_STEP_MINUTES = 1  # The minute pipeline takes a reading of every plant each minute
+DEFAULT_CHUNK_ROWS = 1000000
+DEFAULT_SEED = 0
+ARCHIVE_DELAY = timedelta(hours=24)  # How long rows stay in the database before being archived
+PEAK_HOUR = 15  # When the daily temperature cycle peaks
+TEMPERATURE_NOISE = 0.3
+MOISTURE_NOISE = 0.5
+DRYING_PER_DEGREE = 0.05  # Extra drying per degree above the plant's base temperature
+WATERING_COLUMNS = ['id', 'plant_id', 'datetime']
+
+
+class PlantModel:
+    """
+    The parameters and soil moisture of every plant, drawn once from the seed; simulating a span
+    of time for some of the plants carries their moisture on, so spans must be simulated in order.
+    """
+
+    def __init__(self, plants: int, seed: int = DEFAULT_SEED) -> None:
+        rng = np.random.default_rng(seed)
+        self.plants = plants
+        self.seed = seed
+        self.base_temperature = rng.uniform(9, 17, plants)
+        self.temperature_swing = rng.uniform(1, 4, plants)
+        self.drying_per_minute = rng.uniform(0.005, 0.03, plants)
+        self.threshold = rng.uniform(15, 30, plants)
+        self.capacity = rng.uniform(70, 100, plants)
+        self.moisture = rng.uniform(self.threshold, self.capacity)
+        # Plants are read one after another, a few seconds apart
+        self.second_offset = (np.arange(plants) * 60 // max(plants, 1)).astype('timedelta64[s]')
+
+    def simulate(self, plant_ids: np.ndarray, times: pd.DatetimeIndex,
+                 step_minutes: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the temperature, soil moisture and whether each plant was watered at each of the
+        times (as plants x times arrays), for the given plants.
+        """
+        rng = np.random.default_rng([self.seed, int(plant_ids[0]), times[0].value // 10**9])
+        hours = (times.hour + times.minute / 60).to_numpy()
+        daily_cycle = np.sin(2 * np.pi * (hours - PEAK_HOUR + 6) / 24)
+        base = self.base_temperature[plant_ids, None]
+        temperature = (base + self.temperature_swing[plant_ids, None] * daily_cycle
+                       + rng.normal(0, TEMPERATURE_NOISE, (len(plant_ids), len(times))))
+
+        drying = (self.drying_per_minute[plant_ids, None] * step_minutes
+                  * np.clip(1 + DRYING_PER_DEGREE * (temperature - base), 0, None))
+        dried = np.cumsum(drying, axis=1)
+        # How far past its first watering each plant has dried, and so how often it's been watered
+        threshold = self.threshold[plant_ids, None]
+        refill = self.capacity[plant_ids, None] - threshold
+        past_threshold = dried - (self.moisture[plant_ids, None] - threshold)
+        waterings = np.where(past_threshold > 0, past_threshold // refill + 1, 0)
+        moisture = np.where(past_threshold > 0,
+                            self.capacity[plant_ids, None] - past_threshold % refill,
+                            self.moisture[plant_ids, None] - dried)
+        watered = np.diff(waterings, axis=1, prepend=0) > 0
+
+        self.moisture[plant_ids] = moisture[:, -1]
+        moisture = np.clip(moisture + rng.normal(0, MOISTURE_NOISE, moisture.shape), 0, 100)
+        return temperature, moisture, watered
+
+
+class LocalBucketClient:
+    """
+    Stand-in for an s3 client which writes objects to files under a directory, by key, so the
+    archive can be generated without a bucket; multipart uploads are streamed to disk.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.uploads = {}
+        self.next_upload_id = 0
+
+    def get_path(self, key: str) -> str:
+        """Returns the path of the object's file, creating its directory."""
+        file_path = path.join(self.directory, *key.split('/'))
+        makedirs(path.dirname(file_path), exist_ok=True)
+        return file_path
+
+    def put_object(self, Body, Bucket, Key, **kwargs) -> dict:
+        """Writes the object's file."""
+        body = Body.encode() if isinstance(Body, str) else bytes(Body)
+        with open(self.get_path(Key), 'wb') as object_file:
+            object_file.write(body)
+        return {'ETag': f'"{hashlib.md5(body).hexdigest()}"'}
+
+    def get_object(self, Bucket, Key, **kwargs) -> dict:
+        """Returns the object's file, raising the error s3 would if there isn't one."""
+        file_path = path.join(self.directory, *Key.split('/'))
+        if not path.exists(file_path):
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        with open(file_path, 'rb') as object_file:
+            body = object_file.read()
+        return {'Body': BytesIO(body), 'ETag': f'"{hashlib.md5(body).hexdigest()}"'}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs) -> dict:
+        """Starts writing the object to a temporary file beside it."""
+        upload_id = str(self.next_upload_id)
+        self.next_upload_id += 1
+        # Closed once the upload is completed or aborted
+        self.uploads[upload_id] = open(  # pylint: disable=consider-using-with
+            f'{self.get_path(Key)}.upload', 'wb')
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Body, Bucket, Key, PartNumber, UploadId) -> dict:
+        """Appends the part to the object's temporary file."""
+        self.uploads[UploadId].write(Body)
+        return {'ETag': f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload) -> dict:
+        """Moves the temporary file into place; returns an ETag like s3's for multipart objects."""
+        upload_file = self.uploads.pop(UploadId)
+        upload_file.close()
+        shutil.move(upload_file.name, self.get_path(Key))
+        parts = MultipartUpload['Parts']
+        digests = b''.join(bytes.fromhex(part['ETag'].strip('"')) for part in parts)
+        return {'ETag': f'"{hashlib.md5(digests).hexdigest()}-{len(parts)}"'}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId) -> dict:
+        """Deletes the temporary file."""
+        upload_file = self.uploads.pop(UploadId)
+        upload_file.close()
+        remove(upload_file.name)
+        return {}
+
+
+def get_times(start: datetime, end: datetime, step_minutes: int) -> pd.DatetimeIndex:
+    """Returns the times of the readings from start up to end."""
+    return pd.date_range(start, end, freq=f'{step_minutes}min', inclusive='left')
+
+
+def get_chunks(model: PlantModel, start: datetime, end: datetime, origin: datetime,
+               step_minutes: int, chunk_rows: int, plant_major: bool):
+    """
+    Yields the recordings and watering events of every plant from start up to end as chunks of
+    about chunk_rows recordings, in the table's shapes. With plant_major, chunks cover a few plants
+    over the whole span (so rows come sorted by plant and time, as archive files are); otherwise
+    every plant over a few times (so rows come in time order, as they're inserted). Recording ids
+    are those the rows would get if every reading since origin had been inserted in time order;
+    watering events aren't given ids yet.
+    """
+    times = get_times(start, end, step_minutes)
+    if times.empty:
+        return
+    first_step = (times[0] - pd.Timestamp(origin)) // pd.Timedelta(minutes=step_minutes)
+
+    if plant_major:
+        plants_per_chunk = max(1, chunk_rows // len(times))
+        spans = [(np.arange(first, min(first + plants_per_chunk, model.plants)), slice(None))
+                 for first in range(0, model.plants, plants_per_chunk)]
+    else:
+        times_per_chunk = max(1, chunk_rows // model.plants)
+        spans = [(np.arange(model.plants), slice(first, first + times_per_chunk))
+                 for first in range(0, len(times), times_per_chunk)]
+
+    for plant_ids, time_slice in spans:
+        chunk_times = times[time_slice]
+        temperature, moisture, watered = model.simulate(plant_ids, chunk_times, step_minutes)
+        steps = first_step + np.arange(len(times))[time_slice]
+        # Arrays are plants x times; ravelling them in Fortran order puts rows in time order
+        order = 'C' if plant_major else 'F'
+        ids = 1 + steps[None, :] * model.plants + plant_ids[:, None]
+        plant_grid = np.broadcast_to(plant_ids[:, None], ids.shape)
+        datetimes = (chunk_times.to_numpy()[None, :]
+                     + model.second_offset[plant_ids, None]).astype('datetime64[us]')
+
+        recordings = pd.DataFrame({'id': ids.ravel(order),
+                                   'plant_id': plant_grid.ravel(order),
+                                   'soil_moisture': moisture.ravel(order),
+                                   'temperature': temperature.ravel(order),
+                                   'datetime': np.broadcast_to(datetimes, ids.shape).ravel(order)})
+        waterings = recordings.loc[watered.ravel(order), ['plant_id', 'datetime']]
+        yield recordings, waterings.reset_index(drop=True)
+
+
+def number_waterings(waterings: list[pd.DataFrame], first_id: int) -> pd.DataFrame:
+    """Returns the watering events joined, with ids in time order from first_id."""
+    df = pd.concat(waterings, ignore_index=True) if waterings else pd.DataFrame(
+        columns=WATERING_COLUMNS[1:])
+    df = df.sort_values(['datetime', 'plant_id'], ignore_index=True)
+    df.insert(0, 'id', np.arange(first_id, first_id + len(df)))
+    return df
+
+
+def write_archive_file(s3_client, bucket_name: str, key: str, chunks,
+                       rollup_writers: dict = None) -> dict:
+    """
+    Streams the chunks (sorted by plant and time) to the key as one archive file, as compaction
+    writes month files (streaming their rollups to rollup_writers, if given); returns its manifest
+    entry, or None if there were no rows.
+    """
+    datetime_range = []
+    writer = compaction.ArchiveFileWriter(s3_client, bucket_name, key)
+    chunks = compaction.track_datetime_range(chunks, datetime_range)
+    if rollup_writers is not None:
+        chunks = rollups.track_rollups(chunks, rollup_writers)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+        writer.close()
+    except Exception as e:
+        writer.abort()
+        raise e
+
+    if not writer.rows:
+        writer.abort()
+        return None
+    etag = writer.complete()
+    indexed = archive_files.save_plant_offsets(s3_client, bucket_name, key, etag,
+                                               writer.plant_offsets)
+    return manifest.get_file_entry(key, writer.rows, writer.tell(), etag, *datetime_range,
+                                   indexed)
+
+
+def get_archive_spans(start: datetime, end: datetime, part_start: datetime):
+    """
+    Yields the (start, end, whether it's a part file's) spans the archive is written in: a month
+    file's span for each month up to part_start, then an hourly part file's for each hour after.
+    """
+    span_start = start
+    while span_start < part_start:
+        month_start = span_start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        span_end = min((month_start + timedelta(days=32)).replace(day=1), part_start)
+        yield span_start, span_end, False
+        span_start = span_end
+    while span_start < end:
+        hour_start = span_start.replace(minute=0, second=0, microsecond=0)
+        span_end = min(hour_start + timedelta(hours=1), end)
+        yield span_start, span_end, True
+        span_start = span_end
+
+
+def write_archive(s3_client, bucket_name: str, model: PlantModel, start: datetime, end: datetime,
+                  part_days: int, step_minutes: int, chunk_rows: int, archive_format: str,
+                  with_rollups: bool = False) -> dict:
+    """
+    Writes the plants' recordings and waterings from start up to end to the archive in the given
+    format, adding the files to its manifest; returns the manifest entries written, by key.
+    """
+    environ['ARCHIVE_FORMAT'] = archive_format  # Which rollup files are written in
+    entries = {}
+    watering_id = 1
+    part_start = max(start, end - timedelta(days=part_days))
+    for span_start, span_end, is_part in get_archive_spans(start, end, part_start):
+        if is_part:
+            run_time = span_end + ARCHIVE_DELAY
+            folder = f'{span_start.year}/{span_start.month}'
+            keys = {data_type: f'{folder}/{data_type}_{span_start.day}/'
+                               f'{run_time:%Y%m%d%H%M%S%f}.{archive_format}'
+                    for data_type in ('recording', 'watering')}
+        else:
+            version = s3_data_management.get_version()
+            keys = {data_type: s3_data_management.get_month_key(
+                        f'{span_start.year}/{span_start.month}', data_type, archive_format, version)
+                    for data_type in ('recording', 'watering')}
+
+        waterings = []
+        rollup_writers = None
+        if with_rollups and not is_part:
+            rollup_writers = s3_data_management.open_rollup_writers(
+                s3_client, 'recording', span_start.year, span_start.month, bucket_name, version)
+
+        def get_recording_chunks(span_start=span_start, span_end=span_end, waterings=waterings):
+            for recordings, chunk_waterings in get_chunks(model, span_start, span_end, start,
+                                                          step_minutes, chunk_rows, True):
+                waterings.append(chunk_waterings)
+                yield recordings
+
+        recording_entry = write_archive_file(s3_client, bucket_name, keys['recording'],
+                                             get_recording_chunks(), rollup_writers)
+        if recording_entry:
+            entries[keys['recording']] = recording_entry
+        waterings = number_waterings(waterings, watering_id)
+        watering_id += len(waterings)
+        watering_entry = write_archive_file(
+            s3_client, bucket_name, keys['watering'],
+            iter([waterings.sort_values(archive_files.SORT_COLUMNS, ignore_index=True)]))
+        if watering_entry:
+            entries[keys['watering']] = watering_entry
+
+        if rollup_writers and recording_entry:
+            entries.update(s3_data_management.save_rollups(s3_client, rollup_writers,
+                                                           recording_entry, bucket_name))
+        if not is_part or span_end.hour == 0 or span_end == end:
+            print(f"Wrote the archive up to {span_end:%Y-%m-%d %H:%M}.", file=sys.stderr)
+
+    manifest.update_manifest(s3_client, bucket_name, added=entries)
+    return entries
+
+
+def write_database_tables(output_dir: str, model: PlantModel, start: datetime, end: datetime,
+                          step_minutes: int, chunk_rows: int) -> dict:
+    """
+    Writes the plants' recordings and waterings from start up to end as csv files of the
+    recording, watering and latest_recording tables in output_dir; returns the rows of each.
+    """
+    makedirs(output_dir, exist_ok=True)
+    rows = {'recording': 0, 'watering': 0, 'latest_recording': 0}
+    latest = None
+    with open(path.join(output_dir, 'recording.csv'), 'w', encoding='utf-8') as recording_file, \
+         open(path.join(output_dir, 'watering.csv'), 'w', encoding='utf-8') as watering_file:
+        for recordings, waterings in get_chunks(model, start, end, start, step_minutes,
+                                                chunk_rows, False):
+            recordings.to_csv(recording_file, index=False, header=not rows['recording'],
+                              date_format=archive_files.CSV_DATETIME_FORMAT)
+            waterings = number_waterings([waterings], rows['watering'] + 1)
+            waterings.to_csv(watering_file, index=False, header=not rows['watering'],
+                             date_format=archive_files.CSV_DATETIME_FORMAT)
+            rows['recording'] += len(recordings)
+            rows['watering'] += len(waterings)
+            # Each chunk holds every plant, so its last rows are the latest of each
+            latest = recordings.drop_duplicates('plant_id', keep='last')
+
+    if latest is not None:
+        latest = latest.drop(columns='id').sort_values('plant_id')
+        latest.to_csv(path.join(output_dir, 'latest_recording.csv'), index=False,
+                      date_format=archive_files.CSV_DATETIME_FORMAT)
+        rows['latest_recording'] = len(latest)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--target', choices=['archive', 'database'], default='archive')
+    parser.add_argument('--plants', type=int, default=DEFAULT_PLANTS)
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS)
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        help='when the readings end (by default, the start of today)')
+    parser.add_argument('--step-minutes', type=int, default=DEFAULT_STEP_MINUTES,
+                        help='minutes between the readings of a plant')
+    parser.add_argument('--part-days', type=int, default=0,
+                        help='last days of the archive to write as hourly part files')
+    parser.add_argument('--format', choices=archive_files.ARCHIVE_FORMATS, default='csv')
+    parser.add_argument('--rollups', action='store_true',
+                        help='write the rollup files of every month file too')
+    parser.add_argument('--bucket', help='bucket to write the archive to, rather than a directory')
+    parser.add_argument('--output-dir', default='mock_data',
+                        help='directory to write the archive or table files to')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help='rows generated at a time, which sets the memory used')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+
+    end_time = args.end or datetime.combine(datetime.today(), datetime.min.time())
+    start_time = end_time - timedelta(days=args.days)
+    plant_model = PlantModel(args.plants, args.seed)
+
+    if args.target == 'database':
+        written = write_database_tables(args.output_dir, plant_model, start_time, end_time,
+                                        args.step_minutes, args.chunk_rows)
+        print(f"Wrote {written} rows to {args.output_dir}.")
+    else:
+        if args.bucket:
+            client, bucket = s3_data_management.create_s3_client(), args.bucket
+        else:
+            client, bucket = LocalBucketClient(args.output_dir), args.output_dir
+        written = write_archive(client, bucket, plant_model, start_time, end_time,
+                                args.part_days, args.step_minutes, args.chunk_rows, args.format,
+                                args.rollups)
+        print(f"Wrote {len(written)} files to {bucket}.")
@@ -0,0 +1,286 @@
+"""
+Contains the offline stand-ins the benchmarks run the pipelines and dashboard against, so no AWS,
+database or plant API access is needed, and the measurements they take of each stage.
+
+- FakeS3Client: an in-memory bucket, answering the s3 calls the pipelines and dashboard make, with
+  an optional latency added to each request and bandwidth limit to each download (also used by
+  dashboard/benchmark_s3_extraction.py).
+- StubPlantAPI: a local HTTP server answering /plants/{id} like the plant API, for any number of
+  plants.
+- create_sqlite_engine: an in-memory SQLite database with the tables of tables.py. SQLite can't
+  name the columns of a VALUES clause, so (only here) VALUES sources are compiled as a SELECT of
+  one, leaving the statements load.py builds unchanged.
+"""
+
+import asyncio
+from datetime import datetime
+from io import BytesIO
+import json
+from os import environ, path
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+from aiohttp import web
+from botocore.exceptions import ClientError
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql.expression import Values
+
+
+REPO_ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+BUCKET_NAME = 'benchmark'
+API_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+API_WATERED_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+PERCENTILES = (50, 95, 99)
+
+
+def use_component(component: str) -> None:
+    """
+    Makes the modules of a component directory (minute_pipeline, daily_pipeline or dashboard)
+    importable, with the environment they expect at import time.
+    """
+    sys.path.insert(0, path.join(REPO_ROOT, component))
+    environ.setdefault('BUCKET_NAME', BUCKET_NAME)
+    environ.setdefault('DB_SCHEMA', 'main')
+
+
+class FakeS3Client:
+    """In-memory stand-in for an s3 client, optionally slowing each request down like a real one."""
+
+    def __init__(self, latency: float = 0, bandwidth: float = None) -> None:
+        self.objects = {}
+        self.uploads = {}
+        self.latency = latency
+        self.bandwidth = bandwidth  # Bytes per second, per download; None for no limit
+        self.requests = 0
+        self.bytes_read = 0
+
+    def wait(self) -> None:
+        """Counts a request, sleeping for the latency first."""
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_body(self, key: str) -> bytes:
+        """Returns the stored object, raising the error s3 would if there isn't one."""
+        if key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return self.objects[key]
+
+    def put_object(self, Body, Bucket, Key, **kwargs) -> dict:
+        """Stores the object."""
+        self.wait()
+        self.objects[Key] = Body.encode() if isinstance(Body, str) else bytes(Body)
+        return {'ETag': f'"{hash(self.objects[Key])}"'}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None) -> dict:
+        """
+        Returns the object, or the given byte range of it, once it would have downloaded, raising
+        the error s3 would if it no longer has the ETag given.
+        """
+        self.wait()
+        body = self.get_body(Key)
+        if IfMatch is not None and IfMatch != f'"{hash(body)}"':
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'GetObject')
+        if Range:
+            start, end = Range.removeprefix('bytes=').split('-')
+            body = body[int(start):int(end) + 1]
+        if self.bandwidth:
+            time.sleep(len(body) / self.bandwidth)
+        self.bytes_read += len(body)
+        return {'Body': BytesIO(body), 'ETag': f'"{hash(self.objects[Key])}"',
+                'ContentLength': len(body)}
+
+    def head_object(self, Bucket, Key) -> dict:
+        """Returns the object's size."""
+        self.wait()
+        return {'ContentLength': len(self.get_body(Key))}
+
+    def delete_object(self, Bucket, Key) -> dict:
+        """Deletes the object, if there is one."""
+        self.wait()
+        self.objects.pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete) -> dict:
+        """Deletes the objects listed."""
+        self.wait()
+        for obj in Delete['Objects']:
+            self.objects.pop(obj['Key'], None)
+        return {}
+
+    def list_objects(self, Bucket, Prefix='', Marker='') -> dict:
+        """Lists the keys with the prefix after the marker, all in one page."""
+        self.wait()
+        return {'Contents': [{'Key': key} for key in sorted(self.objects)
+                             if key.startswith(Prefix) and key > Marker],
+                'IsTruncated': False}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs) -> dict:
+        """Starts a multipart upload."""
+        self.wait()
+        upload_id = str(len(self.uploads))
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Body, Bucket, Key, PartNumber, UploadId) -> dict:
+        """Stores a part of a multipart upload."""
+        self.wait()
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload) -> dict:
+        """Joins the parts of a multipart upload into the object."""
+        parts = self.uploads.pop(UploadId)
+        return self.put_object(b''.join(parts[part['PartNumber']]
+                                        for part in MultipartUpload['Parts']), Bucket, Key)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId) -> dict:
+        """Drops the parts of a multipart upload."""
+        self.uploads.pop(UploadId, None)
+        return {}
+
+
+class StubPlantAPI:
+    """
+    Local HTTP server answering /plants/{id} with a reading in the plant API's format, on its own
+    thread; use as a context manager, with url as extract.BASE_URL.
+    """
+
+    def __init__(self, latency: float = 0) -> None:
+        self.latency = latency
+        self.url = None
+        self.loop = asyncio.new_event_loop()
+        self.runner = None
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    async def get_plant(self, request: web.Request) -> web.Response:
+        """Answers with a reading of the plant asked for."""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        plant_id = int(request.match_info['plant_id'])
+        now = datetime.now()
+        return web.json_response({
+            'plant_id': plant_id, 'name': f'Plant {plant_id}',
+            'soil_moisture': 20 + plant_id % 60 + np.random.random(),
+            'temperature': 10 + plant_id % 10 + np.random.random(),
+            'recording_taken': now.strftime(API_TIME_FORMAT),
+            'last_watered': now.replace(hour=13, minute=0, second=0).strftime(API_WATERED_FORMAT)})
+
+    async def start(self) -> None:
+        """Starts the server on a free port."""
+        app = web.Application()
+        app.router.add_get('/plants/{plant_id}', self.get_plant)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f'http://127.0.0.1:{port}/plants/'
+
+    def __enter__(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.start(), self.loop).result()
+        return self
+
+    def __exit__(self, *args):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        return False
+
+
+@compiles(Values, 'sqlite')
+def compile_values_for_sqlite(element, compiler, **kw):
+    """Compiles a named VALUES clause as a SELECT of one, naming its columns as SQLite can't."""
+    values = compiler.visit_values(element, **kw).rpartition(' AS ')[0]
+    columns = ', '.join(f'column{number} AS {column.name}'
+                        for number, column in enumerate(element.columns, 1))
+    return f'(SELECT {columns} FROM {values}) AS {element.name}'
+
+
+def create_sqlite_engine(metadata: db.MetaData) -> db.Engine:
+    """Returns an engine of a new in-memory SQLite database holding the tables of the metadata."""
+    engine = db.create_engine('sqlite://', poolclass=StaticPool,
+                              connect_args={'check_same_thread': False})
+    metadata.create_all(engine)
+    return engine
+
+
+def get_latency_stats(seconds: list[float]) -> dict:
+    """Returns the mean, percentiles and maximum of the latencies, in milliseconds."""
+    milliseconds = np.array(seconds) * 1000
+    stats = {'mean': float(milliseconds.mean())}
+    for percentile in PERCENTILES:
+        stats[f'p{percentile}'] = float(np.percentile(milliseconds, percentile))
+    stats['max'] = float(milliseconds.max())
+    return {key: round(value, 3) for key, value in stats.items()}
+
+
+def measure(run, rows: int, repeats: int, setup=None) -> dict:
+    """
+    Times repeats runs of run(state) (state being what setup returns, fresh for every run, and
+    not timed), then runs it once more under tracemalloc for its peak memory. Returns the latency
+    stats, the throughput (rows a second at the median latency) and the peak memory (of Python
+    and numpy allocations).
+    """
+    seconds = []
+    for _ in range(repeats):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        run(state)
+        seconds.append(time.perf_counter() - start)
+
+    state = setup() if setup else None
+    tracemalloc.start()
+    try:
+        run(state)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(seconds)
+    return {'rows': rows, 'repeats': repeats, 'latency_ms': get_latency_stats(seconds),
+            'throughput_rows_per_s': round(rows / median, 1) if median else None,
+            'peak_memory_bytes': peak_memory}
+
+
+def get_result(component: str, stage: str, scale: dict, measurement: dict) -> dict:
+    """Returns a benchmark result, identified by its component, stage and scale."""
+    return {'component': component, 'stage': stage, 'scale': scale, **measurement}
+
+
+def write_results(results: list[dict], json_path: str = None) -> None:
+    """Writes the results as JSON to the given path, or prints them."""
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as json_file:
+            json.dump(results, json_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+def get_int_list(text: str) -> list[int]:
+    """Returns the integers of a comma separated argument."""
+    return [int(value) for value in text.split(',')]
+
+
+def get_recordings(start: datetime, end: datetime, plants: int, step_minutes: int,
+                   first_id: int = 1) -> pd.DataFrame:
+    """
+    Returns generated recordings of every plant from start up to end, one every step_minutes, in
+    the shape of the recording table (ordered by time, as they're inserted).
+    """
+    times = pd.date_range(start, end, freq=f'{step_minutes}min', inclusive='left')
+    rows = plants * len(times)
+    rng = np.random.default_rng(len(times) + plants)
+    return pd.DataFrame({'id': np.arange(first_id, first_id + rows),
+                         'plant_id': np.tile(np.arange(plants), len(times)),
+                         'soil_moisture': rng.uniform(15, 100, rows).round(4),
+                         'temperature': rng.uniform(10, 20, rows).round(4),
+                         'datetime': np.repeat(times, plants)})
@@ -0,0 +1,137 @@
+"""
+Script to run every component's benchmarks (each in its own process, as the components' modules
+share names) and save their results together to results/{label}.json, with the commit and machine
+they were measured on; or to compare two saved runs.
+
+    python run_benchmarks.py --label before
+    python run_benchmarks.py --label after --plants 51,1000
+    python run_benchmarks.py --compare before after
+"""
+
+import argparse
+from datetime import datetime
+import json
+from os import makedirs, path
+import platform
+import subprocess
+import sys
+import tempfile
+
+from offline import REPO_ROOT
+
+
+BENCHMARKS_DIRECTORY = path.dirname(path.abspath(__file__))
+RESULTS_DIRECTORY = path.join(BENCHMARKS_DIRECTORY, 'results')
+BENCHMARKS = {'minute_pipeline': 'bench_minute.py', 'daily_pipeline': 'bench_daily.py',
+              'dashboard': 'bench_dashboard.py'}
+
+
+def get_git_commit() -> str:
+    """Returns the commit the repository is at, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(script: str, arguments: list[str]) -> list[dict]:
+    """Runs a component's benchmark script with the given arguments; returns its results."""
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = path.join(directory, 'results.json')
+        subprocess.run([sys.executable, path.join(BENCHMARKS_DIRECTORY, script), *arguments,
+                        '--json', json_path], check=True)
+        with open(json_path, encoding='utf-8') as json_file:
+            return json.load(json_file)
+
+
+def get_component_arguments(args: argparse.Namespace) -> dict:
+    """Returns the arguments each component's benchmark script is run with."""
+    arguments = {'minute_pipeline': [], 'daily_pipeline': [], 'dashboard': []}
+    if args.plants:
+        arguments['minute_pipeline'] += ['--plants', args.plants]
+        arguments['dashboard'] += ['--window-plants', args.plants]
+    if args.archive_plants:
+        arguments['daily_pipeline'] += ['--plants', args.archive_plants]
+        arguments['dashboard'] += ['--archive-plants', args.archive_plants]
+    if args.spans:
+        arguments['daily_pipeline'] += ['--spans', args.spans]
+        arguments['dashboard'] += ['--spans', args.spans]
+    if args.format:
+        arguments['daily_pipeline'] += ['--format', args.format]
+        arguments['dashboard'] += ['--format', args.format]
+    if args.repeats:
+        for component_arguments in arguments.values():
+            component_arguments += ['--repeats', str(args.repeats)]
+    return arguments
+
+
+def run_benchmarks(args: argparse.Namespace) -> dict:
+    """Runs the chosen components' benchmarks; returns their results, with the run's metadata."""
+    arguments = get_component_arguments(args)
+    results = []
+    for component in args.components:
+        print(f"Benchmarking {component}...", file=sys.stderr)
+        results += run_benchmark(BENCHMARKS[component], arguments[component])
+    return {'label': args.label, 'created_at': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': get_git_commit(), 'python': platform.python_version(),
+            'platform': platform.platform(), 'results': results}
+
+
+def get_result_key(result: dict) -> tuple:
+    """Returns what identifies a result across runs: its component, stage and scale."""
+    return (result['component'], result['stage'], json.dumps(result['scale'], sort_keys=True))
+
+
+def print_comparison(baseline: dict, run: dict) -> None:
+    """
+    Prints how each result of the run compares with the same result of the baseline: the ratio of
+    their median latencies (above 1 is slower), throughputs and peak memories.
+    """
+    baseline_results = {get_result_key(result): result for result in baseline['results']}
+    print(f"{'component':<16}{'stage':<24}{'scale':<64}{'p50':>8}{'rows/s':>8}{'memory':>8}")
+    for result in run['results']:
+        base = baseline_results.get(get_result_key(result))
+        if base is None:
+            continue
+        scale = ' '.join(f'{key}={value}' for key, value in result['scale'].items())
+        p50 = result['latency_ms']['p50'] / max(base['latency_ms']['p50'], 1e-3)
+        throughput = (result['throughput_rows_per_s'] or 0) / max(
+            base['throughput_rows_per_s'] or 0, 1e-3)
+        memory = result['peak_memory_bytes'] / max(base['peak_memory_bytes'], 1)
+        print(f"{result['component']:<16}{result['stage']:<24}{scale:<64}"
+              f"{p50:>7.2f}x{throughput:>7.2f}x{memory:>7.2f}x")
+
+
+def load_run(label: str) -> dict:
+    """Returns the saved run with the given label."""
+    with open(path.join(RESULTS_DIRECTORY, f'{label}.json'), encoding='utf-8') as run_file:
+        return json.load(run_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--label', help='name to save the run under')
+    parser.add_argument('--components', type=lambda text: text.split(','),
+                        default=list(BENCHMARKS),
+                        help=f'comma separated components to benchmark, of {list(BENCHMARKS)}')
+    parser.add_argument('--plants', help='comma separated numbers of plants sending readings')
+    parser.add_argument('--archive-plants', help='comma separated numbers of plants archived')
+    parser.add_argument('--spans', help='comma separated spans of archive, e.g. 1d,1m,12m')
+    parser.add_argument('--format', choices=['csv', 'parquet'])
+    parser.add_argument('--repeats', type=int)
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'RUN'),
+                        help='labels of two saved runs to compare, instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        print_comparison(*[load_run(label) for label in args.compare])
+    elif not args.label:
+        parser.error('--label is required to run the benchmarks')
+    else:
+        run = run_benchmarks(args)
+        makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        with open(path.join(RESULTS_DIRECTORY, f'{args.label}.json'), 'w',
+                  encoding='utf-8') as run_file:
+            json.dump(run, run_file, indent=2)
+        print(f"Saved {len(run['results'])} results to results/{args.label}.json.")
@@ -0,0 +1,321 @@
+"""
+Contains code to write and read the files of the s3 archive, either as csv or as typed, compressed
+parquet. New files are written in the format named by the ARCHIVE_FORMAT environment variable
+(csv unless set); existing files are read in the format of their key's extension, so the bucket can
+hold both while it moves over.
+
+Parquet files are written sorted by plant and time, so the row group statistics on plant_id and
+datetime let readers skip the row groups (and columns) a query doesn't need. Csv files are written
+sorted the same way, with the byte range of each plant's rows kept in an index object beside the
+file ({key}.index.json; its manifest entry is only marked as indexed, keeping the manifest small),
+so readers after a few plants can fetch just their rows with ranged requests.
+"""
+
+import io
+import json
+from os import environ
+
+from botocore.exceptions import ClientError
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+ARCHIVE_FORMATS = ('csv', 'parquet')
+DEFAULT_ARCHIVE_FORMAT = 'csv'
+DEFAULT_PARQUET_COMPRESSION = 'zstd'
+ROW_GROUP_SIZE = 50000  # About a month of one plant's recordings
+ARCHIVE_COLUMN_TYPES = {
+    'id': pa.int64(),
+    'plant_id': pa.int64(),
+    'soil_moisture': pa.float64(),
+    'temperature': pa.float64(),
+    'datetime': pa.timestamp('us')
+}
+# How csv files are parsed; naming the types up front saves pandas inferring them per chunk
+CSV_DTYPES = {'id': 'int64', 'plant_id': 'int64', 'soil_moisture': 'float64',
+              'temperature': 'float64'}
+CSV_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+SORT_COLUMNS = ['plant_id', 'datetime']
+# S3 metadata marking csv files written sorted by SORT_COLUMNS (parquet files always are)
+SORTED_METADATA = {'sort-order': 'plant_id,datetime'}
+INDEX_SUFFIX = '.index.json'
+
+
+def get_archive_format() -> str:
+    """Returns the format new archive files are written in, from ARCHIVE_FORMAT."""
+    archive_format = (environ.get('ARCHIVE_FORMAT') or DEFAULT_ARCHIVE_FORMAT).lower()
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format: {archive_format}")
+    return archive_format
+
+
+def get_parquet_compression() -> str:
+    """Returns the codec parquet files are compressed with, from PARQUET_COMPRESSION."""
+    return environ.get('PARQUET_COMPRESSION') or DEFAULT_PARQUET_COMPRESSION
+
+
+def get_key_format(key: str) -> str:
+    """Returns the format of the archive file with the given key, from its extension."""
+    return key.split('.')[-1]
+
+
+def is_sorted_file(key: str, metadata: dict) -> bool:
+    """Returns whether the archive file with the given key and s3 metadata is sorted."""
+    return (get_key_format(key) == 'parquet'
+            or metadata.get('sort-order') == SORTED_METADATA['sort-order'])
+
+
+def parse_csv_datetimes(datetimes: pd.Series) -> pd.Series:
+    """
+    Returns the csv datetime strings as datetimes, using the format the pipelines write them in,
+    and falling back to any ISO 8601 format for files (or rows) written otherwise.
+    """
+    try:
+        return pd.to_datetime(datetimes, format=CSV_DATETIME_FORMAT)
+    except ValueError:
+        return pd.to_datetime(datetimes, format='ISO8601')
+
+
+def get_typed_table(df: pd.DataFrame) -> pa.Table:
+    """
+    Returns the archive columns of the dataframe as an arrow table with fixed column types, sorted
+    by plant and time; columns which aren't archived (such as a saved index) are dropped.
+    """
+    schema = pa.schema([(name, column_type) for name, column_type in ARCHIVE_COLUMN_TYPES.items()
+                        if name in df.columns])
+    df = df[schema.names].copy()
+
+    if 'datetime' in df.columns:
+        # Csv files hold times as text; offsets (if any) are dropped to leave UTC wall times
+        df['datetime'] = pd.to_datetime(df['datetime'], format='ISO8601',
+                                        utc=True).dt.tz_convert(None)
+    sort_columns = [column for column in SORT_COLUMNS if column in df.columns]
+    if sort_columns:
+        df = df.sort_values(sort_columns)
+
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False, safe=False)
+
+
+def get_file_body(df: pd.DataFrame, archive_format: str = None):
+    """Returns the body of an archive file holding the dataframe, in the given format."""
+    archive_format = archive_format or get_archive_format()
+
+    if archive_format == 'csv':
+        return df.to_csv(index=False)
+
+    buffer = io.BytesIO()
+    pq.write_table(get_typed_table(df), buffer, row_group_size=ROW_GROUP_SIZE,
+                   compression=get_parquet_compression())
+    return buffer.getvalue()
+
+
+def get_indexed_csv_body(df: pd.DataFrame, plant_offsets: dict, header: bool = True,
+                         position: int = 0) -> bytes:
+    """
+    Returns the dataframe (sorted by plant) as csv, adding the byte range ([start, end)) of each
+    plant's rows to plant_offsets, by plant id as text; position is where in the file the body will
+    start, so a file can be written a chunk at a time, extending the ranges of plants which run on
+    from the chunk before.
+    """
+    body = [df.iloc[:0].to_csv(index=False).encode()] if header else []
+    position += len(body[0]) if header else 0
+
+    for plant_id, plant_df in df.groupby('plant_id', sort=False):
+        plant_body = plant_df.to_csv(index=False, header=False).encode()
+        start = plant_offsets.get(str(plant_id), [position])[0]
+        plant_offsets[str(plant_id)] = [start, position + len(plant_body)]
+        position += len(plant_body)
+        body.append(plant_body)
+
+    return b''.join(body)
+
+
+def get_index_key(key: str) -> str:
+    """Returns the key of the index object holding the plant offsets of the file with the key."""
+    return f'{key}{INDEX_SUFFIX}'
+
+
+def save_plant_offsets(s3_client, bucket_name: str, key: str, etag: str,
+                       plant_offsets: dict) -> bool:
+    """
+    Writes the plant offsets of the file with the given key and ETag (see get_indexed_csv_body) to
+    its index object, if it has any; returns whether it did, i.e. whether the file is indexed. The
+    index is written before the file's manifest entry, so readers never find it missing.
+    """
+    if not plant_offsets:
+        return False
+    s3_client.put_object(Body=json.dumps({'etag': etag, 'plant_offsets': plant_offsets}),
+                         Bucket=bucket_name, Key=get_index_key(key),
+                         ContentType='application/json')
+    return True
+
+
+def load_plant_offsets(s3_client, bucket_name: str, key: str, etag: str = None) -> dict:
+    """
+    Returns the plant offsets from the index object of the file with the given key, or None if it
+    has no index, or (given the file's ETag) the index belongs to another version of the file.
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=get_index_key(key))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise e
+    index = json.loads(response['Body'].read())
+    if etag and index['etag'] != etag:
+        return None
+    return index['plant_offsets']
+
+
+def get_condition(etag: str = None) -> dict:
+    """
+    Returns the arguments making a GET conditional on the object still having the given ETag (from
+    its manifest entry), so a replaced object raises a ClientError (PreconditionFailed).
+    """
+    return {'IfMatch': etag} if etag else {}
+
+
+def get_filter_plant_ids(filters: list[tuple]) -> list:
+    """Returns the plant ids the filters keep rows of, or None if they don't filter on plant."""
+    for column, operator, value in filters or []:
+        if column == 'plant_id' and operator in ('=', '=='):
+            return [value]
+        if column == 'plant_id' and operator == 'in':
+            return list(value)
+    return None
+
+
+def read_csv_plant_ranges(s3_client, key: str, bucket_name: str, plant_offsets: dict,
+                          plant_ids: list, etag: str = None) -> bytes:
+    """
+    Returns the header and the rows of just the given plants of an indexed csv file, downloading
+    only their byte ranges (adjoining ranges in one request).
+    """
+    ranges = [[0, min(start for start, _ in plant_offsets.values())]]
+    for start, end in sorted(plant_offsets[str(plant_id)] for plant_id in plant_ids
+                             if str(plant_id) in plant_offsets):
+        if start <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+
+    return b''.join(
+        s3_client.get_object(Bucket=bucket_name, Key=key, Range=f'bytes={start}-{end - 1}',
+                             **get_condition(etag))['Body'].read()
+        for start, end in ranges if end > start)
+
+
+class S3RangeFile(io.RawIOBase):
+    """
+    Read-only, seekable file over an s3 object which only downloads the byte ranges read from it, so
+    parquet readers can fetch a file's footer and then just the column chunks they need. Given the
+    object's ETag, every read is conditional on it, so the ranges can't come from different objects.
+    """
+
+    def __init__(self, s3_client, bucket_name: str, key: str, size: int = None,
+                 etag: str = None) -> None:
+        """Opens the object, finding its size if it isn't given."""
+        super().__init__()
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.etag = etag
+        self.size = size if size is not None else s3_client.head_object(
+            Bucket=bucket_name, Key=key)['ContentLength']
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Moves to the given offset, from the start, current position or end of the object."""
+        start = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = start + offset
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        """Reads up to the length of the buffer from the current position with one ranged GET."""
+        if self.position >= self.size or not len(buffer):
+            return 0
+
+        end = min(self.position + len(buffer), self.size) - 1
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.key,
+                                             Range=f'bytes={self.position}-{end}',
+                                             **get_condition(self.etag))
+        data = response['Body'].read()
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def filter_df(df: pd.DataFrame, filters: list[tuple]) -> pd.DataFrame:
+    """
+    Returns the rows of the dataframe matching every (column, operator, value) filter, the same as
+    parquet reads are filtered.
+    """
+    operators = {'=': 'eq', '==': 'eq', '!=': 'ne', '<': 'lt', '<=': 'le', '>': 'gt', '>=': 'ge'}
+    for column, operator, value in filters or []:
+        if operator == 'in':
+            df = df[df[column].isin(value)]
+        else:
+            df = df[getattr(df[column], operators[operator])(value)]
+    return df
+
+
+def read_archive_file(s3_client, key: str, bucket_name: str, columns: list[str] = None,
+                      filters: list[tuple] = None, ranged: bool = False, size: int = None,
+                      indexed: bool = False, etag: str = None) -> pd.DataFrame:
+    """
+    Reads the archive file with the given key as a dataframe, keeping only the given columns and
+    the rows matching the filters (as (column, operator, value) tuples, e.g.
+    ('plant_id', '=', 3)). Parquet files skip the row groups the filters rule out; with ranged, only
+    the byte ranges of the columns and row groups needed are downloaded (worth the extra requests
+    for large files, or to read a few plants). Likewise, with ranged and filtering on plant, an
+    indexed csv file (as marked in its manifest entry) has its plant offsets fetched from its index
+    object, and only the rows of the plants filtered on are downloaded. Giving the file's size saves
+    a request to find it, and giving its ETag makes every request conditional on it (see
+    get_condition), so offsets and sizes are never used with another version of the file.
+    """
+    if get_key_format(key) == 'parquet':
+        if ranged:
+            source = S3RangeFile(s3_client, bucket_name, key, size, etag)
+        else:
+            source = pa.BufferReader(s3_client.get_object(Bucket=bucket_name, Key=key,
+                                                          **get_condition(etag))['Body'].read())
+        return pq.read_table(source, columns=columns, filters=filters or None,
+                             pre_buffer=True).to_pandas()
+
+    read_columns = None
+    if columns:
+        read_columns = set(columns) | {column for column, _, _ in filters or []}
+
+    plant_ids = get_filter_plant_ids(filters)
+    plant_offsets = None
+    if ranged and indexed and plant_ids is not None:
+        plant_offsets = load_plant_offsets(s3_client, bucket_name, key, etag)
+    if plant_offsets:
+        body = io.BytesIO(read_csv_plant_ranges(s3_client, key, bucket_name, plant_offsets,
+                                                plant_ids, etag))
+    else:
+        body = s3_client.get_object(Bucket=bucket_name, Key=key, **get_condition(etag))['Body']
+    try:
+        df = pd.read_csv(body, dtype=CSV_DTYPES,
+                         usecols=(lambda column: column in read_columns) if columns else None)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame(columns=columns)
+
+    if 'datetime' in df.columns:
+        df['datetime'] = parse_csv_datetimes(df['datetime'])
+    df = filter_df(df, filters)
+    if columns:
+        # Matching parquet, columns only used by the filters aren't returned
+        df = df[[column for column in columns if column in df.columns]]
+    return df
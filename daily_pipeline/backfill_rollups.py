@@ -0,0 +1,66 @@
+"""
+Script to build the rollup files (see rollups.py) of every month file of recordings in the archive
+which doesn't have them yet, such as months compacted before rollups were added; each month file
+is streamed once, a chunk at a time, and its rollups written out a plant at a time. Months
+compacted from now on get their rollups then.
+"""
+
+from os import environ
+
+from dotenv import load_dotenv
+
+import compaction
+import manifest
+import rollups
+from s3_data_management import (create_s3_client, get_key_day, get_version, open_rollup_writers,
+                                save_rollups, ARCHIVE_COLUMNS)
+
+
+def get_months_without_rollups(archive_manifest: dict, data_type: str) -> dict:
+    """Returns the keys of the month files of data_type with no rollups, by (year, month)."""
+    rollup_months = {rollups.get_rollup_key_month(key)
+                     for key in manifest.get_keys_for_range(
+                         archive_manifest, data_type,
+                         resolution=next(iter(rollups.RESOLUTIONS)))}
+    months = {}
+    for key in manifest.get_keys_for_range(archive_manifest, data_type):
+        parts = key.split('/')
+        # Only month files ({year}/{month}/{data_type}-{version}.{format}), not day or part files
+        if len(parts) == 3 and get_key_day(key) is None:
+            year, month = int(parts[0]), int(parts[1])
+            if (year, month) not in rollup_months:
+                months[(year, month)] = key
+    return months
+
+
+def backfill_rollups(s3_client, bucket_name: str, data_type: str = 'recording') -> list[str]:
+    """Builds the missing rollups of every month; returns the keys of the files written."""
+    archive_manifest, _ = manifest.load_manifest(s3_client, bucket_name)
+    written = []
+
+    for (year, month), key in sorted(get_months_without_rollups(archive_manifest,
+                                                                data_type).items()):
+        rollup_writers = open_rollup_writers(s3_client, data_type, year, month, bucket_name,
+                                             get_version())
+        chunks = compaction.read_sorted_chunks(s3_client, key, bucket_name,
+                                               ARCHIVE_COLUMNS[data_type])
+        try:
+            for _ in rollups.track_rollups(chunks, rollup_writers):
+                pass
+        except Exception as e:
+            for writer in rollup_writers.values():
+                writer.abort()
+            raise e
+
+        entries = save_rollups(s3_client, rollup_writers, archive_manifest['files'][key],
+                               bucket_name)
+        manifest.update_manifest(s3_client, bucket_name, added=entries)
+        written.extend(entries)
+
+    return written
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    written_keys = backfill_rollups(create_s3_client(), environ['BUCKET_NAME'])
+    print(f"Wrote {len(written_keys)} rollup files.")
@@ -0,0 +1,329 @@
+"""
+Contains code to compact archive files (csv or parquet) into a single file, streaming: the inputs,
+each sorted by (plant_id, datetime), are merged a chunk at a time with duplicate rows dropped, and
+the output is written to s3 with a multipart upload. Memory use is set by CHUNK_ROWS per input and
+one PART_SIZE upload part, rather than by the size of the month. The month's rollups are streamed
+out in the same pass, one plant at a time.
+"""
+
+import concurrent.futures
+import io
+import itertools
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+import archive_files
+import manifest
+from metrics import METRICS
+import rollups
+
+
+CHUNK_ROWS = 50000
+PART_SIZE = 8 * 1024 * 1024  # Bytes; every upload part but the last must be at least 5MB
+MAX_DOWNLOAD_WORKERS = 32
+SORT_KEY = ['plant_id', 'datetime']
+
+
+class MultipartUploadWriter(io.RawIOBase):
+    """
+    Write-only file which uploads what's written to it as the parts of an s3 multipart upload,
+    holding at most one part in memory at a time.
+    """
+
+    def __init__(self, s3_client, bucket_name: str, key: str, part_size: int = PART_SIZE) -> None:
+        """Starts a multipart upload to the given key."""
+        super().__init__()
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.upload_id = s3_client.create_multipart_upload(
+            Bucket=bucket_name, Key=key, Metadata=archive_files.SORTED_METADATA)['UploadId']
+        self.buffer = bytearray()
+        self.parts = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def write(self, data) -> int:
+        """Adds the data to the current part, uploading the part once it's big enough."""
+        self.buffer += data
+        self.position += len(data)
+        if len(self.buffer) >= self.part_size:
+            self.upload_part()
+        return len(data)
+
+    def upload_part(self):
+        """Uploads what's been written since the last part as the next part."""
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(Body=bytes(self.buffer), Bucket=self.bucket_name,
+                                              Key=self.key, PartNumber=part_number,
+                                              UploadId=self.upload_id)
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer = bytearray()
+
+    def complete(self) -> str:
+        """
+        Uploads the last part and completes the upload, replacing any object at the key; returns the
+        new object's ETag.
+        """
+        if self.buffer or not self.parts:
+            self.upload_part()
+        response = self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts})
+        return response['ETag']
+
+    def abort(self):
+        """Abandons the upload, leaving any object at the key as it was."""
+        self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key,
+                                              UploadId=self.upload_id)
+
+
+def get_clean_chunk(df: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+    """
+    Returns the chunk with just the given columns (dropping any saved index) and typed datetimes.
+    """
+    df = df.reindex(columns=columns)
+    df['datetime'] = pd.to_datetime(df['datetime'], format='ISO8601', utc=True).dt.tz_convert(None)
+    return df.reset_index(drop=True)
+
+
+def read_sorted_chunks(s3_client, key: str, bucket_name: str, columns: list[str]):
+    """
+    Yields the rows of the archive file with the given key in chunks of at most CHUNK_ROWS rows,
+    sorted by plant and time. Parquet files are read a row group at a time with ranged requests,
+    and sorted csv files streamed; csv files not marked as sorted (from before they were written
+    sorted) are sorted in memory.
+    """
+    if archive_files.get_key_format(key) == 'parquet':
+        parquet_file = pq.ParquetFile(archive_files.S3RangeFile(s3_client, bucket_name, key))
+        file_columns = [column for column in columns if column in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(batch_size=CHUNK_ROWS, columns=file_columns):
+            yield get_clean_chunk(batch.to_pandas(), columns)
+        return
+
+    response = s3_client.get_object(Bucket=bucket_name, Key=key)
+    try:
+        chunks = pd.read_csv(response['Body'], chunksize=CHUNK_ROWS,
+                             usecols=lambda column: column in columns)
+    except pd.errors.EmptyDataError:
+        return
+
+    if not archive_files.is_sorted_file(key, response.get('Metadata', {})):
+        df = get_clean_chunk(pd.concat(chunks), columns).sort_values(SORT_KEY, kind='stable')
+        chunks = (df.iloc[start:start + CHUNK_ROWS] for start in range(0, len(df), CHUNK_ROWS))
+
+    for chunk in chunks:
+        yield get_clean_chunk(chunk, columns)
+
+
+def get_first_key(df: pd.DataFrame) -> tuple:
+    """Returns the (plant_id, datetime) of the first row of a chunk."""
+    return df['plant_id'].iat[0], df['datetime'].iat[0]
+
+
+def get_last_key(df: pd.DataFrame) -> tuple:
+    """Returns the (plant_id, datetime) of the last row of a chunk."""
+    return df['plant_id'].iat[-1], df['datetime'].iat[-1]
+
+
+def is_sorted_chunk(df: pd.DataFrame) -> bool:
+    """Returns whether the rows of the chunk are in (plant_id, datetime) order."""
+    plant_ids = df['plant_id'].to_numpy()
+    datetimes = df['datetime'].to_numpy()
+    return bool(((plant_ids[1:] > plant_ids[:-1]) |
+                 ((plant_ids[1:] == plant_ids[:-1]) & (datetimes[1:] >= datetimes[:-1]))).all())
+
+
+def count_rows_up_to(df: pd.DataFrame, key: tuple) -> int:
+    """Returns how many of the (sorted) chunk's first rows have a (plant_id, datetime) <= key."""
+    plant_id, datetime = key
+    return int(((df['plant_id'] < plant_id) |
+                ((df['plant_id'] == plant_id) & (df['datetime'] <= datetime))).sum())
+
+
+def merge_sorted_chunks(inputs: dict):
+    """
+    Merges the chunks of each input (by name), each sorted by (plant_id, datetime), yielding sorted
+    chunks with the duplicates of any (plant_id, datetime) dropped. Raises a ValueError if an input
+    turns out not to be sorted.
+    """
+    iterators = {name: iter(chunks) for name, chunks in inputs.items()}
+    last_keys = {}
+    buffers = {}
+
+    def refill(name: str):
+        for chunk in iterators[name]:
+            if chunk.empty:
+                continue
+            if not is_sorted_chunk(chunk) or (
+                    name in last_keys and get_first_key(chunk) < last_keys[name]):
+                raise ValueError(f"Archive file {name} isn't sorted by plant and time.")
+            last_keys[name] = get_last_key(chunk)
+            buffers[name] = chunk
+            return
+        buffers.pop(name, None)
+
+    for name in inputs:
+        refill(name)
+
+    last_merged_key = None
+    while buffers:
+        # Every input has all of its rows up to its buffer's last key in memory, so everything up
+        # to the smallest of those can be merged now
+        bound = min(get_last_key(buffer) for buffer in buffers.values())
+
+        taken = []
+        for name in list(buffers):
+            rows = count_rows_up_to(buffers[name], bound)
+            taken.append(buffers[name].iloc[:rows])
+            buffers[name] = buffers[name].iloc[rows:]
+            if buffers[name].empty:
+                refill(name)
+
+        merged = pd.concat(taken, ignore_index=True).sort_values(SORT_KEY, kind='stable')
+        merged = merged.drop_duplicates(SORT_KEY)
+        if last_merged_key is not None:
+            merged = merged.iloc[count_rows_up_to(merged, last_merged_key):]
+
+        if not merged.empty:
+            last_merged_key = get_last_key(merged)
+            yield merged
+
+
+def prime_chunks(chunks):
+    """Reads the first chunk of an input, returning an iterator over all of its chunks."""
+    chunks = iter(chunks)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        return iter([])
+    return itertools.chain([first_chunk], chunks)
+
+
+class ArchiveFileWriter:
+    """
+    Writes chunks of rows (sorted by plant and time) as they're pushed to it, to one csv or parquet
+    file (in the format of its key's extension) through a multipart upload. For csv, the byte range
+    of each plant's rows is kept in plant_offsets; for parquet, chunks are gathered into full row
+    groups, so readers can skip by plant and time.
+    """
+
+    def __init__(self, s3_client, bucket_name: str, key: str, part_size: int = PART_SIZE,
+                 row_group_size: int = archive_files.ROW_GROUP_SIZE,
+                 get_table=archive_files.get_typed_table) -> None:
+        """Starts the upload; get_table turns parquet row groups into arrow tables."""
+        self.key = key
+        self.archive_format = archive_files.get_key_format(key)
+        self.upload = MultipartUploadWriter(s3_client, bucket_name, key, part_size)
+        self.row_group_size = row_group_size
+        self.get_table = get_table
+        self.plant_offsets = {}
+        self.rows = 0
+        self.parquet_writer = None
+        self.pending = []
+        self.pending_rows = 0
+
+    def tell(self) -> int:
+        return self.upload.tell()
+
+    def write(self, chunk: pd.DataFrame):
+        """Writes the chunk, after the rows written before it."""
+        if chunk.empty:
+            return
+        if self.archive_format == 'csv':
+            self.upload.write(archive_files.get_indexed_csv_body(
+                chunk, self.plant_offsets, header=not self.rows, position=self.upload.tell()))
+        else:
+            self.pending.append(chunk)
+            self.pending_rows += len(chunk)
+            if self.pending_rows >= self.row_group_size:
+                self.write_row_group()
+        self.rows += len(chunk)
+
+    def write_row_group(self):
+        """Writes the chunks gathered since the last row group as the next one."""
+        table = self.get_table(pd.concat(self.pending, ignore_index=True))
+        if self.parquet_writer is None:
+            self.parquet_writer = pq.ParquetWriter(
+                self.upload, table.schema, compression=archive_files.get_parquet_compression())
+        self.parquet_writer.write_table(table, row_group_size=self.row_group_size)
+        self.pending = []
+        self.pending_rows = 0
+
+    def close(self):
+        """Writes the rows still gathered and ends the file, ready for complete (or abort)."""
+        if self.pending:
+            self.write_row_group()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
+
+    def complete(self) -> str:
+        """Completes the upload; returns the new object's ETag."""
+        return self.upload.complete()
+
+    def abort(self):
+        """Abandons the upload."""
+        self.upload.abort()
+
+
+def track_datetime_range(chunks, datetime_range: list):
+    """Yields the chunks, keeping the earliest and latest datetime seen in datetime_range."""
+    for chunk in chunks:
+        chunk_range = [chunk['datetime'].min(), chunk['datetime'].max()]
+        if datetime_range:
+            chunk_range = [min(datetime_range[0], chunk_range[0]),
+                           max(datetime_range[1], chunk_range[1])]
+        datetime_range[:] = chunk_range
+        yield chunk
+
+
+def compact_files(s3_client, keys: list[str], output_key: str, bucket_name: str,
+                  columns: list[str], part_size: int = PART_SIZE,
+                  rollup_writers: dict = None) -> dict:
+    """
+    Merges the archive files with the given keys into one sorted file at output_key (in the format
+    of its extension) without duplicate rows, keeping only the given columns; returns the new
+    file's manifest entry, or None if there were no rows to write. If the merge fails, the upload
+    is abandoned and every file is left as it was. Given rollup_writers (for recordings), each
+    plant's rollups are streamed to them as the merge moves past it (see rollups.track_rollups);
+    they're abandoned too if there are no rows or the merge fails, and otherwise left for the
+    caller to complete.
+    """
+    inputs = {key: read_sorted_chunks(s3_client, key, bucket_name, columns) for key in keys}
+    # The first chunk of every input is fetched concurrently; later chunks as the merge needs them
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+        inputs = dict(zip(inputs, executor.map(prime_chunks, inputs.values())))
+
+    datetime_range = []
+    writer = ArchiveFileWriter(s3_client, bucket_name, output_key, part_size)
+    writers = [writer] + list((rollup_writers or {}).values())
+    chunks = track_datetime_range(merge_sorted_chunks(inputs), datetime_range)
+    if rollup_writers is not None:
+        chunks = rollups.track_rollups(chunks, rollup_writers)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+        writer.close()
+    except Exception as e:
+        for abandoned_writer in writers:
+            abandoned_writer.abort()
+        raise e
+
+    if not writer.rows:
+        for abandoned_writer in writers:
+            abandoned_writer.abort()
+        return None
+    etag = writer.complete()
+    indexed = archive_files.save_plant_offsets(s3_client, bucket_name, output_key, etag,
+                                               writer.plant_offsets)
+    METRICS.increment('rows', writer.rows, stage='compaction')
+    METRICS.increment('bytes_written', writer.tell(), stage='compaction')
+    return manifest.get_file_entry(output_key, writer.rows, writer.tell(), etag, *datetime_range,
+                                   indexed)
@@ -1,31 +1,35 @@
 """Combines the S3 management script and update duties so they run in the same lambda function"""
 from dotenv import load_dotenv
-import logging
 
+from metrics import METRICS, set_up_logger
+import profiling
 from s3_data_management import management
 from update_duties import cross_reference_api_and_db_duties
 
 
-def set_up_logger():
-    """Set up a logger, to log pipeline progress to the console."""
-    logging.basicConfig(level=logging.INFO,
-                        format='%(asctime)s - %(levelname)s - %(message)s')
-    return logging.getLogger('logger')
-
-
 def run_pipeline():
     """Function to run the whole management script as a Lambda function."""
     logger = set_up_logger()
     load_dotenv()
-    management()
+    with METRICS.time_stage('s3_management'):
+        management()
     logger.info("S3 management has been complete.")
-    cross_reference_api_and_db_duties()
+    with METRICS.time_stage('update_duties'):
+        cross_reference_api_and_db_duties()
     logger.info("Duties table has been updated.")
 
 
+@profiling.profiled('daily_pipeline')
 def handler(event=None, context=None) -> None:
-    """Function to run the whole pipeline script as a Lambda function."""
-    run_pipeline()
+    """
+    Function to run the whole pipeline script as a Lambda function; the invocation's metrics (see
+    metrics) are printed as JSON lines at the end.
+    """
+    try:
+        run_pipeline()
+    finally:
+        METRICS.emit(pipeline='daily_pipeline',
+                     request_id=getattr(context, 'aws_request_id', None))
 
 
 if __name__ == "__main__":
@@ -1,12 +1,38 @@
 """Module to contain database functions used in update_duties.py"""
 
 from datetime import datetime
+from functools import cache
 from os import environ
 
 from dotenv import load_dotenv
 import pandas as pd
 import sqlalchemy as db
 
+import metrics
+import tables
+
+
+POOL_SIZE = 1
+MAX_OVERFLOW = 2
+POOL_RECYCLE = 1800  # Seconds; connections older than this are replaced before they're used
+
+
+@cache
+def get_database_engine() -> db.Engine:
+    """
+    Returns the pooled database engine, creating it on first use; it lives for the whole process,
+    so warm Lambda invocations reuse its connections rather than logging in to the database again.
+    """
+    metrics.instrument_engines()
+    return db.create_engine(
+        f"mssql+pymssql://{environ['DB_USER']}:{environ['DB_PASSWORD']}@{environ['DB_HOST']}:{environ['DB_PORT']}/{environ['DB_NAME']}?charset=utf8",
+        execution_options={'schema_translate_map': tables.get_schema_translate_map()},
+        pool_size=int(environ.get('DB_POOL_SIZE', POOL_SIZE)),
+        max_overflow=int(environ.get('DB_MAX_OVERFLOW', MAX_OVERFLOW)),
+        pool_recycle=int(environ.get('DB_POOL_RECYCLE', POOL_RECYCLE)),
+        pool_pre_ping=True
+    )
+
 
 class MSSQL_Database():
     """
@@ -16,16 +42,13 @@ class MSSQL_Database():
 
     def __init__(self) -> None:
         """
-        Connects to engine, creates connection, and stores resulting objects along with the
-        database metadata as attributes of the image of the class.
+        Takes a connection from the shared engine's pool, and stores it along with the engine as
+        attributes of the image of the class.
         """
         load_dotenv()
         try:
-            self.engine = db.create_engine(
-                f"mssql+pymssql://{environ['DB_USER']}:{environ['DB_PASSWORD']}@{environ['DB_HOST']}:{environ['DB_PORT']}/{environ['DB_NAME']}?charset=utf8"
-            )
+            self.engine = get_database_engine()
             self.connection = self.engine.connect()
-            self.metadata = db.MetaData(schema=environ['DB_SCHEMA'])
         except Exception as e:
             print(f"Error connecting to database: {e}")
             raise e
@@ -35,38 +58,15 @@ class MSSQL_Database():
         self.connection.commit()
 
     def close(self):
-        """Closes db connection."""
+        """Closes db connection (returning it to the engine's pool)."""
         self.connection.close()
 
 
 
-def add_duty(database: MSSQL_Database, plant_id: int, botanist_id: int):
-    """
-    Updates any duties in duty table with plant id and NULL end column to current datetime, and add
-    a new duty for plant and botanist id.
-    """
-
-    try:
-        duty_table = db.Table('duty', database.metadata, autoload_with=database.engine)
-        # Update old duty:
-        query = db.update(duty_table).values(end=datetime.now())\
-            .where((duty_table.c.plant_id == plant_id) & (duty_table.c.end == None))
-        database.connection.execute(query)
-
-        # Add new duty
-        query = db.insert(duty_table).values(plant_id=plant_id, botanist_id=botanist_id)
-        database.connection.execute(query)
-
-        database.commit()
-
-    except Exception as e:
-        raise e
-
-
 def get_db_plant_ids(database: MSSQL_Database) -> list:
     """Retrieves all plant ids from the plant table in the db."""
     try:
-        plant_table = db.Table('plant', database.metadata, autoload_with=database.engine)
+        plant_table = tables.get_table('plant', database.engine)
         query = db.select(plant_table)
         response = database.connection.execute(query)
         results = response.fetchall()
@@ -79,7 +79,7 @@ def get_db_plant_ids(database: MSSQL_Database) -> list:
 def get_active_duties(database: MSSQL_Database) -> pd.DataFrame:
     """Retrieves pandas df of all records in db duty table without an end date."""
     try:
-        duty_table = db.Table('duty', database.metadata, autoload_with=database.engine)
+        duty_table = tables.get_table('duty', database.engine)
         query = db.select(duty_table).where(duty_table.columns.end == None)
         response = database.connection.execute(query)
         results = response.fetchall()
@@ -89,24 +89,53 @@ def get_active_duties(database: MSSQL_Database) -> pd.DataFrame:
         raise e
 
 
-def get_botanist_by_name(forename: str, surname: str, database: MSSQL_Database) -> pd.DataFrame:
-    """Retrieves pandas df of first record in db botanist table with specified fore- and surname."""
+def get_botanist_ids_by_name(database: MSSQL_Database) -> dict[tuple[str, str], int]:
+    """
+    Retrieves the id of every botanist in the db botanist table in one query, by (forename,
+    surname); where botanists share a name, the first added is kept.
+    """
     try:
-        botanist_table = db.Table('botanist', database.metadata, autoload_with=database.engine)
-        query = db.select(botanist_table).where(botanist_table.columns.firstname == forename and
-                                                botanist_table.columns.lastname == surname)
+        botanist_table = tables.get_table('botanist', database.engine)
+        query = db.select(botanist_table.c.id, botanist_table.c.firstname,
+                          botanist_table.c.lastname).order_by(botanist_table.c.id.desc())
         response = database.connection.execute(query)
-        result = response.first()
-        return list(result)
+        return {(row.firstname, row.lastname): row.id for row in response.fetchall()}
+
+    except Exception as e:
+        raise e
+
+
+def apply_duty_changes(database: MSSQL_Database, new_duties: dict[int, int]):
+    """
+    Ends the active duties of every plant in new_duties (plant id: botanist id) and adds their new
+    duties, in one transaction; if any statement fails, none of the changes are kept.
+    """
+    if not new_duties:
+        return
+
+    try:
+        duty_table = tables.get_table('duty', database.engine)
+        # End old duties:
+        query = db.update(duty_table).values(end=datetime.now())\
+            .where(duty_table.c.plant_id.in_(list(new_duties)) & (duty_table.c.end == None))
+        database.connection.execute(query)
+
+        # Add new duties
+        database.connection.execute(db.insert(duty_table),
+                                    [{'plant_id': plant_id, 'botanist_id': botanist_id}
+                                     for plant_id, botanist_id in new_duties.items()])
+
+        database.commit()
 
     except Exception as e:
+        database.connection.rollback()
         raise e
 
 
 def get_table_records(table_name: str, database: MSSQL_Database) -> pd.DataFrame:
     """Retrieves all records as pandas df from specified table in db."""
     try:
-        table = db.Table(table_name, database.metadata, autoload_with=database.engine)
+        table = tables.get_table(table_name, database.engine)
         query = db.select(table)
         response = database.connection.execute(query)
         results = response.fetchall()
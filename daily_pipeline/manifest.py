@@ -0,0 +1,132 @@
+"""
+Contains code to keep and read the manifest of the s3 archive: a single object listing every archive
+file's key with its data type, row count, size in bytes, earliest and latest datetime and ETag (and,
+for csv files, whether the byte range of each plant's rows is in an index object beside the file;
+see archive_files). Rollup files (see the daily pipeline's rollups.py) are listed alongside, with
+their resolution.
+Every pipeline write updates it (with conditional puts, so concurrent writers can't lose each
+other's changes), and readers use it to find the files covering a date range with one request,
+rather than listing the bucket. Files are never rewritten in place: compaction writes each month
+file (and its rollups) to a new key, and the manifest update switching readers over to it is
+atomic. Readers pass a file's ETag with every request for it, so a file replaced or deleted since
+they read the manifest fails their read (rather than being read with the old entry), and they read
+the manifest again.
+"""
+
+from datetime import datetime
+import json
+import re
+
+from botocore.exceptions import ClientError
+
+
+MANIFEST_KEY = 'manifest.json'
+MAX_UPDATE_ATTEMPTS = 5
+CONFLICT_ERROR_CODES = ('PreconditionFailed', 'ConditionalRequestConflict', '409', '412')
+
+
+def get_key_data_type(key: str) -> str:
+    """
+    Returns the data type (watering/recording) of the archive file with the given key: a month
+    ({data_type}-{version}), day ({data_type}_{day}) or part file, or a rollup file.
+    """
+    return re.split(r'[._-]', key.split('/')[2])[0]
+
+
+def get_file_entry(key: str, rows: int, size: int, etag: str, min_datetime: datetime,
+                   max_datetime: datetime, indexed: bool = False,
+                   resolution: str = None) -> dict:
+    """
+    Returns the manifest entry of an archive file; indexed is whether the byte ranges of each
+    plant's rows are saved in the file's index object (see archive_files), and resolution is only
+    given for rollup files.
+    """
+    entry = {'data_type': get_key_data_type(key),
+             'rows': int(rows),
+             'bytes': int(size),
+             'min_datetime': min_datetime.isoformat() if rows else None,
+             'max_datetime': max_datetime.isoformat() if rows else None,
+             'etag': etag}
+    if indexed:
+        entry['indexed'] = True
+    if resolution:
+        entry['resolution'] = resolution
+    return entry
+
+
+def load_manifest(s3_client, bucket_name: str) -> tuple[dict, str]:
+    """Returns the manifest and its ETag, or an empty manifest and None if there isn't one yet."""
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=MANIFEST_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return {'files': {}}, None
+        raise e
+    return json.loads(response['Body'].read()), response['ETag']
+
+
+def save_manifest(s3_client, archive_manifest: dict, bucket_name: str, etag: str = None):
+    """
+    Saves the manifest, only if it hasn't changed since it was loaded with the given ETag (or, with
+    no ETag, if there isn't one yet); otherwise a ClientError is raised.
+    """
+    condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+    s3_client.put_object(Body=json.dumps(archive_manifest, sort_keys=True), Bucket=bucket_name,
+                         Key=MANIFEST_KEY, ContentType='application/json', **condition)
+
+
+def update_manifest(s3_client, bucket_name: str, added: dict = None,
+                    removed: list[str] = None) -> dict:
+    """
+    Adds (or replaces) the given entries, by key, in the manifest and removes the entries of the
+    given keys. If another writer changes the manifest in between loading and saving it, the
+    update is retried on the new version. Returns the updated manifest.
+    """
+    for attempt in range(MAX_UPDATE_ATTEMPTS):
+        archive_manifest, etag = load_manifest(s3_client, bucket_name)
+        archive_manifest['files'].update(added or {})
+        for key in removed or []:
+            archive_manifest['files'].pop(key, None)
+
+        try:
+            save_manifest(s3_client, archive_manifest, bucket_name, etag)
+            return archive_manifest
+        except ClientError as e:
+            if (e.response['Error']['Code'] not in CONFLICT_ERROR_CODES
+                    or attempt == MAX_UPDATE_ATTEMPTS - 1):
+                raise e
+
+
+def get_folder_keys(archive_manifest: dict, folder_path: str) -> list[str]:
+    """Returns the keys of the archive files in the given folder ({year}/{month})."""
+    prefix = f"{folder_path.rstrip('/')}/"
+    return sorted(key for key in archive_manifest['files'] if key.startswith(prefix))
+
+
+def get_keys_for_range(archive_manifest: dict, data_type: str, range_start: datetime = None,
+                       range_end: datetime = None, resolution: str = None) -> list[str]:
+    """
+    Returns the keys of the data_type files holding any rows from range_start up to (not
+    including) range_end; either end may be left open. With a resolution, the keys are of the
+    rollup files of that resolution rather than of the archive files.
+    """
+    keys = []
+    for key, entry in archive_manifest['files'].items():
+        if (entry['data_type'] != data_type or not entry['rows']
+                or entry.get('resolution') != resolution):
+            continue
+        if range_end is not None and datetime.fromisoformat(entry['min_datetime']) >= range_end:
+            continue
+        if range_start is not None and datetime.fromisoformat(entry['max_datetime']) < range_start:
+            continue
+        keys.append(key)
+    return sorted(keys)
+
+
+def get_earliest_datetime(archive_manifest: dict) -> datetime:
+    """Returns the earliest datetime of any row in the archive, or None if it's empty."""
+    min_datetimes = [entry['min_datetime'] for entry in archive_manifest['files'].values()
+                     if entry['rows'] and not entry.get('resolution')]
+    if not min_datetimes:
+        return None
+    return min(datetime.fromisoformat(min_datetime) for min_datetime in min_datetimes)
@@ -0,0 +1,162 @@
+"""
+Contains the pipelines' logging set-up and their metrics: counters (such as rows and bytes
+written, s3 requests and database round trips) and histograms (such as each stage's duration and
+each plant's API latency), collected during a handler() call and emitted at its end as one JSON
+line per metric, so CloudWatch Logs Insights (or a metric filter) can show which stage is using
+the invocation's time.
+
+Metrics are named, with optional dimensions (e.g. stage='load'); each name and set of dimensions is
+a separate series. S3 clients are instrumented when created, and database engines once per
+process; both count into whichever invocation is running.
+"""
+
+from contextlib import contextmanager
+import json
+import logging
+import threading
+import time
+
+import numpy as np
+import sqlalchemy as db
+
+
+LOGGER_NAME = 'logger'
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# Upper bounds (in seconds) of the buckets histograms are counted in; the last is unbounded
+HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+PERCENTILES = (50, 95, 99)
+
+
+def set_up_logger() -> logging.Logger:
+    """Sets up logging to the console (once per process), returning the pipelines' logger."""
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    return logging.getLogger(LOGGER_NAME)
+
+
+def get_series_key(name: str, dimensions: dict) -> tuple:
+    """Returns the key of the series of the metric with the given name and dimensions."""
+    return (name, tuple(sorted(dimensions.items())))
+
+
+class Metrics():
+    """
+    The counters and histograms of one invocation, safe to update from several threads; emit()
+    writes them out and starts afresh for the next invocation.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name: str, value: float = 1, **dimensions) -> None:
+        """Adds the value to the counter."""
+        key = get_series_key(name, dimensions)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **dimensions) -> None:
+        """Adds an observation (such as a latency, in seconds) to the histogram."""
+        key = get_series_key(name, dimensions)
+        with self.lock:
+            self.histograms.setdefault(key, []).append(value)
+
+    @contextmanager
+    def time_stage(self, stage: str):
+        """Observes how long the block takes as the stage's duration, even if it fails."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, stage=stage)
+
+    def get_metric_lines(self, **context) -> list[dict]:
+        """
+        Returns every metric collected as a dict, with the given context (e.g. the pipeline's
+        name) added to each: a counter's total, or a histogram's count, sum, extremes,
+        percentiles and bucket counts.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(values) for key, values in self.histograms.items()}
+
+        lines = []
+        for (name, dimensions), value in counters.items():
+            lines.append({**context, 'metric': name, 'type': 'counter',
+                          'dimensions': dict(dimensions), 'value': value})
+
+        for (name, dimensions), values in histograms.items():
+            observations = np.array(values)
+            counts = np.bincount(np.searchsorted(HISTOGRAM_BUCKETS, observations),
+                                 minlength=len(HISTOGRAM_BUCKETS))
+            lines.append({**context, 'metric': name, 'type': 'histogram',
+                          'dimensions': dict(dimensions), 'count': len(values),
+                          'sum': round(float(observations.sum()), 6),
+                          'min': round(float(observations.min()), 6),
+                          'max': round(float(observations.max()), 6),
+                          **{f'p{percentile}': round(float(np.percentile(observations,
+                                                                         percentile)), 6)
+                             for percentile in PERCENTILES},
+                          'buckets': {str(bound): int(count)
+                                      for bound, count in zip(HISTOGRAM_BUCKETS, counts)}})
+        return lines
+
+    def emit(self, **context) -> list[dict]:
+        """
+        Prints every metric collected as a JSON line (with the given context), then clears them;
+        returns the lines printed.
+        """
+        lines = self.get_metric_lines(**context)
+        for line in lines:
+            print(json.dumps(line), flush=True)
+        self.reset()
+        return lines
+
+    def reset(self) -> None:
+        """Clears every metric."""
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+
+# The metrics of the running invocation, shared by every module of the pipeline
+METRICS = Metrics()
+
+
+def count_s3_request(model, params: dict, **kwargs) -> None:
+    """
+    Counts an s3 request by operation, and the bytes of the body sent, if it's in memory (a
+    botocore before-call handler).
+    """
+    METRICS.increment('s3_requests', operation=model.name)
+    body = params.get('Body')
+    if isinstance(body, (bytes, bytearray, str)):
+        METRICS.increment('s3_bytes_sent', len(body), operation=model.name)
+
+
+def count_s3_response(parsed: dict, model, **kwargs) -> None:
+    """Counts the bytes of an s3 object downloaded (a botocore after-call handler)."""
+    if model.name == 'GetObject' and parsed.get('ContentLength'):
+        METRICS.increment('s3_bytes_received', parsed['ContentLength'], operation=model.name)
+
+
+def instrument_s3_client(s3_client):
+    """Counts the requests made with the s3 client (and the bytes sent and received); returns it."""
+    s3_client.meta.events.register('before-call.s3', count_s3_request)
+    s3_client.meta.events.register('after-call.s3', count_s3_response)
+    return s3_client
+
+
+def count_db_round_trip(*args, **kwargs) -> None:
+    """Counts a statement or commit sent to the database (a SQLAlchemy event listener)."""
+    METRICS.increment('db_round_trips')
+
+
+def instrument_engines() -> None:
+    """
+    Counts the round trips to the database made with every engine's connections; the pipelines
+    have one engine each, so listening on the Engine class covers it wherever it's created.
+    """
+    for event_name in ('before_cursor_execute', 'commit'):
+        if not db.event.contains(db.engine.Engine, event_name, count_db_round_trip):
+            db.event.listen(db.engine.Engine, event_name, count_db_round_trip)
@@ -0,0 +1,75 @@
+"""
+Script to rebuild the archive manifest (see manifest.py) from the files in the s3 bucket, reading
+each file's row count and datetime range (rollup files, under rollups/, are listed with their
+resolution), and marking the files with index objects as indexed. Run it once before the
+pipelines start relying on the manifest, and again to repair it if files are ever added or removed
+by hand. Manifests from before plant offsets moved to index objects held them in each entry;
+rebuilding drops them.
+"""
+
+import concurrent.futures
+from datetime import timedelta
+from os import environ
+import re
+
+from dotenv import load_dotenv
+
+import archive_files
+import manifest
+import rollups
+from s3_data_management import create_s3_client, get_bucket_keys
+
+
+MAX_READ_WORKERS = 32
+VERSION_PATTERN = r'-[0-9]{14}-[0-9a-f]{8}'
+ARCHIVE_KEY_PATTERN = (r'^20[0-9]{2}/([1-9]|1[0-2])/(watering|recording)'
+                       rf'({VERSION_PATTERN}|_([1-9]|[12][0-9]|3[01])(/[0-9]+)?)?\.(csv|parquet)$')
+ROLLUP_KEY_PATTERN = (r'^rollups/(10min|1h|1d)/(watering|recording)/20[0-9]{2}/([1-9]|1[0-2])'
+                      rf'({VERSION_PATTERN})?\.(csv|parquet)$')
+
+
+def get_file_entry(s3_client, key: str, bucket_name: str, indexed: bool = False) -> dict:
+    """
+    Returns the manifest entry of the archive file with the given key, marked as indexed if it has
+    an index object (see archive_files).
+    """
+    response = s3_client.head_object(Bucket=bucket_name, Key=key)
+    # Only the datetime column is needed; for parquet files, only its bytes are downloaded
+    datetimes = archive_files.read_archive_file(s3_client, key, bucket_name,
+                                                columns=['datetime'], ranged=True)['datetime']
+    resolution = None
+    max_datetime = datetimes.max()
+    if re.match(ROLLUP_KEY_PATTERN, key):
+        # The rows rolled up are unknown, so the rollup is taken to cover all of its last period
+        resolution = key.split('/')[1]
+        max_datetime += (timedelta(minutes=rollups.RESOLUTION_MINUTES[resolution])
+                         - timedelta(microseconds=1))
+    return manifest.get_file_entry(key, len(datetimes), response['ContentLength'],
+                                   response['ETag'], datetimes.min(), max_datetime,
+                                   indexed, resolution)
+
+
+def rebuild_manifest(s3_client, bucket_name: str) -> dict:
+    """Replaces the manifest with one listing every archive file in the bucket; returns it."""
+    # Saving fails, rather than overwriting, if a pipeline changes the manifest in the meantime
+    _, etag = manifest.load_manifest(s3_client, bucket_name)
+
+    bucket_keys = get_bucket_keys(s3_client, '', bucket_name)
+    keys = [key for key in bucket_keys
+            if re.match(ARCHIVE_KEY_PATTERN, key) or re.match(ROLLUP_KEY_PATTERN, key)]
+    index_keys = {key for key in bucket_keys if key.endswith(archive_files.INDEX_SUFFIX)}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_READ_WORKERS) as executor:
+        entries = executor.map(
+            lambda key: get_file_entry(s3_client, key, bucket_name,
+                                       archive_files.get_index_key(key) in index_keys), keys)
+        archive_manifest = {'files': dict(zip(keys, entries))}
+
+    manifest.save_manifest(s3_client, archive_manifest, bucket_name, etag)
+    return archive_manifest
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    rebuilt_manifest = rebuild_manifest(create_s3_client(), environ['BUCKET_NAME'])
+    print(f"Manifest rebuilt with {len(rebuilt_manifest['files'])} files.")
@@ -0,0 +1,197 @@
+"""
+Contains code to roll recordings up into per-plant summaries at coarser resolutions: for each plant
+and each 10 minutes, hour or day, the count, minimum, maximum and mean of the soil moisture and of
+the temperature. The daily pipeline writes a rollup file of each resolution for every month it
+compacts (to rollups/{resolution}/{data_type}/{year}/{month}-{version}, new keys each time, listed
+in the archive manifest with their resolution and the datetime range of the rows rolled up), and
+the dashboard reads the coarsest one which still gives its charts enough points, rather than every
+minute's recording.
+
+Rollups are combined as partial rollups, holding sums rather than means, so rollups of different
+rows (e.g. of the archive and of the database) for the same plant and time can be merged exactly.
+Rows streamed in plant order are rolled up one plant at a time, each plant's rollups written out as
+soon as its rows end, so only one plant's partial rollups are held rather than the month's.
+"""
+
+import io
+import math
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import archive_files
+
+
+# Resolution name: pandas frequency, finest first
+RESOLUTIONS = {'10min': '10min', '1h': '1h', '1d': '1D'}
+RESOLUTION_MINUTES = {'10min': 10, '1h': 60, '1d': 1440}
+MEASURES = ['soil_moisture', 'temperature']
+ROLLUP_PREFIX = 'rollups'
+ROLLUP_ROW_GROUP_SIZE = 5000  # About a month of one plant's 10 minute rollups
+MAX_CHART_POINTS = 5000
+GROUP_COLUMNS = ['plant_id', 'datetime']
+
+
+def get_rollup_key(resolution: str, data_type: str, year: int, month: int,
+                   archive_format: str, version: str = None) -> str:
+    """
+    Returns the key of a rollup file of the given resolution for a month; each compaction writes
+    its rollups to new keys, named with its version.
+    """
+    name = f'{month}-{version}' if version else str(month)
+    return f'{ROLLUP_PREFIX}/{resolution}/{data_type}/{year}/{name}.{archive_format}'
+
+
+def get_rollup_key_month(key: str) -> tuple[int, int]:
+    """Returns the (year, month) of the rollup file with the given key."""
+    parts = key.split('/')
+    return int(parts[3]), int(re.split(r'[.-]', parts[4])[0])
+
+
+def get_partial_rollup(df: pd.DataFrame, freq: str) -> pd.DataFrame:
+    """
+    Returns the partial rollup of the recordings: for each plant and period of the frequency (from
+    its start), the count, sum, minimum and maximum of each measure.
+    """
+    aggregations = {}
+    for measure in MEASURES:
+        for statistic in ('count', 'sum', 'min', 'max'):
+            aggregations[f'{measure}_{statistic}'] = (measure, statistic)
+
+    periods = df[GROUP_COLUMNS].assign(datetime=df['datetime'].dt.floor(freq))
+    return (df[MEASURES].groupby([periods['plant_id'], periods['datetime']])
+            .agg(**aggregations).reset_index())
+
+
+def combine_partial_rollups(partials: list[pd.DataFrame], freq: str = None) -> pd.DataFrame:
+    """
+    Returns the partial rollups combined into one, by plant and period, sorted; with a frequency,
+    the periods are first coarsened to it.
+    """
+    df = pd.concat(partials, ignore_index=True)
+    if freq:
+        df['datetime'] = df['datetime'].dt.floor(freq)
+
+    aggregations = {}
+    for measure in MEASURES:
+        aggregations.update({f'{measure}_count': 'sum', f'{measure}_sum': 'sum',
+                             f'{measure}_min': 'min', f'{measure}_max': 'max'})
+    return df.groupby(GROUP_COLUMNS, as_index=False, sort=True).agg(aggregations)
+
+
+def get_rollup(partial: pd.DataFrame) -> pd.DataFrame:
+    """Returns the rollup (count, minimum, maximum and mean of each measure) of a partial rollup."""
+    df = partial[GROUP_COLUMNS].copy()
+    for measure in MEASURES:
+        count = partial[f'{measure}_count']
+        df[f'{measure}_count'] = count
+        df[f'{measure}_min'] = partial[f'{measure}_min']
+        df[f'{measure}_max'] = partial[f'{measure}_max']
+        df[f'{measure}_mean'] = partial[f'{measure}_sum'] / count.where(count > 0)
+    return df
+
+
+def get_partial_from_rollup(rollup: pd.DataFrame) -> pd.DataFrame:
+    """Returns the partial rollup of a rollup, so it can be combined with others."""
+    df = rollup[GROUP_COLUMNS].copy()
+    for measure in MEASURES:
+        df[f'{measure}_count'] = rollup[f'{measure}_count']
+        df[f'{measure}_sum'] = (rollup[f'{measure}_mean'] * rollup[f'{measure}_count']).fillna(0)
+        df[f'{measure}_min'] = rollup[f'{measure}_min']
+        df[f'{measure}_max'] = rollup[f'{measure}_max']
+    return df
+
+
+def write_rollups(partials: list[pd.DataFrame], rollup_writers: dict):
+    """Writes the rollup at every resolution of the partial rollups given to its writer."""
+    for resolution, rollup in get_rollups(partials).items():
+        rollup_writers[resolution].write(rollup)
+
+
+def track_rollups(chunks, rollup_writers: dict):
+    """
+    Yields the chunks of recordings (sorted by plant and time), rolling them up on the way: once the
+    chunks move on from a plant, its rollup at every resolution is written to that resolution's
+    writer in rollup_writers (anything with a write(rollup) method), in plant order.
+    """
+    finest_freq = next(iter(RESOLUTIONS.values()))
+    # The finest partial rollups of the last plant seen, whose rows may go on in the next chunk
+    plant_partials = []
+    for chunk in chunks:
+        if not chunk.empty:
+            partial = get_partial_rollup(chunk, finest_freq)
+            is_last_plant = partial['plant_id'] == chunk['plant_id'].iat[-1]
+            if not is_last_plant.all():
+                write_rollups(plant_partials + [partial[~is_last_plant]], rollup_writers)
+                plant_partials = []
+            plant_partials.append(partial[is_last_plant])
+        yield chunk
+
+    if plant_partials:
+        write_rollups(plant_partials, rollup_writers)
+
+
+def get_rollups(partials: list[pd.DataFrame]) -> dict:
+    """
+    Returns the rollup at every resolution, by name, of the finest resolution partial rollups given
+    (or None if there are none); each coarser rollup is built from the one before.
+    """
+    if not partials:
+        return None
+
+    rollups = {}
+    partial = None
+    for resolution, freq in RESOLUTIONS.items():
+        partial = combine_partial_rollups([partial] if partial is not None else partials, freq)
+        rollups[resolution] = get_rollup(partial)
+    return rollups
+
+
+def get_rollup_table(df: pd.DataFrame) -> pa.Table:
+    """Returns the (sorted) rollup as an arrow table, as rollup files hold it."""
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def get_rollup_body(df: pd.DataFrame, archive_format: str, plant_offsets: dict) -> bytes:
+    """
+    Returns the body of a rollup file holding the (sorted) rollup, in the given format; for csv,
+    the byte range of each plant's rows is added to plant_offsets.
+    """
+    if archive_format == 'csv':
+        return archive_files.get_indexed_csv_body(df, plant_offsets)
+
+    buffer = io.BytesIO()
+    pq.write_table(get_rollup_table(df), buffer,
+                   row_group_size=ROLLUP_ROW_GROUP_SIZE,
+                   compression=archive_files.get_parquet_compression())
+    return buffer.getvalue()
+
+
+def get_chart_minutes(range_minutes: float, sample_minutes: int) -> int:
+    """
+    Returns how many minutes each point of a chart over a range of the given length should cover:
+    the sample rate asked for, unless that would give more than MAX_CHART_POINTS points, in which
+    case the fewest minutes that don't, rounded up to a whole number of the coarsest resolution
+    that fits (so it can be built from that rollup exactly).
+    """
+    needed_minutes = max(sample_minutes, math.ceil(range_minutes / MAX_CHART_POINTS))
+    if needed_minutes == sample_minutes:
+        return sample_minutes
+
+    fitting_minutes = [minutes for minutes in RESOLUTION_MINUTES.values()
+                       if minutes <= needed_minutes]
+    if not fitting_minutes:
+        return needed_minutes
+    return math.ceil(needed_minutes / max(fitting_minutes)) * max(fitting_minutes)
+
+
+def get_resolution(chart_minutes: int) -> str:
+    """
+    Returns the name of the coarsest resolution that charts with points of the given minutes can
+    be built from exactly, or None if only the minute recordings will do.
+    """
+    resolutions = [resolution for resolution, minutes in RESOLUTION_MINUTES.items()
+                   if chart_minutes % minutes == 0]
+    return resolutions[-1] if resolutions else None
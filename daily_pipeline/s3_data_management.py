@@ -1,79 +1,231 @@
 """
-Module containing code to extract and combine cumulative csv files for the month with csv files
-from the previous day in the folder in the s3 bucket corresponding to yesterday's month.
+Module containing code to extract and combine cumulative files for the month with the part files
+written by the minute pipeline for previous days, in the folder in the s3 bucket corresponding to
+the day before yesterday's month, and in that of any earlier month with parts written since it was
+compacted (such as waterings archived late, into the day they happened). Files may be csv or parquet (see archive_files); the month file is
+written in the ARCHIVE_FORMAT, so changing it moves each month over at its next compaction. Files
+are merged with a streaming compaction (see compaction), so memory use doesn't grow with the month.
+The month's recordings are rolled up in the same pass, and the rollup files (see rollups) replaced.
+
+Nothing is overwritten in place: each compaction writes its month file and rollups to new keys
+({data_type}-{version}), switches the manifest over to them in one update, and only then deletes
+the files they replace, so readers never pair a manifest entry with another file's bytes.
 """
 
 from os import environ
 from datetime import datetime, timedelta
+import uuid
 from dotenv import load_dotenv
-import pandas as pd
 
 from boto3 import client
+from botocore.config import Config
+
+import archive_files
+import compaction
+import manifest
+import metrics
+import rollups
 
 
 YESTERDAY = datetime.today() - timedelta(days=1)
 DAY_BEFORE_YESTERDAY = datetime.today() - timedelta(days=2)
+MAX_KEYS_PER_DELETE = 1000
+ARCHIVE_COLUMNS = {'recording': ['id', 'plant_id', 'soil_moisture', 'temperature', 'datetime'],
+                   'watering': ['id', 'plant_id', 'datetime']}
 
 
 def create_s3_client():
     """Creates a client that connects to s3 on AWS."""
-    return client("s3",
-                  aws_access_key_id=environ['AWS_ACCESS_KEY_ID_'],
-                  aws_secret_access_key=environ['AWS_SECRET_ACCESS_KEY_'])
+    return metrics.instrument_s3_client(
+        client("s3",
+               aws_access_key_id=environ['AWS_ACCESS_KEY_ID_'],
+               aws_secret_access_key=environ['AWS_SECRET_ACCESS_KEY_'],
+               # Enough connections for every compaction download worker to have its own
+               config=Config(max_pool_connections=compaction.MAX_DOWNLOAD_WORKERS)))
 
 
 def get_bucket_keys(s3_client: client, folder_path: str, bucket_name: str) -> list:
-    """Returns a list of keys of csv files, with a prefix matching the folder_path."""
-    objects = s3_client.list_objects(
-        Bucket=bucket_name, Prefix=folder_path).get('Contents')
-    if objects:
-        return [obj['Key'] for obj in objects if obj['Key'].split('.')[-1] == 'csv']
-    return []
-
-
-def save_df_to_s3_bucket(s3_client: client, df: pd.DataFrame, key: str, bucket: str):
-    """Function to save a pandas dataframe to the given s3 bucket."""
-    file_body = df.to_csv()
-    s3_client.put_object(Body=file_body, Bucket=bucket, Key=key)
-
-
-def combine_csv_files_for_month(s3_client: client, bucket_name: str):
-    """Downloads relevant files from S3 to local, converts into two pandas data frames and saves them, 
-           old csv files that have been combined are deleted."""
-    folder_path = f'{DAY_BEFORE_YESTERDAY.year}/{DAY_BEFORE_YESTERDAY.month}'
-    keys = get_bucket_keys(s3_client, folder_path, bucket_name)
+    """
+    Returns a list of keys of archive files (csv or parquet) and their index objects, with a prefix
+    matching the path. Only used to rebuild the manifest (see rebuild_manifest.py); the pipelines
+    read the manifest instead.
+    """
+    keys = []
+    response = s3_client.list_objects(Bucket=bucket_name, Prefix=folder_path)
+    while True:
+        objects = response.get('Contents') or []
+        keys.extend(obj['Key'] for obj in objects
+                    if archive_files.get_key_format(obj['Key']) in archive_files.ARCHIVE_FORMATS
+                    or obj['Key'].endswith(archive_files.INDEX_SUFFIX))
+        if not response.get('IsTruncated') or not objects:
+            return keys
+        # Listings stop at 1,000 keys; carry on from the last one
+        response = s3_client.list_objects(Bucket=bucket_name, Prefix=folder_path,
+                                          Marker=objects[-1]['Key'])
+
+
+def get_version() -> str:
+    """Returns a new version for the files of a compaction, sortable by time."""
+    return f'{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}'
+
+
+def get_month_key(folder_path: str, data_type: str, archive_format: str, version: str) -> str:
+    """Returns the key of a new version of the month file of data_type in the folder."""
+    return f'{folder_path}/{data_type}-{version}.{archive_format}'
+
+
+def get_key_day(key: str) -> int:
+    """
+    Returns the day of the month the day file ({data_type}_{day}.csv) or part file
+    ({data_type}_{day}/{run_time}.csv, or .parquet) with the given key holds, or None for a month
+    file ({data_type}-{version}.csv, or {data_type}.csv from before month files were versioned).
+    """
+    name = key.split('/')[2].split('.')[0]
+    if '_' not in name:
+        return None
+    return int(name.split('_')[-1])
+
+
+def is_live_key(key: str) -> bool:
+    """Returns whether the key holds data for yesterday, which the minute pipeline still adds to."""
+    return (key.startswith(f'{YESTERDAY.year}/{YESTERDAY.month}/') and
+            get_key_day(key) == YESTERDAY.day)
+
+
+def delete_keys(s3_client: client, keys: list, bucket_name: str):
+    """Deletes the objects with the given keys from the bucket, in as few requests as possible."""
+    for start in range(0, len(keys), MAX_KEYS_PER_DELETE):
+        s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in keys[start:start + MAX_KEYS_PER_DELETE]]})
+
+
+def open_rollup_writers(s3_client: client, data_type: str, year: int, month: int,
+                        bucket_name: str, version: str) -> dict:
+    """
+    Starts uploading the rollup file of each resolution for the month (to new keys, of the given
+    version); returns their writers, by resolution, for rollups.track_rollups to stream each plant's
+    rollups to.
+    """
+    archive_format = archive_files.get_archive_format()
+    return {resolution: compaction.ArchiveFileWriter(
+                s3_client, bucket_name,
+                rollups.get_rollup_key(resolution, data_type, year, month, archive_format, version),
+                row_group_size=rollups.ROLLUP_ROW_GROUP_SIZE, get_table=rollups.get_rollup_table)
+            for resolution in rollups.RESOLUTIONS}
+
+
+def save_rollups(s3_client: client, rollup_writers: dict, month_entry: dict,
+                 bucket_name: str) -> dict:
+    """
+    Completes the rollup files streamed to the writers (see open_rollup_writers), of the rows of
+    the month file with the given manifest entry; returns the files' manifest entries, by key.
+    Their datetime ranges are those of the rows rolled up, so readers know which rows they cover.
+    """
+    entries = {}
+    for resolution, writer in rollup_writers.items():
+        writer.close()
+        if not writer.rows:
+            writer.abort()
+            continue
+        etag = writer.complete()
+        indexed = archive_files.save_plant_offsets(s3_client, bucket_name, writer.key, etag,
+                                                   writer.plant_offsets)
+        entries[writer.key] = manifest.get_file_entry(
+            writer.key, writer.rows, writer.tell(), etag,
+            datetime.fromisoformat(month_entry['min_datetime']),
+            datetime.fromisoformat(month_entry['max_datetime']), indexed, resolution)
+    return entries
+
+
+def get_month_rollup_keys(archive_manifest: dict, data_type: str, year: int,
+                          month: int) -> list[str]:
+    """Returns the keys of the manifest's rollup files (of any version) of data_type for a month."""
+    return [key for key in archive_manifest['files']
+            if key.startswith(f'{rollups.ROLLUP_PREFIX}/')
+            and manifest.get_key_data_type(key) == data_type
+            and rollups.get_rollup_key_month(key) == (year, month)]
+
+
+def get_months_to_compact(archive_manifest: dict) -> list[tuple[int, int]]:
+    """
+    Returns the day before yesterday's month and every month with day or part files in the manifest
+    which are no longer live, as (year, month) tuples in order.
+    """
+    months = {(DAY_BEFORE_YESTERDAY.year, DAY_BEFORE_YESTERDAY.month)}
+    for key in archive_manifest['files']:
+        if (not key.startswith(f'{rollups.ROLLUP_PREFIX}/') and get_key_day(key) is not None
+                and not is_live_key(key)):
+            year, month = key.split('/')[:2]
+            months.add((int(year), int(month)))
+    return sorted(months)
+
+
+def combine_csv_files_for_month(s3_client: client, bucket_name: str, year: int = None,
+                                month: int = None):
+    """
+    Merges the month file and the (no longer live) part files of the given month (by default the
+    day before yesterday's) into a new version of the month file, streaming, with duplicate rows
+    dropped; the files that have been combined are then deleted. The month's recordings are rolled
+    up on the way, replacing its rollup files. The files are found from, and the changes recorded
+    in, the archive manifest.
+    """
+    if year is None or month is None:
+        year, month = DAY_BEFORE_YESTERDAY.year, DAY_BEFORE_YESTERDAY.month
+    folder_path = f'{year}/{month}'
+    archive_format = archive_files.get_archive_format()
+    version = get_version()
+    archive_manifest, _ = manifest.load_manifest(s3_client, bucket_name)
+    keys = manifest.get_folder_keys(archive_manifest, folder_path)
 
     for data_type in ['watering', 'recording']:
-        type_keys = [key for key in keys if data_type in key and
-                     key.split('_')[-1] != f'{str(YESTERDAY.day)}.csv']
-
+        type_keys = [key for key in keys if manifest.get_key_data_type(key) == data_type
+                     and not is_live_key(key)]
         # ^^ Don't want data from live files
-        responses = [s3_client.get_object(
-            Bucket=bucket_name, Key=key) for key in type_keys]
-        # ^^ List comprehension handles start / end of month
-
-        dfs = []
-
-        for response in responses:
-            try:
-                df = pd.read_csv(response.get("Body"))
-                dfs.append(df)
-            except pd.errors.EmptyDataError:
-                pass
-
-        if dfs:
-            final_df = pd.concat(dfs, ignore_index=True)
-            save_df_to_s3_bucket(
-                s3_client, final_df, f"{folder_path}/{data_type}.csv", bucket_name)
 
-        s3_client.delete_object(
-            Bucket=bucket_name, Key=f"{folder_path}/{data_type}_{DAY_BEFORE_YESTERDAY.day}.csv")
+        if len(type_keys) <= 1 and all(get_key_day(key) is None and
+                                       archive_files.get_key_format(key) == archive_format
+                                       for key in type_keys):
+            # Nothing new to add to the month file
+            continue
+
+        month_key = get_month_key(folder_path, data_type, archive_format, version)
+        rollup_writers = None
+        if data_type == 'recording':
+            rollup_writers = open_rollup_writers(s3_client, data_type, year, month, bucket_name,
+                                                 version)
+        month_entry = compaction.compact_files(s3_client, type_keys, month_key, bucket_name,
+                                               ARCHIVE_COLUMNS[data_type],
+                                               rollup_writers=rollup_writers)
+
+        added = {month_key: month_entry} if month_entry else {}
+        combined_keys = list(type_keys)
+        if rollup_writers and month_entry:
+            added.update(save_rollups(s3_client, rollup_writers, month_entry, bucket_name))
+            # Every earlier version is replaced, whatever its format
+            combined_keys += get_month_rollup_keys(archive_manifest, data_type, year, month)
+        # The manifest moves readers over to the new files (in one conditional put) before the
+        # files they replace are deleted
+        manifest.update_manifest(s3_client, bucket_name, added=added, removed=combined_keys)
+        index_keys = [archive_files.get_index_key(key) for key in combined_keys
+                      if archive_manifest['files'][key].get('indexed')]
+        delete_keys(s3_client, combined_keys + index_keys, bucket_name)
+
+
+def combine_files_for_months(s3_client: client, bucket_name: str):
+    """
+    Compacts every month with parts to add (see get_months_to_compact), so parts written into an
+    earlier month's folder don't build up there uncompacted.
+    """
+    archive_manifest, _ = manifest.load_manifest(s3_client, bucket_name)
+    for year, month in get_months_to_compact(archive_manifest):
+        combine_csv_files_for_month(s3_client, bucket_name, year, month)
 
 
 def management():
     """Function to run the whole management script."""
     s3_client = create_s3_client()
-    combine_csv_files_for_month(s3_client, environ['BUCKET_NAME'])
+    combine_files_for_months(s3_client, environ['BUCKET_NAME'])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+"""Unit tests for compaction.py"""
+from io import BytesIO
+import json
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+
+import archive_files
+import compaction
+from compaction import compact_files, merge_sorted_chunks
+import rollups
+
+
+COLUMNS = ['id', 'plant_id', 'datetime']
+
+
+@pytest.fixture
+def s3_objects():
+    """Returns the objects of a fake bucket, as (body, metadata) by key."""
+    return {}
+
+
+@pytest.fixture
+def s3_client_mock(s3_objects):
+    """Returns a mock s3 client with ranged reads and multipart uploads, over s3_objects."""
+    s3_client_mock = MagicMock()
+    uploads = {}
+
+    def get_object(Bucket, Key, Range=None):
+        body, metadata = s3_objects[Key]
+        if Range:
+            start, end = Range.removeprefix('bytes=').split('-')
+            body = body[int(start):int(end) + 1]
+        return {'Body': BytesIO(body), 'Metadata': metadata}
+
+    def create_multipart_upload(Bucket, Key, Metadata):
+        uploads[Key] = []
+        return {'UploadId': Key}
+
+    def upload_part(Body, Bucket, Key, PartNumber, UploadId):
+        uploads[UploadId].append(Body)
+        return {'ETag': str(PartNumber)}
+
+    def complete_multipart_upload(Bucket, Key, UploadId, MultipartUpload):
+        s3_objects[Key] = (b''.join(uploads.pop(UploadId)), archive_files.SORTED_METADATA)
+        return {'ETag': '"etag"'}
+
+    s3_client_mock.get_object.side_effect = get_object
+    s3_client_mock.head_object.side_effect = lambda Bucket, Key: {
+        'ContentLength': len(s3_objects[Key][0])}
+    s3_client_mock.create_multipart_upload.side_effect = create_multipart_upload
+    s3_client_mock.upload_part.side_effect = upload_part
+    s3_client_mock.complete_multipart_upload.side_effect = complete_multipart_upload
+    return s3_client_mock
+
+
+def get_waterings(plant_ids: list[int], hours: list[int]) -> pd.DataFrame:
+    """Returns waterings of the given plants at the given hours of 10/12/2023."""
+    return pd.DataFrame({'id': range(len(plant_ids)),
+                         'plant_id': plant_ids,
+                         'datetime': pd.to_datetime([f'2023-12-10 {hour:02}:00'
+                                                     for hour in hours])})
+
+
+def test_merge_sorted_chunks_orders_and_drops_duplicates():
+    """Test chunks from several inputs are merged in order, with repeated rows dropped."""
+    inputs = {'a': [get_waterings([1, 1], [1, 3]), get_waterings([2], [1])],
+              'b': [get_waterings([1, 1], [2, 3]), get_waterings([1, 3], [3, 0])]}
+
+    result = pd.concat(merge_sorted_chunks(inputs))
+
+    assert list(zip(result['plant_id'], result['datetime'].dt.hour)) == [
+        (1, 1), (1, 2), (1, 3), (2, 1), (3, 0)]
+
+
+def test_merge_sorted_chunks_unsorted_input():
+    """Test an input out of order is refused rather than merged wrongly."""
+    with pytest.raises(ValueError):
+        list(merge_sorted_chunks({'a': [get_waterings([2, 1], [1, 1])]}))
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'parquet'])
+def test_compact_files_merges_csv_and_parquet(s3_client_mock, s3_objects, output_format):
+    """
+    Test an unsorted csv month file (with a saved index), a sorted csv part and a parquet part are
+    merged into one sorted file without duplicates or the index, over several upload parts.
+    """
+    s3_objects['2023/12/watering.csv'] = (
+        get_waterings([2, 1], [5, 1]).to_csv().encode(), {})
+    s3_objects['2023/12/watering_10/1.csv'] = (
+        get_waterings([1, 2], [1, 6]).to_csv(index=False).encode(), archive_files.SORTED_METADATA)
+    s3_objects['2023/12/watering_10/2.parquet'] = (
+        archive_files.get_file_body(get_waterings([1, 3], [2, 0]), 'parquet'), {})
+
+    result = compact_files(s3_client_mock, list(s3_objects), f'2023/12/watering.{output_format}',
+                           'test', COLUMNS, part_size=16)
+
+    assert (result['rows'], result['min_datetime']) == (5, '2023-12-10T00:00:00')
+    assert s3_client_mock.upload_part.call_count > 1
+    df = archive_files.read_archive_file(s3_client_mock, f'2023/12/watering.{output_format}',
+                                         'test')
+    assert list(df.columns) == COLUMNS
+    assert list(zip(df['plant_id'], df['datetime'].dt.hour)) == [
+        (1, 1), (1, 2), (2, 5), (2, 6), (3, 0)]
+
+
+def test_compact_files_csv_plant_offsets(s3_client_mock, s3_objects, monkeypatch):
+    """Test a compacted csv file's index object has each plant's byte range, across chunks."""
+    monkeypatch.setattr(compaction, 'CHUNK_ROWS', 1)
+    s3_objects['2023/12/watering_10/1.csv'] = (
+        get_waterings([1, 2, 2, 3], [1, 1, 2, 0]).to_csv(index=False).encode(),
+        archive_files.SORTED_METADATA)
+    s3_objects['2023/12/watering_10/2.csv'] = (
+        get_waterings([2], [3]).to_csv(index=False).encode(), archive_files.SORTED_METADATA)
+
+    result = compact_files(s3_client_mock, list(s3_objects), '2023/12/watering.csv', 'test',
+                           COLUMNS)
+
+    body = s3_objects['2023/12/watering.csv'][0]
+    index = json.loads(s3_client_mock.put_object.call_args.kwargs['Body'])
+    start, end = index['plant_offsets']['2']
+    assert result['indexed'] and 'plant_offsets' not in result
+    assert s3_client_mock.put_object.call_args.kwargs['Key'] == '2023/12/watering.csv.index.json'
+    assert index['etag'] == result['etag']
+    assert body[start:end].decode().count('\n') == 3
+    assert all(',2,' in line for line in body[start:end].decode().splitlines())
+    assert sorted(index['plant_offsets']) == ['1', '2', '3']
+
+
+@pytest.mark.parametrize('rollup_format', ['csv', 'parquet'])
+def test_compact_files_streams_rollups(s3_client_mock, s3_objects, monkeypatch, rollup_format):
+    """Test the rollups streamed out a plant at a time match rolling up the whole month at once."""
+    monkeypatch.setattr(compaction, 'CHUNK_ROWS', 2)
+    recordings = pd.DataFrame({
+        'id': range(6), 'plant_id': [1, 1, 1, 2, 2, 3],
+        'soil_moisture': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        'temperature': [10.0, 11.0, 12.0, 13.0, 14.0, 15.0],
+        'datetime': pd.to_datetime(['2023-12-10 00:01', '2023-12-10 00:02', '2023-12-11 01:01',
+                                    '2023-12-10 00:01', '2023-12-10 00:05', '2023-12-10 00:01'])})
+    s3_objects['2023/12/recording_10/1.csv'] = (recordings.to_csv(index=False).encode(),
+                                                archive_files.SORTED_METADATA)
+    keys = {resolution: f'rollups/{resolution}/recording/2023/12.{rollup_format}'
+            for resolution in rollups.RESOLUTIONS}
+    rollup_writers = {resolution: compaction.ArchiveFileWriter(
+                          s3_client_mock, 'test', key, get_table=rollups.get_rollup_table)
+                      for resolution, key in keys.items()}
+
+    compact_files(s3_client_mock, list(s3_objects), '2023/12/recording.csv', 'test',
+                  list(recordings.columns), rollup_writers=rollup_writers)
+    for writer in rollup_writers.values():
+        writer.close()
+        writer.complete()
+
+    expected = rollups.get_rollups([rollups.get_partial_rollup(recordings, '10min')])
+    for resolution, key in keys.items():
+        pd.testing.assert_frame_equal(archive_files.read_archive_file(s3_client_mock, key, 'test'),
+                                      expected[resolution], check_dtype=False)
+
+
+def test_compact_files_aborts_on_failure(s3_client_mock, s3_objects):
+    """
+    Test the upload (and those of the rollups) is abandoned, and the month file left alone, if the
+    merge fails.
+    """
+    s3_objects['2023/12/watering_10/1.csv'] = (
+        get_waterings([2, 1], [1, 1]).to_csv(index=False).encode(), archive_files.SORTED_METADATA)
+    rollup_writer = MagicMock()
+
+    with pytest.raises(ValueError):
+        compact_files(s3_client_mock, list(s3_objects), '2023/12/watering.csv', 'test', COLUMNS,
+                      rollup_writers={'1h': rollup_writer})
+
+    s3_client_mock.abort_multipart_upload.assert_called_once()
+    rollup_writer.abort.assert_called_once()
+    assert '2023/12/watering.csv' not in s3_objects
@@ -0,0 +1,56 @@
+"""Unit tests for rebuild_manifest.py"""
+from io import BytesIO
+from unittest.mock import MagicMock
+
+from botocore.exceptions import ClientError
+import pandas as pd
+
+import archive_files
+from rebuild_manifest import rebuild_manifest
+
+
+def test_rebuild_manifest_lists_archive_files():
+    """Test every archive file (and nothing else) is listed with its rows and datetime range."""
+    df = pd.DataFrame({'plant_id': [1, 2],
+                       'datetime': pd.to_datetime(['2023-12-10 01:00', '2023-12-10 03:00'])})
+    bodies = {'2023/12/watering.csv': df.to_csv(index=False).encode(),
+              '2023/12/watering_11/1.parquet': archive_files.get_file_body(df, 'parquet'),
+              'rollups/1h/watering/2023/12.csv': df.to_csv(index=False).encode(),
+              '2023/11/watering-20231212001500-1a2b3c4d.csv': df.to_csv(index=False).encode(),
+              '2023/11/watering-20231212001500-1a2b3c4d.csv.index.json': b'{}',
+              'rollups/1d/watering/2023/11-20231212001500-1a2b3c4d.parquet':
+                  archive_files.get_file_body(df, 'parquet'),
+              'archive_state/watering.json': b'{}',
+              'notes/plants.csv': b'plant_id\n1\n'}
+    s3_client_mock = MagicMock()
+    s3_client_mock.list_objects.return_value = {'Contents': [{'Key': key} for key in bodies]}
+    s3_client_mock.head_object.side_effect = lambda Bucket, Key: {
+        'ContentLength': len(bodies[Key]), 'ETag': f'"{Key}"'}
+
+    def get_object(Bucket, Key, Range=None):
+        if Key not in bodies:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        body = bodies[Key]
+        if Range:
+            start, end = Range.removeprefix('bytes=').split('-')
+            body = body[int(start):int(end) + 1]
+        return {'Body': BytesIO(body)}
+
+    s3_client_mock.get_object.side_effect = get_object
+
+    result = rebuild_manifest(s3_client_mock, 'test')
+
+    assert sorted(result['files']) == [
+        '2023/11/watering-20231212001500-1a2b3c4d.csv', '2023/12/watering.csv',
+        '2023/12/watering_11/1.parquet',
+        'rollups/1d/watering/2023/11-20231212001500-1a2b3c4d.parquet',
+        'rollups/1h/watering/2023/12.csv']
+    rollup_entry = result['files']['rollups/1h/watering/2023/12.csv']
+    assert (rollup_entry['resolution'], rollup_entry['max_datetime']) == (
+        '1h', '2023-12-10T03:59:59.999999')
+    entry = result['files']['2023/12/watering_11/1.parquet']
+    assert (entry['rows'], entry['min_datetime'], entry['max_datetime']) == (
+        2, '2023-12-10T01:00:00', '2023-12-10T03:00:00')
+    assert result['files']['2023/11/watering-20231212001500-1a2b3c4d.csv']['indexed']
+    assert 'indexed' not in result['files']['2023/12/watering.csv']
+    assert s3_client_mock.put_object.call_args.kwargs['IfNoneMatch'] == '*'
@@ -0,0 +1,91 @@
+"""Unit tests for rollups.py"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from rollups import (get_partial_rollup, combine_partial_rollups, get_rollup,
+                     get_partial_from_rollup, track_rollups, get_rollups, get_chart_minutes,
+                     get_resolution)
+
+
+@pytest.fixture
+def recordings():
+    """Returns two hours of minute recordings of two plants, with a missing temperature."""
+    times = pd.date_range('2023-12-10 23:00', periods=120, freq='1min')
+    df = pd.DataFrame({'plant_id': np.repeat([1, 2], 120),
+                       'soil_moisture': np.arange(240, dtype=float),
+                       'temperature': np.arange(240, dtype=float) / 10,
+                       'datetime': np.tile(times, 2)})
+    df.loc[5, 'temperature'] = None
+    return df
+
+
+def test_get_rollups_match_resampling(recordings):
+    """Test each resolution's rollup matches resampling the recordings directly."""
+    result = get_rollups([get_partial_rollup(recordings, '10min')])
+
+    hourly = result['1h'][result['1h']['plant_id'] == 1]
+    expected = recordings[recordings['plant_id'] == 1].resample('1h', on='datetime')
+    assert list(hourly['temperature_mean']) == pytest.approx(list(expected['temperature'].mean()))
+    assert list(hourly['temperature_count']) == [59, 60]
+    assert list(result['1d']['soil_moisture_max']) == [59.0, 119.0, 179.0, 239.0]
+    assert len(result['10min']) == 24
+
+
+class RollupWriter:
+    """Collects the rollups written to it."""
+
+    def __init__(self) -> None:
+        self.rollups = []
+
+    def write(self, rollup: pd.DataFrame):
+        self.rollups.append(rollup)
+
+    def get_rollup(self) -> pd.DataFrame:
+        return pd.concat(self.rollups, ignore_index=True)
+
+
+def test_combined_partials_match_whole(recordings):
+    """Test rolling up in chunks, or from stored rollups, gives the same as all at once."""
+    chunks = [recordings.iloc[:70], recordings.iloc[70:]]
+    rollup_writers = {resolution: RollupWriter() for resolution in ('10min', '1h', '1d')}
+    list(track_rollups(chunks, rollup_writers))
+
+    in_chunks = rollup_writers['1h'].get_rollup()
+    whole = get_rollup(get_partial_rollup(recordings, '1h'))
+    from_rollup = get_rollup(combine_partial_rollups(
+        [get_partial_from_rollup(rollup_writers['10min'].get_rollup())], '1h'))
+
+    pd.testing.assert_frame_equal(in_chunks, whole)
+    pd.testing.assert_frame_equal(in_chunks, from_rollup)
+
+
+def test_track_rollups_writes_each_plant_once_finished(recordings):
+    """Test a plant's rollups are written as soon as the chunks move on from it, whole."""
+    chunks = [recordings.iloc[:70], recordings.iloc[70:150], recordings.iloc[150:]]
+    rollup_writers = {resolution: RollupWriter() for resolution in ('10min', '1h', '1d')}
+    tracked = track_rollups(chunks, rollup_writers)
+
+    next(tracked)
+    assert not rollup_writers['1h'].rollups
+    next(tracked)
+    assert [list(rollup['plant_id'].unique()) for rollup in rollup_writers['1h'].rollups] == [[1]]
+    list(tracked)
+    assert [list(rollup['plant_id'].unique())
+            for rollup in rollup_writers['1h'].rollups] == [[1], [2]]
+    assert list(rollup_writers['1d'].get_rollup()['soil_moisture_count']) == [60, 60, 60, 60]
+
+
+def test_get_chart_minutes_keeps_to_point_budget():
+    """Test the sample rate is kept when it fits, and otherwise coarsened onto a rollup."""
+    assert get_chart_minutes(24 * 60, 7) == 7
+    assert get_chart_minutes(7 * 24 * 60, 1) == 3
+    assert get_chart_minutes(365 * 24 * 60, 10) == 120
+
+
+def test_get_resolution_coarsest_exact():
+    """Test the coarsest rollup which chart points can be built from exactly is chosen."""
+    assert get_resolution(7) is None
+    assert get_resolution(20) == '10min'
+    assert get_resolution(120) == '1h'
+    assert get_resolution(2880) == '1d'
@@ -1,11 +1,17 @@
 """Unit tests for s3_data_management.py"""
+from datetime import datetime
 from os import environ
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
-from s3_data_management import get_bucket_keys
+import pandas as pd
 
 environ['BUCKET_NAME'] = 'test'
 
+import manifest
+import rollups
+import s3_data_management
+from s3_data_management import get_bucket_keys, get_key_day
+
 
 def test_get_bucket_keys_correct_keys():
     """Test the bucket keys returned are just csv files."""
@@ -17,6 +23,7 @@ def test_get_bucket_keys_correct_keys():
         {'Key': 'folder/file2.json'},
         {'Key': 'other_folder/file3.txt'},
         {'Key': 'folder/file4.csv'},
+        {'Key': 'folder/file4.csv.index.json'},
     ]
 
     s3_client_mock.list_objects.return_value = {'Contents': sample_objects}
@@ -25,4 +32,131 @@ def test_get_bucket_keys_correct_keys():
 
     s3_client_mock.list_objects.assert_called_once_with(
         Bucket=bucket_name, Prefix=folder_path)
-    assert result == ['folder/file1.csv', 'folder/file4.csv']
+    assert result == ['folder/file1.csv', 'folder/file4.csv', 'folder/file4.csv.index.json']
+
+
+def test_get_bucket_keys_follows_truncated_listings():
+    """Test listing carries on past the first 1,000 keys from the last key returned."""
+    s3_client_mock = MagicMock()
+    s3_client_mock.list_objects.side_effect = [
+        {'Contents': [{'Key': 'folder/file1.csv'}], 'IsTruncated': True},
+        {'Contents': [{'Key': 'folder/file2.csv'}], 'IsTruncated': False}
+    ]
+
+    result = get_bucket_keys(s3_client_mock, 'folder', 'test')
+
+    assert result == ['folder/file1.csv', 'folder/file2.csv']
+    assert s3_client_mock.list_objects.call_args.kwargs['Marker'] == 'folder/file1.csv'
+
+
+def test_get_key_day_day_and_part_files():
+    """Test the day is found for day and part files, and not for month files."""
+    assert get_key_day('2023/12/recording.csv') is None
+    assert get_key_day('2023/12/recording-20231212001500-1a2b3c4d.csv') is None
+    assert get_key_day('2023/12/recording_17.csv') == 17
+    assert get_key_day('2023/12/watering_3/20231204000000000000.csv') == 3
+
+
+def test_get_key_day_parquet_files():
+    """Test the day is found for parquet part files, and not for parquet month files."""
+    assert get_key_day('2023/12/recording.parquet') is None
+    assert get_key_day('2023/12/watering_3/20231204000000000000.parquet') == 3
+
+
+def get_entry(key: str) -> dict:
+    """Returns the manifest entry of a file of rows from 1/11/2023."""
+    return manifest.get_file_entry(key, 1, 10, '"etag"', datetime(2023, 11, 1),
+                                   datetime(2023, 11, 1))
+
+
+@patch('s3_data_management.DAY_BEFORE_YESTERDAY', datetime(2023, 11, 5))
+@patch('s3_data_management.delete_keys')
+@patch('s3_data_management.manifest.update_manifest')
+@patch('s3_data_management.manifest.load_manifest')
+@patch('s3_data_management.compaction.compact_files')
+def test_combine_files_writes_new_versions(mock_compact_files, mock_load_manifest,
+                                           mock_update_manifest, mock_delete_keys):
+    """
+    Test the month file and rollups are written to new keys, and the files they replace are only
+    removed from the manifest and deleted (with their index objects) after the manifest lists the
+    new ones.
+    """
+    old_keys = ['2023/11/recording-20231104001500-00000000.csv', '2023/11/recording_3/1.csv',
+                'rollups/1h/recording/2023/11-20231104001500-00000000.csv',
+                'rollups/1d/recording/2023/11.parquet']
+    mock_load_manifest.return_value = (
+        {'files': {key: get_entry(key) for key in old_keys + ['2023/1/recording.csv']}}, '"v1"')
+    mock_load_manifest.return_value[0]['files']['2023/11/recording_3/1.csv']['indexed'] = True
+
+    def compact_files(s3_client, keys, output_key, bucket_name, columns, rollup_writers=None):
+        list(rollups.track_rollups([pd.DataFrame({
+            'plant_id': [1], 'datetime': [pd.Timestamp('2023-11-01')], 'soil_moisture': [1.0],
+            'temperature': [1.0]})], rollup_writers))
+        return get_entry(output_key)
+
+    mock_compact_files.side_effect = compact_files
+    s3_client_mock = MagicMock()
+    s3_client_mock.put_object.return_value = {'ETag': '"new"'}
+    s3_client_mock.upload_part.return_value = {'ETag': '"1"'}
+    s3_client_mock.complete_multipart_upload.return_value = {'ETag': '"new"'}
+
+    s3_data_management.combine_csv_files_for_month(s3_client_mock, 'test')
+
+    month_key = mock_compact_files.call_args.args[2]
+    assert month_key.startswith('2023/11/recording-') and month_key not in old_keys
+    added, removed = (mock_update_manifest.call_args.kwargs['added'],
+                      mock_update_manifest.call_args.kwargs['removed'])
+    version = month_key.split('recording-')[1].split('.')[0]
+    assert sorted(added) == sorted([month_key] + [
+        f'rollups/{resolution}/recording/2023/11-{version}.csv'
+        for resolution in ('10min', '1h', '1d')])
+    assert sorted(removed) == sorted(old_keys)
+    assert all(call.kwargs['Key'] not in old_keys
+               for call in s3_client_mock.put_object.call_args_list)
+    assert all(call.kwargs['Key'] not in old_keys
+               for call in s3_client_mock.create_multipart_upload.call_args_list)
+    mock_delete_keys.assert_called_once_with(
+        s3_client_mock, removed + ['2023/11/recording_3/1.csv.index.json'], 'test')
+
+
+@patch('s3_data_management.YESTERDAY', datetime(2023, 12, 1))
+@patch('s3_data_management.DAY_BEFORE_YESTERDAY', datetime(2023, 11, 30))
+def test_get_months_to_compact():
+    """
+    Test earlier months with parts are compacted along with the day before yesterday's, and months
+    with only month files, rollups or live parts aren't.
+    """
+    keys = ['2023/9/recording-20231001001500-00000000.csv', '2023/10/watering_12/1.csv',
+            '2023/11/recording_29/1.csv', '2023/12/recording_1/1.csv',
+            'rollups/1h/recording/2023/8-20230901001500-00000000.csv']
+
+    result = s3_data_management.get_months_to_compact({'files': {key: {} for key in keys}})
+
+    assert result == [(2023, 10), (2023, 11)]
+
+
+@patch('s3_data_management.YESTERDAY', datetime(2023, 11, 6))
+@patch('s3_data_management.DAY_BEFORE_YESTERDAY', datetime(2023, 11, 5))
+@patch('s3_data_management.delete_keys')
+@patch('s3_data_management.manifest.update_manifest')
+@patch('s3_data_management.manifest.load_manifest')
+@patch('s3_data_management.compaction.compact_files')
+def test_combine_files_for_months_late_part(mock_compact_files, mock_load_manifest,
+                                            mock_update_manifest, mock_delete_keys):
+    """
+    Test a part written late into an earlier month's folder (a watering re-archived into the day it
+    happened) is compacted into that month's file, and removed from the manifest.
+    """
+    keys = ['2023/10/watering-20231101001500-00000000.csv', '2023/10/watering_12/1.csv',
+            '2023/11/watering-20231105001500-00000000.csv']
+    mock_load_manifest.return_value = ({'files': {key: get_entry(key) for key in keys}}, '"v1"')
+    mock_compact_files.side_effect = lambda s3_client, keys, output_key, *args, **kwargs: (
+        get_entry(output_key))
+
+    s3_data_management.combine_files_for_months(MagicMock(), 'test')
+
+    [(compacted_keys, month_key)] = [call.args[1:3] for call in mock_compact_files.call_args_list]
+    assert compacted_keys == keys[:2]
+    assert month_key.startswith('2023/10/watering-')
+    assert mock_update_manifest.call_args.kwargs['removed'] == keys[:2]
+    assert mock_delete_keys.call_args.args[1] == keys[:2]
@@ -1,7 +1,8 @@
 """Unit tests for update_duties.py"""
 import pandas as pd
 from unittest.mock import MagicMock, patch
-from update_duties import get_api_botanist_name_by_plant_id, check_if_duty_exists_in_duties
+from update_duties import (get_api_botanist_name_by_plant_id, check_if_duty_exists_in_duties,
+                           get_api_botanist_names, get_duty_changes)
 
 
 @patch('update_duties.get')
@@ -46,3 +47,53 @@ def test_check_if_duty_exists_in_duties_false():
     duties_df = pd.DataFrame(duties_data)
     result = check_if_duty_exists_in_duties(4, 102, duties_df)
     assert result is False
+
+
+def test_get_api_botanist_name_by_plant_id_uses_session():
+    """Testing the request is made over the session given."""
+    mock_session = MagicMock()
+    mock_session.get.return_value.json.return_value = {'botanist': {'name': 'Jane Doe'}}
+
+    result = get_api_botanist_name_by_plant_id(7, mock_session)
+
+    assert result == ['Jane', 'Doe']
+    assert mock_session.get.call_args.args[0].endswith('/7')
+
+
+@patch('update_duties.Session')
+def test_get_api_botanist_names_skips_failed_plants(mock_session_class):
+    """Testing every plant is requested over one session, and failed requests are left out."""
+    def get_plant(url, timeout):
+        if url.endswith('/2'):
+            raise ConnectionError('API unavailable')
+        response = MagicMock()
+        response.json.return_value = {'botanist': {'name': f'Botanist {url[-1]}'}}
+        return response
+
+    mock_session = mock_session_class.return_value.__enter__.return_value
+    mock_session.get.side_effect = get_plant
+
+    result = get_api_botanist_names([1, 2, 3], max_workers=3)
+
+    assert result == {1: ['Botanist', '1'], 3: ['Botanist', '3']}
+    assert mock_session.get.call_count == 3
+    assert mock_session_class.call_count == 1
+
+
+def test_get_duty_changes():
+    """Testing only plants whose API botanist has no active duty for them are changed."""
+    active_duties = pd.DataFrame({'plant_id': [1, 2], 'botanist_id': [101, 102]})
+    botanist_ids = {('John', 'Doe'): 101, ('Jane', 'Doe'): 102}
+    botanist_names = {1: ['John', 'Doe'], 2: ['John', 'Doe'], 3: ['Jane', 'Doe'],
+                      4: ['Unknown', 'Botanist'], 5: []}
+
+    result = get_duty_changes(botanist_names, botanist_ids, active_duties)
+
+    assert result == {2: 101, 3: 102}
+
+
+def test_get_duty_changes_no_active_duties():
+    """Testing every plant gets a duty if there are no active duties."""
+    result = get_duty_changes({1: ['John', 'Doe']}, {('John', 'Doe'): 101}, pd.DataFrame([]))
+
+    assert result == {1: 101}
@@ -1,51 +1,106 @@
 """
 Module containing functions to update duty table in database according to current state of the API
-data.
+data. Every plant's botanist is fetched from the API concurrently (over one pooled session), and
+compared with the active duties in memory; the changed duties are then applied in one transaction.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 from dotenv import load_dotenv
 import pandas as pd
-from requests import get
+from requests import get, Session
+from requests.adapters import HTTPAdapter
 
 import database_functions as dbf
+from metrics import METRICS
 
 
 BASE_URL = "https://data-eng-plants-api.herokuapp.com/plants/"
+MAX_WORKERS = 25
+REQUEST_TIMEOUT = 30
 
 
-def get_api_botanist_name_by_plant_id(plant_id: int) -> list[dict]:
-    """Gets plant data from API using ID."""
-    api_botanist_info = get(BASE_URL + str(plant_id),
-                            timeout=100).json().get('botanist', {})
+def get_api_botanist_name_by_plant_id(plant_id: int, session: Session = None) -> list[str]:
+    """Gets the name of the plant's botanist from the API using ID, over the session if given."""
+    request = session.get if session is not None else get
+    api_botanist_info = request(BASE_URL + str(plant_id),
+                                timeout=REQUEST_TIMEOUT).json().get('botanist', {})
     return api_botanist_info.get('name', '').split()
 
 
+def get_api_botanist_names(plant_ids: list[int],
+                           max_workers: int = MAX_WORKERS) -> dict[int, list[str]]:
+    """
+    Gets the name of each plant's botanist from the API, with up to max_workers requests at once
+    sharing one session's connections; plants whose request fails are left out.
+    """
+    def get_botanist_name(session: Session, plant_id: int) -> list[str]:
+        METRICS.increment('api_requests')
+        try:
+            return get_api_botanist_name_by_plant_id(plant_id, session)
+        except Exception as e:  # pylint: disable=broad-except
+            METRICS.increment('api_errors')
+            print(f'Error getting botanist for plant with id {plant_id}: {e}')
+            return None
+
+    with Session() as session:
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        session.mount(BASE_URL, adapter)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            names = executor.map(partial(get_botanist_name, session), plant_ids)
+            return {plant_id: name for plant_id, name in zip(plant_ids, names)
+                    if name is not None}
+
+
 def check_if_duty_exists_in_duties(plant_id: int, botanist_id: int, duties: pd.DataFrame) -> bool:
     """Returns whether there is a duty in dataframe matching both plant and botanist id."""
     return not duties[(duties['plant_id'] == plant_id) &
                       (duties['botanist_id'] == botanist_id)].empty
 
 
+def get_duty_changes(botanist_names: dict[int, list[str]],
+                     botanist_ids: dict[tuple[str, str], int],
+                     active_duties: pd.DataFrame) -> dict[int, int]:
+    """
+    Returns the new duty (plant id: botanist id) of every plant whose botanist in the API has no
+    active duty for it; plants without a full botanist name, or whose botanist isn't in the
+    database, are left as they are.
+    """
+    active_pairs = set() if active_duties.empty else set(
+        zip(active_duties['plant_id'], active_duties['botanist_id']))
+
+    new_duties = {}
+    for plant_id, botanist_name in botanist_names.items():
+        if len(botanist_name) != 2:
+            continue
+        botanist_id = botanist_ids.get(tuple(botanist_name))
+        if botanist_id is None:
+            print(f'No botanist named {" ".join(botanist_name)} for plant with id {plant_id}.')
+            continue
+        if (plant_id, botanist_id) not in active_pairs:
+            new_duties[plant_id] = botanist_id
+    return new_duties
+
+
 def cross_reference_api_and_db_duties():
     """Checks and updates duty table in db based on current API data."""
     database = dbf.MSSQL_Database()
 
-    plant_ids = dbf.get_db_plant_ids(database)
-    active_duties = dbf.get_active_duties(database)
+    try:
+        plant_ids = dbf.get_db_plant_ids(database)
+        active_duties = dbf.get_active_duties(database)
+        botanist_ids = dbf.get_botanist_ids_by_name(database)
+
+        botanist_names = get_api_botanist_names(plant_ids)
+        new_duties = get_duty_changes(botanist_names, botanist_ids, active_duties)
+        print(f'Checked duties of {len(botanist_names)} plants; {len(new_duties)} have changed.')
 
-    check_for_existing_duty = partial(
-        check_if_duty_exists_in_duties, duties=active_duties)
+        dbf.apply_duty_changes(database, new_duties)
+        METRICS.increment('duties_changed', len(new_duties))
 
-    for plant_id in plant_ids:
-        botanist_name = get_api_botanist_name_by_plant_id(plant_id)
-        print(f'Checking duty for plant with id {plant_id}...')
-        if len(botanist_name) == 2:
-            botanist_id = dbf.get_botanist_by_name(
-                botanist_name[0], botanist_name[1], database)[0]
-            if not check_for_existing_duty(plant_id, botanist_id):
-                dbf.add_duty(database, plant_id, botanist_id)
+    finally:
+        database.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+"""
+Script to time how long the dashboard takes to read 1, 3 and 12 months of recordings from the s3
+archive, with one download worker (reading the files one after another) and with the full pool.
+With --plant, just that plant's rows are read, as the dashboard does. By default the archive is a
+generated one held in memory, behind the benchmarks' fake s3 client (benchmarks/offline.py), which
+adds a fixed latency to each request and limits the bandwidth of each download, so no AWS access
+is needed; with --bucket, the real archive in that bucket is read instead (ending yesterday).
+
+    python benchmark_s3_extraction.py --format parquet --latency 0.08
+"""
+
+import argparse
+from datetime import date, datetime, timedelta
+from os import environ, path
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+environ.setdefault('BUCKET_NAME', 'benchmark')
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'benchmarks'))
+
+import archive_files  # pylint: disable=wrong-import-position
+import manifest  # pylint: disable=wrong-import-position
+import offline  # pylint: disable=wrong-import-position
+import s3_data_extraction  # pylint: disable=wrong-import-position
+
+
+BENCHMARK_MONTHS = (1, 3, 12)
+BENCHMARK_YEAR = 2023
+DEFAULT_PLANTS = 50
+DEFAULT_STEP_MINUTES = 10
+DEFAULT_LATENCY = 0.05  # Seconds before the first byte of each request
+DEFAULT_BANDWIDTH = 50 * 1024 * 1024  # Bytes per second, per connection
+
+
+def get_month_recordings(month: int, plants: int, step_minutes: int) -> pd.DataFrame:
+    """Returns generated recordings of every plant for the month, one every step_minutes."""
+    month_start = pd.Timestamp(BENCHMARK_YEAR, month, 1)
+    times = pd.date_range(month_start, month_start + pd.offsets.MonthBegin(1),
+                          freq=f'{step_minutes}min', inclusive='left')
+    rng = np.random.default_rng(month)
+    rows = plants * len(times)
+    return pd.DataFrame({'id': np.arange(rows),
+                         'plant_id': np.repeat(np.arange(1, plants + 1), len(times)),
+                         'soil_moisture': rng.uniform(10, 100, rows).round(4),
+                         'temperature': rng.uniform(10, 20, rows).round(4),
+                         'datetime': np.tile(times, plants)})
+
+
+def create_archive(s3_client: offline.FakeS3Client, archive_format: str, plants: int,
+                   step_minutes: int) -> None:
+    """Writes a month file of recordings for each month of BENCHMARK_YEAR, with its manifest."""
+    entries = {}
+    for month in range(1, 13):
+        key = f'{BENCHMARK_YEAR}/{month}/recording.{archive_format}'
+        df = get_month_recordings(month, plants, step_minutes)
+        plant_offsets = {}
+        if archive_format == 'csv':
+            body = archive_files.get_indexed_csv_body(df, plant_offsets)
+        else:
+            body = archive_files.get_file_body(df, archive_format)
+        response = s3_client.put_object(Body=body, Bucket='benchmark', Key=key)
+        indexed = archive_files.save_plant_offsets(s3_client, 'benchmark', key, response['ETag'],
+                                                   plant_offsets)
+        entries[key] = manifest.get_file_entry(key, len(df), len(body), response['ETag'],
+                                               df['datetime'].min(), df['datetime'].max(),
+                                               indexed)
+    manifest.save_manifest(s3_client, {'files': entries}, 'benchmark')
+
+
+def time_read(s3_client, range_start: date, range_end: date, bucket_name: str, workers: int,
+              repeats: int, plant_id: int = None) -> tuple[float, int]:
+    """Returns the best time of repeated reads of the range with the given workers, and its rows."""
+    s3_data_extraction.MAX_DOWNLOAD_WORKERS = workers
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        df = s3_data_extraction.get_s3_data_for_type_and_date_ranges(
+            s3_client, 'recording', range_start, range_end, bucket_name, plant_id=plant_id)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(df)
+
+
+def run_benchmark(s3_client, range_end: date, bucket_name: str, workers: int, repeats: int,
+                  plant_id: int = None) -> list[dict]:
+    """
+    Times reading each of BENCHMARK_MONTHS up to range_end, serially and with the pool; with the
+    fake client, the megabytes downloaded per read are given too.
+    """
+    results = []
+    for months in BENCHMARK_MONTHS:
+        range_start = (pd.Timestamp(range_end) + timedelta(days=1)
+                       - pd.DateOffset(months=months)).date()
+        for worker_count in (1, workers):
+            bytes_read = getattr(s3_client, 'bytes_read', 0)
+            seconds, rows = time_read(s3_client, range_start, range_end, bucket_name,
+                                      worker_count, repeats, plant_id)
+            result = {'months': months, 'workers': worker_count, 'rows': rows,
+                      'seconds': round(seconds, 3)}
+            if isinstance(s3_client, offline.FakeS3Client):
+                result['mb_read'] = round((s3_client.bytes_read - bytes_read)
+                                          / repeats / 1024 / 1024, 2)
+            results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--format', choices=archive_files.ARCHIVE_FORMATS, default='csv',
+                        help='format of the generated archive')
+    parser.add_argument('--plants', type=int, default=DEFAULT_PLANTS)
+    parser.add_argument('--step-minutes', type=int, default=DEFAULT_STEP_MINUTES,
+                        help='minutes between the generated recordings of a plant')
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY)
+    parser.add_argument('--bandwidth', type=float, default=DEFAULT_BANDWIDTH)
+    parser.add_argument('--workers', type=int, default=s3_data_extraction.MAX_DOWNLOAD_WORKERS)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--plant', type=int, help='read just this plant\'s rows')
+    parser.add_argument('--bucket', help='read the real archive in this bucket instead')
+    args = parser.parse_args()
+
+    if args.bucket:
+        client = s3_data_extraction.create_s3_client()
+        bucket, end = args.bucket, (datetime.today() - timedelta(days=1)).date()
+    else:
+        client = offline.FakeS3Client(args.latency, args.bandwidth)
+        create_archive(client, args.format, args.plants, args.step_minutes)
+        bucket, end = 'benchmark', date(BENCHMARK_YEAR, 12, 31)
+
+    print(pd.DataFrame(run_benchmark(client, end, bucket, args.workers, args.repeats,
+                                     args.plant)).to_string(index=False))
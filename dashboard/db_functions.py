@@ -2,15 +2,23 @@
 
 from datetime import timedelta, datetime
 from os import environ
+import threading
 
 from dotenv import load_dotenv
 import pandas as pd
 import sqlalchemy as db
 
+import tables
+
 
 load_dotenv()
-LITERAL_DAY_AGO = (datetime.now() - timedelta(hours=24))
 TODAY = datetime.today()
+WINDOW_LENGTH = timedelta(hours=24)
+WINDOW_MAX_AGE = timedelta(seconds=60)  # New recordings arrive once a minute
+# The last minutes of rows held (by datetime) are fetched again on each refresh, as a load can
+# commit its rows after another's later ones; longer than a pipeline run (540 seconds) can take to
+# commit the readings it took
+WINDOW_OVERLAP = timedelta(minutes=10)
 
 
 class MSSQL_Database():
@@ -21,16 +29,16 @@ class MSSQL_Database():
 
     def __init__(self) -> None:
         """
-        Connects to engine, creates connection, and stores resulting objects along with the
-        database metadata as attributes of the image of the class.
+        Connects to engine, creates connection, and stores resulting objects as attributes of the
+        image of the class.
         """
         load_dotenv()
         try:
             self.engine = db.create_engine(
-                f"mssql+pymssql://{environ['DB_USER']}:{environ['DB_PASSWORD']}@{environ['DB_HOST']}:{environ['DB_PORT']}/{environ['DB_NAME']}?charset=utf8"
+                f"mssql+pymssql://{environ['DB_USER']}:{environ['DB_PASSWORD']}@{environ['DB_HOST']}:{environ['DB_PORT']}/{environ['DB_NAME']}?charset=utf8",
+                execution_options={'schema_translate_map': tables.get_schema_translate_map()}
             )
             self.connection = self.engine.connect()
-            self.metadata = db.MetaData(schema=environ['DB_SCHEMA'])
         except Exception as e:
             print(f"Error connecting to database: {e}")
             raise e
@@ -45,19 +53,82 @@ class MSSQL_Database():
 
 
 
-def get_24hr_data(table_name: str, database: MSSQL_Database,
-                  datetime_cutoff: str = LITERAL_DAY_AGO):
+def get_24hr_data(table_name: str, database: MSSQL_Database, datetime_cutoff: datetime = None):
     """
-    Retrieves records from the last 24 hours (by attribute 'datetime') from db table with given
-    name.
+    Retrieves records from the last 24 hours (by attribute 'datetime', or after the cutoff given)
+    from db table with given name.
     """
     try:
-        table = db.Table(table_name, database.metadata, autoload_with=database.engine)
+        datetime_cutoff = datetime_cutoff or datetime.now() - WINDOW_LENGTH
+        table = tables.get_table(table_name, database.engine)
         query = db.select(table).where(
             table.columns.datetime > datetime_cutoff)
         response = database.connection.execute(query)
-        results = response.fetchall()
-        return pd.DataFrame(results)
+        return pd.DataFrame(response.fetchall(), columns=list(response.keys()))
+
+    except Exception as e:
+        raise e
+
+
+class RollingWindow():
+    """
+    In-process store of the last 24 hours of a table's rows (by attribute 'datetime'). Each
+    refresh only fetches the rows since the newest held, less WINDOW_OVERLAP, replacing those
+    fetched again (by id), and drops the rows which have aged out, so its cost follows the time
+    since the last refresh rather than the size of the window. Snapshots are never changed once
+    handed out: a refresh builds a new dataframe rather than altering the last one.
+    """
+
+    def __init__(self, table_name: str, database: MSSQL_Database,
+                 length: timedelta = WINDOW_LENGTH) -> None:
+        """Sets up an empty window (with the table's columns), filled by the first refresh."""
+        self.table_name = table_name
+        self.database = database
+        self.length = length
+        table = tables.get_table(table_name, database.engine)
+        self.rows = pd.DataFrame(columns=list(table.columns.keys()))
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self, now: datetime = None) -> pd.DataFrame:
+        """Brings the window up to date with the table; returns a snapshot of it."""
+        now = now or datetime.now()
+        cutoff = now - self.length
+
+        with self.lock:
+            rows = self.rows
+            since = cutoff
+            if not rows.empty:
+                rows = rows[rows['datetime'] > cutoff]
+                since = max(cutoff, self.rows['datetime'].max() - WINDOW_OVERLAP)
+            new_rows = get_24hr_data(self.table_name, self.database, since)
+
+            if not new_rows.empty:
+                if not rows.empty:
+                    new_rows = pd.concat([rows, new_rows], ignore_index=True)
+                rows = new_rows.drop_duplicates('id', keep='last', ignore_index=True)
+
+            self.rows = rows
+            self.refreshed_at = now
+            return self.rows.copy(deep=False)
+
+    def get_snapshot(self, max_age: timedelta = WINDOW_MAX_AGE) -> pd.DataFrame:
+        """Returns a snapshot of the window, refreshing it first if it's older than max_age."""
+        if self.refreshed_at is None or datetime.now() - self.refreshed_at > max_age:
+            return self.refresh()
+        with self.lock:
+            return self.rows.copy(deep=False)
+
+
+def get_latest_recordings(database: MSSQL_Database) -> pd.DataFrame:
+    """
+    Retrieves each plant's latest recording (one row per plant) from the latest_recording table,
+    which the minute pipeline keeps up to date.
+    """
+    try:
+        table = tables.get_table('latest_recording', database.engine)
+        response = database.connection.execute(db.select(table).order_by(table.columns.plant_id))
+        return pd.DataFrame(response.fetchall(), columns=list(response.keys()))
 
     except Exception as e:
         raise e
@@ -66,7 +137,7 @@ def get_24hr_data(table_name: str, database: MSSQL_Database,
 def get_plant_image_url(plant_id: int, database: MSSQL_Database) -> pd.DataFrame:
     """Retrieves pandas df of first image in db image table with specified plant id."""
     try:
-        image_table = db.Table('image', database.metadata, autoload_with=database.engine)
+        image_table = tables.get_table('image', database.engine)
         query = db.select(image_table).where(image_table.columns.plant_id == plant_id)
         response = database.connection.execute(query)
         result = response.first()
@@ -1,6 +1,7 @@
 """Modules containing functions to make altair chart graphics used in dashboard (main.py)."""
 
 import altair as alt
+import numpy as np
 import pandas as pd
 
 
@@ -9,12 +10,63 @@ FIG_WIDTH = 750
 FIG_HEIGHT = 400  # int(FIG_WIDTH / 4)
 TICK_LABEL_FONT_SIZE = 14
 AXIS_LABEL_FONT_SIZE = 16
+MAX_LINE_POINTS = 2 * FIG_WIDTH  # More points than this can't be told apart on the chart
+
+
+def get_lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Returns the indices of the points (sorted by x) which Largest-Triangle-Three-Buckets
+    downsampling keeps: the first and last points, and from each of max_points - 2 buckets in
+    between, the point making the largest triangle with the point kept from the bucket before and
+    the average of the bucket after. Peaks and troughs are kept, so the line keeps its shape.
+    """
+    n_points = len(x)
+    if max_points >= n_points or max_points < 3:
+        return np.arange(n_points)
+
+    # Bucket edges over the points between the first and last (in integers, as floats can round
+    # an edge into the wrong bucket); the last bucket is the last point
+    edges = 1 + np.arange(max_points - 1) * (n_points - 2) // (max_points - 2)
+    starts = np.append(edges[:-1], n_points - 1)
+    stops = np.append(edges[1:], n_points)
+    counts = stops - starts
+    x_means = np.add.reduceat(x, starts) / counts
+    y_means = np.add.reduceat(y, starts) / counts
+
+    indices = np.empty(max_points, dtype=int)
+    indices[0], indices[-1] = 0, n_points - 1
+    for bucket in range(max_points - 2):
+        start, stop = starts[bucket], stops[bucket]
+        previous_x, previous_y = x[indices[bucket]], y[indices[bucket]]
+        # Twice the triangle areas, for every point in the bucket at once
+        areas = np.abs((previous_x - x_means[bucket + 1]) * (y[start:stop] - previous_y)
+                       - (previous_x - x[start:stop]) * (y_means[bucket + 1] - previous_y))
+        indices[bucket + 1] = start + np.argmax(areas)
+    return indices
+
+
+def downsample_line_data(chart_data: pd.DataFrame, y_column: str,
+                         max_points: int = MAX_LINE_POINTS) -> pd.DataFrame:
+    """
+    Returns just the datetime and y_column of the chart data, sorted by time without missing
+    values, downsampled with LTTB (see get_lttb_indices) if there are more than max_points rows.
+    Only the columns drawn are kept, as the whole dataframe is embedded in the chart's spec.
+    """
+    line_data = chart_data[['datetime', y_column]].dropna().sort_values('datetime')
+    if len(line_data) <= max_points:
+        return line_data.reset_index(drop=True)
+
+    x = line_data['datetime'].to_numpy().astype('datetime64[ns]').astype(np.int64).astype(float)
+    y = line_data[y_column].to_numpy(dtype=float)
+    return line_data.iloc[get_lttb_indices(x, y, max_points)].reset_index(drop=True)
 
 
 def get_soil_moisture_chart(chart_data: pd.DataFrame) -> alt.Chart:
     """
-    Creates altair line chart of moisture against time for given df (of a singular plant's info).
+    Creates altair line chart of moisture against time for given df (of a singular plant's info),
+    downsampled to at most MAX_LINE_POINTS points.
     """
+    chart_data = downsample_line_data(chart_data, 'soil_moisture')
     y_min = chart_data['soil_moisture'].min()
     y_max = chart_data['soil_moisture'].max()
 
@@ -40,8 +92,9 @@ def get_soil_moisture_chart(chart_data: pd.DataFrame) -> alt.Chart:
 def get_temperature_chart(chart_data: pd.DataFrame) -> alt.Chart:
     """
     Creates altair line chart of temperature against time for a given df (of a singular plant's
-    info).
+    info), downsampled to at most MAX_LINE_POINTS points.
     """
+    chart_data = downsample_line_data(chart_data, 'temperature')
     y_min = chart_data['temperature'].min()
     y_max = chart_data['temperature'].max()
 
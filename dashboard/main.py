@@ -8,6 +8,8 @@ import streamlit as st
 
 import db_functions
 import graphics
+import profiling
+import rollups
 import s3_data_extraction as s3_functions
 
 from data_utils import (
@@ -40,27 +42,49 @@ def fetch_s3_client_object():
     return s3_functions.create_s3_client()
 
 
-@st.cache_data(show_spinner='Plants be loading... 🌱')
-def get_24hr_data(table_name: str, _database: db_functions.MSSQL_Database) -> pd.DataFrame:
-    """Cacheable function to return last 24hrs of data from database."""
-    return db_functions.get_24hr_data(table_name, _database)
+@st.cache_resource
+def fetch_rolling_window(table_name: str,
+                         _database: db_functions.MSSQL_Database) -> db_functions.RollingWindow:
+    """
+    Cacheable function to return the (shared) store of the last 24hrs of data from the database
+    table, which only fetches what's new whenever it's refreshed.
+    """
+    return db_functions.RollingWindow(table_name, _database)
+
+
+@st.cache_data(ttl=db_functions.WINDOW_MAX_AGE)
+def get_latest_readings(_database: db_functions.MSSQL_Database) -> pd.DataFrame:
+    """Cacheable function to return each plant's latest recording, from the database."""
+    return db_functions.get_latest_recordings(_database)
 
 
 @st.cache_data()
 def get_min_s3_date(_s3_client) -> datetime:
-    """Cacheable function to return minimum date (to the month) of data in s3 bucket."""
+    """Cacheable function to return minimum date of data in s3 bucket."""
     return s3_functions.get_earliest_data_date(_s3_client).date()
 
 
 @st.cache_data()
 def get_s3_data_for_type_and_date_ranges(_s3_client, data_type: str, range_start: datetime,
-                                         range_end: datetime) -> pd.DataFrame:
+                                         range_end: datetime, plant_id: int) -> pd.DataFrame:
     """
-    Cacheable function to return s3 data of given type between the months of the date range given
-    (range_start and range_end MUST be date objects).
+    Cacheable function to return s3 data of given type and plant between the months of the date
+    range given (range_start and range_end MUST be date objects).
     """
     return s3_functions.get_s3_data_for_type_and_date_ranges(
-        _s3_client, data_type, range_start, range_end)
+        _s3_client, data_type, range_start, range_end, plant_id=plant_id)
+
+
+@st.cache_data()
+def get_s3_rollups_for_type_and_date_ranges(_s3_client, data_type: str, resolution: str,
+                                            range_start: datetime, range_end: datetime,
+                                            plant_id: int) -> pd.DataFrame:
+    """
+    Cacheable function to return the s3 rollup of given type, resolution and plant between the
+    dates of the date range given (range_start and range_end MUST be date objects).
+    """
+    return s3_functions.get_s3_rollups_for_type_and_date_ranges(
+        _s3_client, data_type, resolution, range_start, range_end, plant_id=plant_id)
 
 
 @st.cache_data(show_spinner="Retrieving image...")
@@ -71,16 +95,16 @@ def get_plant_image_url(plant_id: int, _database: db_functions.MSSQL_Database) -
 
 # Data manipulation:
 
-def get_moisture_data(data: pd.DataFrame, sample_rate: str) -> pd.DataFrame:
-    """Gets moisture data from filtered dataframe."""
-    return data.resample(
-        sample_rate, on='datetime').mean().reset_index()
-
-
-def get_temperature_data(data: pd.DataFrame, sample_rate: str) -> pd.DataFrame:
-    """Gets moisture data from filtered dataframe."""
-    return data.resample(
-        sample_rate, on='datetime').mean().reset_index()
+def get_chart_data(partial_rollups: list[pd.DataFrame], sample_rate: str) -> pd.DataFrame:
+    """
+    Combines partial rollups (see rollups) into one point per sample period, with the mean of each
+    measure under the measure's name (and its count, minimum and maximum alongside).
+    """
+    partial_rollups = [partial for partial in partial_rollups if not partial.empty]
+    if not partial_rollups:
+        return pd.DataFrame(columns=['datetime'] + rollups.MEASURES)
+    chart_data = rollups.get_rollup(rollups.combine_partial_rollups(partial_rollups, sample_rate))
+    return chart_data.rename(columns={f'{measure}_mean': measure for measure in rollups.MEASURES})
 
 
 def get_individual_plant_data(chart_data: pd.DataFrame, plant_selected: int) -> pd.DataFrame:
@@ -99,12 +123,11 @@ def get_selected_plant(chart_data: pd.DataFrame) -> int:
     return st.sidebar.selectbox('Plant ID', plant_ids)
 
 
-def build_resample_rate_slider() -> str:
-    """Builds sidebar resample rate slider, returns chosen resample rate."""
-    resample_rate = st.sidebar.slider(
+def build_resample_rate_slider() -> int:
+    """Builds sidebar resample rate slider, returns chosen resample rate in minutes."""
+    return st.sidebar.slider(
         'Select sample rate (minutes)',
         min_value=1, max_value=60, value=10, step=1)
-    return f'{resample_rate}T'
 
 
 def build_date_range_slider(min_date_possible: datetime) -> list[datetime]:
@@ -163,38 +186,33 @@ def display_sidebar_map(selected_plant: int) -> None:
 
     
 
+@profiling.profiled('dashboard')
 def main():
     """Main logic to run dashboard."""
 
     load_dotenv()
 
-    # Fetching db data:
+    # Fetching the latest readings (one per plant), which is all the current values need:
     database = fetch_database_object()
-    db_data = get_24hr_data('recording', database)
+    latest_readings_df = get_latest_readings(database)
 
 
     # Sidebar:
     st.sidebar.title('Plant Selector')
 
-    selected_plant_id = get_selected_plant(db_data)
+    selected_plant_id = get_selected_plant(latest_readings_df)
     st.sidebar.write('##')
-    resample_rate = build_resample_rate_slider()
+    resample_minutes = build_resample_rate_slider()
 
 
     # Current values section:
-    idx = db_data.groupby('plant_id')['datetime'].idxmax()
-
-    latest_readings_df = db_data.loc[
-        idx, ['plant_id', 'soil_moisture', 'temperature', 'datetime']].reset_index()
-
     col1, col2, col3 = st.columns([2, 1, 1])
 
     with col1:
         st.title('🪴 Plant Health Tracker')
 
     with col2:
-        st.metric('Total Number of Plants 🌿',
-                  len(db_data['plant_id'].unique()))
+        st.metric('Total Number of Plants 🌿', len(latest_readings_df))
 
     with col3:
         min_soil_moisture_index = latest_readings_df['soil_moisture'].idxmin()
@@ -222,6 +240,11 @@ def main():
 
     # Plant specific historic section:
 
+    # Fetching the last 24hrs of db data:
+    recording_window = fetch_rolling_window('recording', database)
+    with st.spinner('Plants be loading... 🌱'):
+        db_data = recording_window.get_snapshot()
+
     st.title(f'Plant {selected_plant_id}')
 
     # Datetime slider and selection from user
@@ -231,19 +254,34 @@ def main():
     datetime_range = (datetime.combine(date_range[0], datetime.min.time()),
                       datetime.combine(date_range[1] + timedelta(days=1), datetime.min.time()))
 
-    # Fetching data from s3, and restricting to current plant
-    selected_plant_data = get_individual_plant_data(db_data, selected_plant_id)
-    s3_data = get_s3_data_for_type_and_date_ranges(
-        s3_client, 'recording', date_range[0], date_range[1])
-    
-    if not s3_data.empty:
-        selected_plant_s3_data = get_individual_plant_data(s3_data, selected_plant_id)
-        selected_plant_data = pd.concat([selected_plant_data, selected_plant_s3_data])
+    # Charts get at most rollups.MAX_CHART_POINTS points, from the coarsest rollup that gives them
+    range_minutes = (datetime_range[1] - datetime_range[0]) / timedelta(minutes=1)
+    chart_minutes = rollups.get_chart_minutes(range_minutes, resample_minutes)
+    resolution = rollups.get_resolution(chart_minutes)
+    sample_rate = f'{chart_minutes}min'
 
-    selected_plant_data = selected_plant_data[
+    # Fetching data from s3 for just the current plant, rolled up unless the minutes are needed
+    selected_plant_data = get_individual_plant_data(db_data, selected_plant_id)
+    db_range_data = selected_plant_data[
         (selected_plant_data['datetime'] >= datetime_range[0]) &
-        (selected_plant_data['datetime'] <= datetime_range[1])
+        (selected_plant_data['datetime'] < datetime_range[1])
         ]
+    partial_rollups = [rollups.get_partial_rollup(db_range_data, sample_rate)]
+
+    if resolution:
+        s3_rollup = get_s3_rollups_for_type_and_date_ranges(
+            s3_client, 'recording', resolution, date_range[0], date_range[1],
+            int(selected_plant_id))
+        if not s3_rollup.empty:
+            partial_rollups.append(rollups.get_partial_from_rollup(s3_rollup))
+    else:
+        selected_plant_s3_data = get_s3_data_for_type_and_date_ranges(
+            s3_client, 'recording', date_range[0], date_range[1], int(selected_plant_id))
+        if not selected_plant_s3_data.empty:
+            partial_rollups.append(rollups.get_partial_rollup(selected_plant_s3_data,
+                                                              sample_rate))
+
+    chart_data = get_chart_data(partial_rollups, sample_rate)
 
 
     build_moisture_header_and_metric(selected_plant_data, selected_plant_id)
@@ -253,8 +291,7 @@ def main():
 
         with col1:
 
-            moisture_data = get_moisture_data(selected_plant_data, resample_rate)
-            st.altair_chart(graphics.get_soil_moisture_chart(moisture_data))
+            st.altair_chart(graphics.get_soil_moisture_chart(chart_data))
 
         with col2:
             current_moisture_chart = graphics.adjust_chart_dimensions(
@@ -271,8 +308,7 @@ def main():
 
         with col1:
 
-            temperature_data = get_temperature_data(selected_plant_data, resample_rate)
-            st.altair_chart(graphics.get_temperature_chart(temperature_data))
+            st.altair_chart(graphics.get_temperature_chart(chart_data))
 
         with col2:
             current_temperature_chart = graphics.adjust_chart_dimensions(current_temperature_chart, height = 400)
@@ -286,7 +322,9 @@ def main():
     display_sidebar_map(selected_plant_id)
 
     if st.sidebar.button('🌀 Get latest readings', help='Gets latest data from the database'):
-        get_24hr_data.clear()
+        recording_window.refresh()
+        get_latest_readings.clear()
+        st.rerun()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+"""
+Contains an opt-in profiler for the pipelines' handlers and the dashboard's main(). With the
+PROFILE environment variable set, each call of a function decorated with profiled() is run under
+cProfile and tracemalloc, and its profile written under a new run id: the cProfile stats
+(stats.prof, which pstats and snakeviz open), the slowest functions by cumulative time
+(stats.txt) and the lines which allocated the most memory (allocations.txt). They're written to
+PROFILE_DIRECTORY (by default /tmp/profiles, as /tmp is all a Lambda can write to) or, with
+PROFILE_OUTPUT=s3, to the archive bucket under profiles/. cProfile and tracemalloc can only
+profile one call of a process at a time, so a call made while another is profiled (e.g. by another
+of the dashboard's sessions), or while tracemalloc is already tracing, is run without a profile.
+
+Without PROFILE, profiled() hands back the function itself, so profiling costs nothing unless it's
+switched on (which is read when the function is decorated, i.e. at import).
+"""
+
+import cProfile
+from datetime import datetime
+import functools
+import io
+import logging
+import marshal
+from os import environ, makedirs, path
+import pstats
+import threading
+import tracemalloc
+import uuid
+
+from boto3 import client
+
+
+DEFAULT_PROFILE_DIRECTORY = '/tmp/profiles'
+PROFILE_PREFIX = 'profiles'
+TOP_FUNCTIONS = 50
+TOP_ALLOCATIONS = 25
+TRACEMALLOC_FRAMES = 1
+PROFILE_LOCK = threading.Lock()  # Held while a call is profiled
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_profiling_enabled() -> bool:
+    """Returns whether the PROFILE environment variable switches profiling on."""
+    return environ.get('PROFILE', '').lower() in ('1', 'true', 'yes')
+
+
+def get_run_id(name: str) -> str:
+    """Returns a new id for a profiled run of the named function, sortable by time."""
+    return f'{name}/{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}'
+
+
+def get_stats_text(profiler: cProfile.Profile) -> str:
+    """Returns the TOP_FUNCTIONS functions with the most cumulative time, as text."""
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    return output.getvalue()
+
+
+def get_allocations_text(snapshot: tracemalloc.Snapshot, peak: int) -> str:
+    """Returns the peak traced memory and the TOP_ALLOCATIONS lines allocating most, as text."""
+    lines = [f"Peak traced memory: {peak / 1024 / 1024:.1f} MiB",
+             f"Top {TOP_ALLOCATIONS} lines by memory still allocated at the end of the run:"]
+    lines += [str(statistic) for statistic in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]]
+    return '\n'.join(lines) + '\n'
+
+
+def get_profile_files(profiler: cProfile.Profile, snapshot: tracemalloc.Snapshot,
+                      peak: int) -> dict:
+    """Returns the files of a run's profile, by name."""
+    profiler.create_stats()
+    # As Profile.dump_stats writes them, without needing a file to write to
+    return {'stats.prof': marshal.dumps(profiler.stats),
+            'stats.txt': get_stats_text(profiler).encode(),
+            'allocations.txt': get_allocations_text(snapshot, peak).encode()}
+
+
+def save_profile(run_id: str, files: dict) -> str:
+    """
+    Writes the profile's files under the run id, to the archive bucket with PROFILE_OUTPUT=s3 and
+    otherwise to PROFILE_DIRECTORY; returns where they were written.
+    """
+    if environ.get('PROFILE_OUTPUT', '').lower() == 's3':
+        s3_client = client("s3",
+                           aws_access_key_id=environ['AWS_ACCESS_KEY_ID_'],
+                           aws_secret_access_key=environ['AWS_SECRET_ACCESS_KEY_'])
+        prefix = f'{PROFILE_PREFIX}/{run_id}'
+        for file_name, body in files.items():
+            s3_client.put_object(Body=body, Bucket=environ['BUCKET_NAME'],
+                                 Key=f'{prefix}/{file_name}')
+        return f"s3://{environ['BUCKET_NAME']}/{prefix}"
+
+    directory = path.join(environ.get('PROFILE_DIRECTORY', DEFAULT_PROFILE_DIRECTORY), run_id)
+    makedirs(directory, exist_ok=True)
+    for file_name, body in files.items():
+        with open(path.join(directory, file_name), 'wb') as profile_file:
+            profile_file.write(body)
+    return directory
+
+
+def start_profiling(name: str) -> cProfile.Profile:
+    """
+    Starts profiling a call of the named function and returns its profiler, or None (saying why)
+    if it can't be profiled, as another call is being profiled or memory is already traced.
+    """
+    if not PROFILE_LOCK.acquire(blocking=False):
+        logger.info("Not profiling %s: another call is being profiled.", name)
+        return None
+    if tracemalloc.is_tracing():
+        PROFILE_LOCK.release()
+        logger.info("Not profiling %s: tracemalloc is already tracing.", name)
+        return None
+
+    profiler = cProfile.Profile()
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    try:
+        profiler.enable()
+    except ValueError as e:  # Another profiler is active (Python 3.12+)
+        tracemalloc.stop()
+        PROFILE_LOCK.release()
+        logger.warning("Not profiling %s: %s", name, e)
+        return None
+    return profiler
+
+
+def stop_profiling(name: str, profiler: cProfile.Profile) -> None:
+    """Stops profiling a call of the named function and saves its profile (see save_profile)."""
+    # A profile that can't be taken or saved mustn't fail (or hide the error of) the call
+    try:
+        try:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            PROFILE_LOCK.release()
+        location = save_profile(get_run_id(name), get_profile_files(profiler, snapshot, peak))
+        logger.info("Profile of %s saved to %s.", name, location)
+    except Exception as e:  # pylint: disable=broad-except
+        logger.warning("Error saving profile of %s: %s", name, e)
+
+
+def profiled(name: str):
+    """
+    Returns a decorator which, if profiling is enabled (see is_profiling_enabled), profiles each
+    call of the function and saves the profile under a new run id (see save_profile), even when
+    the call fails; otherwise the function is returned as it is.
+    """
+    def decorator(function):
+        if not is_profiling_enabled():
+            return function
+
+        @functools.wraps(function)
+        def profiled_function(*args, **kwargs):
+            profiler = start_profiling(name)
+            if profiler is None:
+                return function(*args, **kwargs)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stop_profiling(name, profiler)
+
+        return profiled_function
+
+    return decorator
@@ -1,88 +1,185 @@
 """
-Module containing code to extract and combine cumulative csv files for the month with csv files
-from the previous day in the folder in the s3 bucket corresponding to yesterday's month.
+Module containing code to read the archived data between two dates from the s3 bucket, using the
+archive manifest to find the files which hold it, or their rollups at a coarser resolution (see
+rollups). The files are downloaded and parsed concurrently, at most MAX_DOWNLOAD_WORKERS at a
+time, and joined with a single concat at the end. Every request is conditional on the ETag in the
+file's manifest entry; if a file has been replaced (or deleted by compaction) since the manifest
+was read, the manifest is read again and the query redone.
 """
 
+import concurrent.futures
 from os import environ
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 import pandas as pd
-import re
 from boto3 import client
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import archive_files
+import manifest
+import rollups
 
 
 load_dotenv()
 TODAY = datetime.today()
 YESTERDAY = TODAY - timedelta(days=1)
-VALID_S3_FILE_PATTERN = r'20[0-9][0-9]\/(([0-9])|(1[0-2]))\/(watering|recording)(_(([1-9]|[1-2][0-9]|3[01])))?.csv'
+MAX_DOWNLOAD_WORKERS = 16
+RANGED_READ_MIN_BYTES = 4 * 1024 * 1024  # Smaller files are cheaper to fetch in one request
+ARCHIVE_COLUMNS = {'recording': ['plant_id', 'soil_moisture', 'temperature', 'datetime'],
+                   'watering': ['plant_id', 'datetime']}
+MAX_READ_ATTEMPTS = 3
+# Errors meaning a file listed in the manifest has since been replaced or deleted
+STALE_FILE_ERROR_CODES = ('PreconditionFailed', '412', 'NoSuchKey', '404')
 
 
 def create_s3_client():
     """Creates a client that connects to s3 on AWS."""
     return client("s3",
                   aws_access_key_id=environ['AWS_ACCESS_KEY_ID_'],
-                  aws_secret_access_key=environ['AWS_SECRET_ACCESS_KEY_'])
+                  aws_secret_access_key=environ['AWS_SECRET_ACCESS_KEY_'],
+                  # Enough connections for every download worker to have its own
+                  config=Config(max_pool_connections=MAX_DOWNLOAD_WORKERS))
+
+
+def get_earliest_data_date(s3_client: client, bucket_name: str = environ['BUCKET_NAME']):
+    """Function to return the earliest datetime there is data for in s3 (or now, if there is none)."""
+    archive_manifest, _ = manifest.load_manifest(s3_client, bucket_name)
+    return manifest.get_earliest_datetime(archive_manifest) or TODAY
 
 
-def get_bucket_keys(s3_client: client, bucket_name: str = environ['BUCKET_NAME']) -> list:
+def read_archive_keys(s3_client, archive_manifest: dict, keys: list[str], bucket_name: str,
+                      columns: list[str], filters: list[tuple]) -> list[pd.DataFrame]:
     """
-    Returns a list of keys of csv files, format matching {year}/{month}/recording_20, for example
-    (recording could be watering, and underscore day is optional).
+    Downloads the archive (or rollup) files with the given keys concurrently, keeping just the
+    given columns and the rows matching the filters; returns the non-empty ones, in key order.
+    Parquet files are only read for the row groups and columns needed; large ones with ranged
+    requests. When filtering on plant, every file is read with ranged requests, so only that
+    plant's row groups (or csv rows) are downloaded.
     """
-    objects = s3_client.list_objects(
-        Bucket=bucket_name).get('Contents')
-    if objects:
-        return [obj['Key'] for obj in objects if re.search(VALID_S3_FILE_PATTERN, obj['Key'])]
-    return []
+    by_plant = archive_files.get_filter_plant_ids(filters) is not None
 
+    def read_file(key: str) -> pd.DataFrame:
+        entry = archive_manifest['files'][key]
+        ranged = by_plant or entry['bytes'] >= RANGED_READ_MIN_BYTES
+        return archive_files.read_archive_file(s3_client, key, bucket_name, columns, filters,
+                                               ranged=ranged, size=entry['bytes'],
+                                               indexed=entry.get('indexed', False),
+                                               etag=entry['etag'])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+        return [df for df in executor.map(read_file, keys) if not df.empty]
+
+
+def read_with_manifest(s3_client, bucket_name: str, read):
+    """
+    Returns read(archive_manifest), on the current manifest; if a file it lists turns out to have
+    been replaced or deleted since (by compaction), it's read again, on the new manifest.
+    """
+    for attempt in range(MAX_READ_ATTEMPTS):
+        archive_manifest, _ = manifest.load_manifest(s3_client, bucket_name)
+        try:
+            return read(archive_manifest)
+        except ClientError as e:
+            if (e.response['Error']['Code'] not in STALE_FILE_ERROR_CODES
+                    or attempt == MAX_READ_ATTEMPTS - 1):
+                raise e
 
-def get_earliest_data_date(s3_client: client, bucket_name: str = environ['BUCKET_NAME']):
-    """Function to return the earliest month there is data for in the s3 bucket."""
-    keys = get_bucket_keys(s3_client, bucket_name)
-    keys.sort(key = lambda file_name: int(''.join(file_name.split('/')[:-1])))
-    return datetime(year = int(keys[0].split('/')[0]), month = int(keys[0].split('/')[1]), day = 1)
 
+def get_range_filters(range_start: datetime, range_end: datetime, plant_id: int = None) -> list:
+    """Returns the filters for the rows from the start of one date to the end of another."""
+    filters = [('datetime', '>=', pd.Timestamp(range_start).normalize()),
+               ('datetime', '<', pd.Timestamp(range_end).normalize() + timedelta(days = 1))]
+    if plant_id is not None:
+        filters.append(('plant_id', '=', plant_id))
+    return filters
 
 
 def get_s3_data_for_type_and_date_ranges(s3_client, data_type: str, range_start: datetime,
                                          range_end: datetime = TODAY,
-                                         bucket_name: str = environ['BUCKET_NAME']):
+                                         bucket_name: str = environ['BUCKET_NAME'],
+                                         columns: list[str] = None, plant_id: int = None):
     """
-    Downloads relevant s3 files for every month between the two dates (including the months in
-    which they themselves fall).
+    Downloads the data_type rows between the two dates (inclusive) from the s3 files the archive
+    manifest lists as holding any of them, keeping just the given columns (by default those in
+    ARCHIVE_COLUMNS) and, if given, the one plant's rows. Rows come in the order of the files' keys.
     """
     if range_start > (datetime.now() - timedelta(days = 1)).date():
         return pd.DataFrame()
 
-    keys = get_bucket_keys(s3_client, bucket_name)
+    filters = get_range_filters(range_start, range_end, plant_id)
 
-    int_start = int(str(range_start.year) + str(range_start.month))
-    int_end = int(str(range_end.year) + str(range_end.month))
+    def read(archive_manifest: dict) -> list[pd.DataFrame]:
+        keys = manifest.get_keys_for_range(archive_manifest, data_type, filters[0][2],
+                                           filters[1][2])
+        return read_archive_keys(s3_client, archive_manifest, keys, bucket_name,
+                                 columns or ARCHIVE_COLUMNS[data_type], filters)
 
-    keys = [key for key in keys if int_start <= int(''.join(key.split('/')[:-1])) <= int_end]
-    # Filters keys by date_range
-    keys = [key for key in keys if data_type in key]
-    # Filters keys by datatype
+    dfs = read_with_manifest(s3_client, bucket_name, read)
+    if not dfs:
+        return pd.DataFrame()
+    return pd.concat(dfs, ignore_index=True)
 
-    responses = [s3_client.get_object(Bucket=bucket_name, Key=key) for key in keys]
-    # ^^ List comprehension handles start / end of month
 
-    df = pd.DataFrame()
+def get_month_file_month(key: str) -> tuple[int, int]:
+    """
+    Returns the (year, month) of a month file ({year}/{month}/{data_type}-{version}.{format}), or
+    None for a day or part file.
+    """
+    parts = key.split('/')
+    if len(parts) != 3 or '_' in parts[2]:
+        return None
+    return int(parts[0]), int(parts[1])
 
-    for response in responses:
-        try:
-            # This way would allow us to monitor df size and decrease resolution as needed
-            df_csv = pd.read_csv(response.get("Body"))
-            df = pd.concat([df, df_csv])
-        except pd.errors.EmptyDataError as e:
-            pass
 
-    if not df.empty:
-        df['datetime'] = pd.to_datetime(df['datetime'])
+def read_partial_rollups(s3_client, archive_manifest: dict, data_type: str, resolution: str,
+                         bucket_name: str, filters: list[tuple]) -> list[pd.DataFrame]:
+    """
+    Returns the partial rollups at the given resolution of the rows matching the filters: those of
+    the rollup files listed in the manifest, and those of the archived rows they don't cover.
+    """
+    rollup_keys = manifest.get_keys_for_range(archive_manifest, data_type, filters[0][2],
+                                              filters[1][2], resolution)
+    partials = [rollups.get_partial_from_rollup(df) for df in read_archive_keys(
+        s3_client, archive_manifest, rollup_keys, bucket_name, None, filters)]
+
+    # A month's rollups are of its month file's rows alone, so day and part files (even those
+    # archived into a month after it was rolled up) are rolled up here
+    rolled_up_months = {rollups.get_rollup_key_month(key) for key in rollup_keys}
+    raw_keys = [key for key in manifest.get_keys_for_range(archive_manifest, data_type,
+                                                           filters[0][2], filters[1][2])
+                if get_month_file_month(key) not in rolled_up_months]
+    raw_dfs = read_archive_keys(s3_client, archive_manifest, raw_keys, bucket_name,
+                                ARCHIVE_COLUMNS[data_type], filters)
+    if raw_dfs:
+        partials.append(rollups.get_partial_rollup(pd.concat(raw_dfs, ignore_index=True),
+                                                   rollups.RESOLUTIONS[resolution]))
+    return partials
+
+
+def get_s3_rollups_for_type_and_date_ranges(s3_client, data_type: str, resolution: str,
+                                            range_start: datetime, range_end: datetime = TODAY,
+                                            bucket_name: str = environ['BUCKET_NAME'],
+                                            plant_id: int = None) -> pd.DataFrame:
+    """
+    Returns the data_type rollup at the given resolution (see rollups) between the two dates
+    (inclusive), for the one plant if given. It's read from the rollup files, plus the archived
+    rows they don't cover (such as the last day or two), which are rolled up here and merged in.
+    """
+    if range_start > (datetime.now() - timedelta(days = 1)).date():
+        return pd.DataFrame()
 
-    return df
+    filters = get_range_filters(range_start, range_end, plant_id)
+    partials = read_with_manifest(
+        s3_client, bucket_name,
+        lambda archive_manifest: read_partial_rollups(s3_client, archive_manifest, data_type,
+                                                      resolution, bucket_name, filters))
 
+    if not partials:
+        return pd.DataFrame()
+    # Rows archived after a month was rolled up can fall in the same periods as its last rows
+    return rollups.get_rollup(rollups.combine_partial_rollups(partials))
 
 if __name__ == "__main__":
 
@@ -0,0 +1,112 @@
+"""
+Contains definitions of the database tables (matching db_setup/schema.sql), so that database
+functions don't have to reflect tables from the database every time they're used.
+
+Tables are declared without a schema; engines map them onto DB_SCHEMA with
+get_schema_translate_map().
+"""
+
+from os import environ
+
+import sqlalchemy as db
+
+
+metadata = db.MetaData()
+
+location = db.Table(
+    'location', metadata,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('latitude', db.Float, nullable=False),
+    db.Column('longitude', db.Float, nullable=False),
+    db.Column('town', db.String(100), nullable=False),
+    db.Column('city', db.String(100), nullable=False),
+    db.Column('country_code', db.NCHAR(2), nullable=False),
+    db.Column('continent', db.String(50), nullable=False)
+)
+
+plant = db.Table(
+    'plant', metadata,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('name', db.String(255)),
+    db.Column('scientific_name', db.String(255)),
+    db.Column('location_id', db.Integer, db.ForeignKey('location.id'))
+)
+
+recording = db.Table(
+    'recording', metadata,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('plant_id', db.Integer, db.ForeignKey('plant.id'), nullable=False),
+    db.Column('soil_moisture', db.Float, nullable=False),
+    db.Column('temperature', db.Float, nullable=False),
+    db.Column('datetime', db.DateTime, nullable=False)
+)
+
+# Each plant's most recent recording, upserted by the minute pipeline's load with the recordings
+latest_recording = db.Table(
+    'latest_recording', metadata,
+    db.Column('plant_id', db.Integer, db.ForeignKey('plant.id'), primary_key=True,
+              autoincrement=False),
+    db.Column('soil_moisture', db.Float, nullable=False),
+    db.Column('temperature', db.Float, nullable=False),
+    db.Column('datetime', db.DateTime, nullable=False)
+)
+
+watering = db.Table(
+    'watering', metadata,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('plant_id', db.Integer, db.ForeignKey('plant.id'), nullable=False),
+    db.Column('datetime', db.DateTime, nullable=False),
+    db.UniqueConstraint('plant_id', 'datetime', name='unique_watering_events')
+)
+
+botanist = db.Table(
+    'botanist', metadata,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('email', db.String(350), nullable=False),
+    db.Column('firstname', db.String(100), nullable=False),
+    db.Column('lastname', db.String(100), nullable=False),
+    db.Column('phone', db.String(30), nullable=False)
+)
+
+duty = db.Table(
+    'duty', metadata,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('botanist_id', db.Integer, db.ForeignKey('botanist.id'), nullable=False),
+    db.Column('plant_id', db.Integer, db.ForeignKey('plant.id'), nullable=False),
+    db.Column('start', db.DateTime, nullable=False, server_default=db.func.getdate()),
+    db.Column('end', db.DateTime)
+)
+
+image = db.Table(
+    'image', metadata,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('plant_id', db.Integer, db.ForeignKey('plant.id'), nullable=False),
+    db.Column('image_url', db.String(500), nullable=False),
+    db.Column('license', db.Integer),
+    db.Column('license_name', db.String(255)),
+    db.Column('license_url', db.String(255))
+)
+
+# Filled on first use when REFLECT_TABLES is set, then reused for the life of the process
+reflected_metadata = db.MetaData()
+
+
+def get_schema_translate_map() -> dict:
+    """Returns the execution option mapping the (schema-less) declared tables onto DB_SCHEMA."""
+    return {None: environ['DB_SCHEMA']}
+
+
+def get_table(table_name: str, db_engine: db.Engine = None) -> db.Table:
+    """
+    Returns the declared table with the given name. If the REFLECT_TABLES environment variable is
+    set, the table is instead reflected from the database the first time it's asked for, and the
+    reflected table is reused from then on.
+    """
+    if db_engine is None or not environ.get('REFLECT_TABLES'):
+        return metadata.tables[table_name]
+
+    schema = environ['DB_SCHEMA']
+    table_key = f"{schema}.{table_name}"
+    if table_key not in reflected_metadata.tables:
+        db.Table(table_name, reflected_metadata, schema=schema, autoload_with=db_engine)
+    return reflected_metadata.tables[table_key]
@@ -0,0 +1,67 @@
+"""Unit tests for db_functions.py"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+import sqlalchemy as db
+
+from db_functions import RollingWindow
+import tables
+
+
+NOW = datetime(2023, 12, 10, 12)
+
+
+@pytest.fixture
+def database():
+    """Returns an in-memory database with the dashboard's tables, as the window uses it."""
+    engine = db.create_engine('sqlite://')
+    tables.metadata.create_all(engine)
+    with engine.connect() as connection:
+        yield SimpleNamespace(engine=engine, connection=connection)
+
+
+def add_recordings(database, recordings: list[tuple]):
+    """Inserts recordings, as (id, plant_id, minutes before NOW) tuples."""
+    database.connection.execute(db.insert(tables.recording), [
+        {'id': recording_id, 'plant_id': plant_id, 'soil_moisture': 50.0, 'temperature': 15.0,
+         'datetime': NOW - timedelta(minutes=minutes)}
+        for recording_id, plant_id, minutes in recordings])
+
+
+def test_rolling_window_appends_new_rows(database):
+    """
+    Test a refresh adds the rows committed since the last, including those with lower ids than rows
+    already held, without holding any twice.
+    """
+    add_recordings(database, [(1, 1, 30), (2, 2, 2)])
+    window = RollingWindow('recording', database)
+    window.refresh(NOW)
+
+    # A load which took its ids first commits after a later one
+    add_recordings(database, [(5, 1, 0), (3, 2, 3)])
+    result = window.refresh(NOW + timedelta(seconds=1))
+
+    assert sorted(result['id']) == [1, 2, 3, 5]
+
+
+def test_rolling_window_evicts_old_rows(database):
+    """Test the rows older than the window's length are dropped, and no others."""
+    add_recordings(database, [(1, 1, 60), (2, 1, 30), (3, 1, 0)])
+    window = RollingWindow('recording', database, length=timedelta(minutes=45))
+    window.refresh(NOW)
+
+    result = window.refresh(NOW + timedelta(minutes=20))
+
+    assert list(result['id']) == [3]
+
+
+def test_rolling_window_empty_has_columns(database):
+    """Test an empty window still has the table's columns, before and after a refresh."""
+    window = RollingWindow('recording', database)
+
+    assert window.rows.empty
+    assert list(window.rows.columns) == [
+        'id', 'plant_id', 'soil_moisture', 'temperature', 'datetime']
+    assert list(window.refresh(NOW).columns) == list(window.rows.columns)
+    assert window.refresh(NOW)['plant_id'].tolist() == []
@@ -0,0 +1,93 @@
+"""Unit tests for graphics.py"""
+import numpy as np
+import pytest
+
+from graphics import get_lttb_indices
+
+
+def get_reference_lttb_indices(x: list, y: list, threshold: int) -> list[int]:
+    """
+    Returns the indices LTTB keeps, following the original algorithm point by point: buckets of
+    (n - 2) / (threshold - 2) points between the first and last, each giving the point with the
+    largest triangle between the point kept before it and the average of the next bucket.
+    """
+    n_points = len(x)
+    if threshold >= n_points or threshold < 3:
+        return list(range(n_points))
+
+    indices = [0]
+    for bucket in range(threshold - 2):
+        start = bucket * (n_points - 2) // (threshold - 2) + 1
+        stop = (bucket + 1) * (n_points - 2) // (threshold - 2) + 1
+        next_stop = min((bucket + 2) * (n_points - 2) // (threshold - 2) + 1, n_points)
+        next_x = sum(x[stop:next_stop]) / (next_stop - stop)
+        next_y = sum(y[stop:next_stop]) / (next_stop - stop)
+
+        previous = indices[-1]
+        largest_area, largest_index = -1, start
+        for index in range(start, stop):
+            area = abs((x[previous] - next_x) * (y[index] - y[previous])
+                       - (x[previous] - x[index]) * (next_y - y[previous])) / 2
+            if area > largest_area:
+                largest_area, largest_index = area, index
+        indices.append(largest_index)
+    indices.append(n_points - 1)
+    return indices
+
+
+@pytest.fixture
+def series():
+    """Returns a fixed, noisy sine wave of 1,000 points."""
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 50) * 10 + np.random.default_rng(7).normal(0, 1, 1000)
+    return x, y
+
+
+@pytest.mark.parametrize('threshold', [3, 4, 13, 100, 500, 999])
+def test_get_lttb_indices_matches_reference(series, threshold):
+    """Test the points kept are the ones the original algorithm keeps."""
+    x, y = series
+
+    result = get_lttb_indices(x, y, threshold)
+
+    assert list(result) == get_reference_lttb_indices(list(x), list(y), threshold)
+    assert len(result) == threshold
+
+
+@pytest.mark.parametrize('threshold', [13, 15, 24, 28])
+def test_get_lttb_indices_exact_bucket_edges(threshold):
+    """Test bucket edges falling on whole points aren't rounded into the bucket before."""
+    x = np.arange(32, dtype=float)
+    y = np.random.default_rng(7).normal(0, 1, 32).cumsum()
+
+    assert list(get_lttb_indices(x, y, threshold)) == get_reference_lttb_indices(
+        list(x), list(y), threshold)
+
+
+def test_get_lttb_indices_keeps_extremes(series):
+    """Test the first, last and most extreme points survive downsampling."""
+    x, y = series
+
+    result = get_lttb_indices(x, y, 100)
+
+    assert result[0] == 0 and result[-1] == 999
+    assert np.argmax(y) in result and np.argmin(y) in result
+
+
+@pytest.mark.parametrize('threshold', [1000, 1001, 2, 1, 0])
+def test_get_lttb_indices_keeps_every_point(series, threshold):
+    """Test every point is kept when the threshold isn't below the points, or is under 3."""
+    x, y = series
+
+    assert list(get_lttb_indices(x, y, threshold)) == list(range(1000))
+
+
+def test_get_lttb_indices_duplicate_x(series):
+    """Test points sharing an x (e.g. readings in the same second) are downsampled the same way."""
+    _, y = series
+    x = np.repeat(np.arange(500, dtype=float), 2)
+
+    result = get_lttb_indices(x, y, 50)
+
+    assert list(result) == get_reference_lttb_indices(list(x), list(y), 50)
+    assert (np.diff(result) > 0).all()
@@ -0,0 +1,217 @@
+"""Unit tests for s3_data_extraction.py"""
+from datetime import date
+from os import environ, path
+import sys
+import threading
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError
+import numpy as np
+import pandas as pd
+import pytest
+
+environ.setdefault('BUCKET_NAME', 'benchmark')
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'benchmarks'))
+
+import archive_files  # pylint: disable=wrong-import-position
+import manifest  # pylint: disable=wrong-import-position
+import offline  # pylint: disable=wrong-import-position
+import rollups  # pylint: disable=wrong-import-position
+import s3_data_extraction  # pylint: disable=wrong-import-position
+from s3_data_extraction import (  # pylint: disable=wrong-import-position
+    get_s3_data_for_type_and_date_ranges, get_s3_rollups_for_type_and_date_ranges)
+
+
+BUCKET_NAME = offline.BUCKET_NAME
+VERSION = '20231103001500-1a2b3c4d'
+MONTH_KEY = f'2023/11/recording-{VERSION}.csv'
+
+
+def get_recordings(start: str, periods: int, plant_ids: list[int], first_id: int = 0,
+                   freq: str = '15min') -> pd.DataFrame:
+    """
+    Returns recordings of each plant every freq from the start, with whole number measures, so
+    every sum and mean of up to 8 of them (a power of 2) is exact.
+    """
+    times = pd.date_range(start, periods=periods, freq=freq)
+    rows = len(times) * len(plant_ids)
+    return pd.DataFrame({'id': np.arange(first_id, first_id + rows),
+                         'plant_id': np.repeat(plant_ids, len(times)),
+                         'soil_moisture': np.arange(rows) % 50 + 20.0,
+                         'temperature': np.arange(rows) % 7 + 10.0,
+                         'datetime': np.tile(times, len(plant_ids))})
+
+
+def put_file(s3_client: offline.FakeS3Client, archive_manifest: dict, key: str, df: pd.DataFrame,
+             source: pd.DataFrame = None, resolution: str = None) -> None:
+    """
+    Writes the rows to a csv file, and lists it in the manifest; a rollup file's datetime range is
+    that of the rows it rolled up (source).
+    """
+    body = archive_files.get_file_body(df, 'csv')
+    response = s3_client.put_object(Body=body, Bucket=BUCKET_NAME, Key=key)
+    datetimes = (source if source is not None else df)['datetime']
+    archive_manifest['files'][key] = manifest.get_file_entry(
+        key, len(df), len(body), response['ETag'], datetimes.min(), datetimes.max(),
+        resolution=resolution)
+
+
+@pytest.fixture
+def archive():
+    """
+    Returns a fake bucket holding a rolled up month file of 1/11/2023 and 2/11/2023, the manifest
+    it's listed in, and the month file's rows.
+    """
+    s3_client = offline.FakeS3Client()
+    archive_manifest = {'files': {}}
+    month_df = get_recordings('2023-11-01', 2 * 24 * 4, [1, 2])
+    put_file(s3_client, archive_manifest, MONTH_KEY, month_df)
+    for resolution, rollup in rollups.get_rollups(
+            [rollups.get_partial_rollup(month_df, rollups.RESOLUTIONS['10min'])]).items():
+        put_file(s3_client, archive_manifest,
+                 rollups.get_rollup_key(resolution, 'recording', 2023, 11, 'csv', VERSION),
+                 rollup, month_df, resolution)
+    return s3_client, archive_manifest, month_df
+
+
+def get_rollups_read(s3_client: offline.FakeS3Client, archive_manifest: dict) -> tuple:
+    """Returns the hourly rollup of 1/11/2023 to 3/11/2023 read, and the keys of the files read."""
+    manifest.save_manifest(s3_client, archive_manifest, BUCKET_NAME)
+    with patch.object(s3_client, 'get_object', wraps=s3_client.get_object) as mock_get_object:
+        result = get_s3_rollups_for_type_and_date_ranges(
+            s3_client, 'recording', '1h', date(2023, 11, 1), date(2023, 11, 3), BUCKET_NAME)
+    keys_read = {call.kwargs['Key'] for call in mock_get_object.call_args_list}
+    return result, keys_read - {manifest.MANIFEST_KEY}
+
+
+def assert_rollup_of(result: pd.DataFrame, df: pd.DataFrame):
+    """Asserts the rollup read is the exact hourly rollup of the rows, counts and sums included."""
+    expected = rollups.get_rollup(rollups.get_partial_rollup(df, rollups.RESOLUTIONS['1h']))
+    pd.testing.assert_frame_equal(result, expected, check_exact=True, check_dtype=False)
+
+
+def test_get_s3_rollups_only_rollups(archive):
+    """Test a rolled up month is read from its rollup file alone."""
+    s3_client, archive_manifest, month_df = archive
+
+    result, keys_read = get_rollups_read(s3_client, archive_manifest)
+
+    assert_rollup_of(result, month_df)
+    assert keys_read == {f'rollups/1h/recording/2023/11-{VERSION}.csv'}
+
+
+def test_get_s3_rollups_with_later_parts(archive):
+    """Test the part files archived since the month was rolled up are rolled up and added."""
+    s3_client, archive_manifest, month_df = archive
+    part_dfs = [get_recordings('2023-11-03', 8, [1, 2], first_id=1000),
+                get_recordings('2023-11-03 02:00', 8, [1, 2], first_id=2000)]
+    for run, part_df in enumerate(part_dfs):
+        put_file(s3_client, archive_manifest, f'2023/11/recording_3/{run}.csv', part_df)
+
+    result, keys_read = get_rollups_read(s3_client, archive_manifest)
+
+    assert_rollup_of(result, pd.concat([month_df] + part_dfs, ignore_index=True))
+    assert MONTH_KEY not in keys_read
+
+
+def test_get_s3_rollups_with_part_in_rolled_up_range(archive):
+    """
+    Test a part archived late, into a day the month's rollups already cover, is added to the
+    rollups rather than dropped as if they held its rows.
+    """
+    s3_client, archive_manifest, month_df = archive
+    # Four more readings of plant 2 in an hour which already has four
+    late_df = get_recordings('2023-11-01 10:05', 4, [2], first_id=3000)
+    put_file(s3_client, archive_manifest, '2023/11/recording_1/late.csv', late_df)
+
+    result, keys_read = get_rollups_read(s3_client, archive_manifest)
+
+    assert_rollup_of(result, pd.concat([month_df, late_df], ignore_index=True))
+    late_hour = result[(result['plant_id'] == 2)
+                       & (result['datetime'] == pd.Timestamp('2023-11-01 10:00'))]
+    assert late_hour['soil_moisture_count'].tolist() == [8]
+    assert MONTH_KEY not in keys_read
+
+
+def get_day_archive() -> tuple[offline.FakeS3Client, dict, list[pd.DataFrame]]:
+    """
+    Returns a fake bucket holding a part file for each of 1/11/2023 to 3/11/2023, its (saved)
+    manifest, and each part's rows.
+    """
+    s3_client = offline.FakeS3Client()
+    archive_manifest = {'files': {}}
+    part_dfs = [get_recordings(f'2023-11-0{day}', 4, [1, 2], first_id=day * 100)
+                for day in (1, 2, 3)]
+    for day, part_df in enumerate(part_dfs, 1):
+        put_file(s3_client, archive_manifest, f'2023/11/recording_{day}/1.csv', part_df)
+    manifest.save_manifest(s3_client, archive_manifest, BUCKET_NAME)
+    return s3_client, archive_manifest, part_dfs
+
+
+def read_days(s3_client: offline.FakeS3Client) -> pd.DataFrame:
+    """Returns the recordings of 1/11/2023 to 3/11/2023 read from the archive."""
+    return get_s3_data_for_type_and_date_ranges(s3_client, 'recording', date(2023, 11, 1),
+                                                date(2023, 11, 3), BUCKET_NAME)
+
+
+def test_read_with_manifest_retries_stale_file():
+    """
+    Test a file replaced (by compaction) after the manifest was read fails its conditional read,
+    and the query is redone on the manifest read again.
+    """
+    s3_client, stale_manifest, part_dfs = get_day_archive()
+    # The first day's part is replaced, and the manifest updated, after the reader loaded it
+    part_dfs[0] = part_dfs[0].assign(soil_moisture=99.0)
+    current_manifest = {'files': dict(stale_manifest['files'])}
+    put_file(s3_client, current_manifest, '2023/11/recording_1/1.csv', part_dfs[0])
+
+    with patch('s3_data_extraction.manifest.load_manifest',
+               side_effect=[(stale_manifest, None), (current_manifest, None)]) as mock_load:
+        result = read_days(s3_client)
+
+    assert mock_load.call_count == 2
+    expected = pd.concat(part_dfs, ignore_index=True)[s3_data_extraction.ARCHIVE_COLUMNS[
+        'recording']]
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_read_with_manifest_gives_up():
+    """Test a file which stays stale fails the query once every attempt has been made."""
+    s3_client, _, _ = get_day_archive()
+    # Replaced without the manifest being updated, so every read of it fails
+    s3_client.put_object(Body=b'plant_id,datetime\n', Bucket=BUCKET_NAME,
+                         Key='2023/11/recording_2/1.csv')
+
+    with patch('s3_data_extraction.manifest.load_manifest',
+               wraps=manifest.load_manifest) as mock_load:
+        with pytest.raises(ClientError) as error:
+            read_days(s3_client)
+
+    assert error.value.response['Error']['Code'] == 'PreconditionFailed'
+    assert mock_load.call_count == s3_data_extraction.MAX_READ_ATTEMPTS
+
+
+def test_read_archive_keys_concurrent_single_concat():
+    """
+    Test the files are downloaded concurrently, and their rows joined with one concat in key order,
+    whichever finishes first.
+    """
+    s3_client, _, part_dfs = get_day_archive()
+    # Every download waits for the others to start, so reading them one at a time would fail
+    started = threading.Barrier(len(part_dfs), timeout=5)
+    get_object = s3_client.get_object
+
+    def get_object_concurrently(**kwargs):
+        if kwargs['Key'] == manifest.MANIFEST_KEY:
+            return get_object(**kwargs)
+        started.wait()
+        return get_object(**kwargs)
+
+    with (patch.object(s3_client, 'get_object', side_effect=get_object_concurrently),
+          patch('s3_data_extraction.pd.concat', wraps=pd.concat) as mock_concat):
+        result = read_days(s3_client)
+
+    mock_concat.assert_called_once()
+    assert len(mock_concat.call_args.args[0]) == len(part_dfs)
+    assert result['datetime'].dt.day.drop_duplicates().tolist() == [1, 2, 3]
+    assert len(result) == sum(len(part_df) for part_df in part_dfs)
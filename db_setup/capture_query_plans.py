@@ -0,0 +1,222 @@
+"""
+Script to capture the query plans and timings of the queries run most against the recording
+table, so schema.sql and schema_performance.sql can be compared on the same synthetic data. Set the
+database up with one, run `python capture_query_plans.py --seed --label before`, set it up with the
+other and run `python capture_query_plans.py --seed --label after --baseline before`.
+
+Each query's estimated plan is saved to query_plans/{label}/{query}.sqlplan (which SSMS and Azure
+Data Studio open graphically), and the timings of every query to query_plans/{label}/timings.json.
+Statements which change data are rolled back, so every query runs against the same rows.
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import json
+from os import environ, makedirs, path
+import statistics
+import time
+
+from dotenv import load_dotenv
+import numpy as np
+import sqlalchemy as db
+from sqlalchemy.engine.base import Connection
+
+from upload_seed_data import get_database_engine
+
+
+OUTPUT_DIRECTORY = 'query_plans'
+PARTITION_FUNCTION = 'pf_recording_time'  # As in schema_performance.sql
+SEED_HOURS = 26  # The 24-25 hours archival keeps, and a whole hour for it to archive
+# As load.py's INSERT_BATCH_SIZE. pymssql fills parameters in on the client, so MSSQL's limit of
+# 2,100 parameters a statement doesn't apply; 1,000 is the most rows one VALUES clause may insert
+INSERT_BATCH_ROWS = 1000
+REPEATS = 5
+
+# Name: (statement, whether it changes data); parameters are filled by get_query_parameters
+QUERIES = {
+    'archive_id_range': (
+        "SELECT MIN(id), MAX(id) FROM {schema}.recording WHERE datetime < %(cutoff)s", False),
+    'archive_select': (
+        "SELECT * FROM {schema}.recording "
+        "WHERE id BETWEEN %(min_id)s AND %(max_id)s AND datetime < %(cutoff)s", False),
+    'archive_delete_batch': (
+        "DELETE FROM {schema}.recording "
+        "WHERE id >= %(min_id)s AND id < %(stop_id)s AND datetime < %(cutoff)s", True),
+    # An hourly archival run's rows, all deleted at once, to compare switching out against
+    'archive_delete_hour': (
+        "DELETE FROM {schema}.recording "
+        "WHERE datetime >= %(archive_hour)s AND datetime < %(archive_hour_end)s", True),
+    'dashboard_window': (
+        "SELECT * FROM {schema}.recording WHERE datetime > %(cutoff)s", False),
+    'dashboard_delta': (
+        "SELECT * FROM {schema}.recording WHERE datetime > %(delta_cutoff)s", False),
+    'plant_window': (
+        "SELECT * FROM {schema}.recording "
+        "WHERE plant_id = %(plant_id)s AND datetime > %(cutoff)s", False),
+    # A batch of the minute pipeline's insert, as load.upload_recordings builds it (every row the
+    # same, as only the batch's size and shape affect the plan)
+    'load_insert_batch': (
+        "INSERT INTO {schema}.recording (plant_id, soil_moisture, temperature, datetime) "
+        "SELECT plant_id, soil_moisture, temperature, datetime FROM (VALUES "
+        + ", ".join(["(%(plant_id)s, 50.0, 15.0, %(now)s)"] * INSERT_BATCH_ROWS)
+        + ") AS new_recording (plant_id, soil_moisture, temperature, datetime)", True)
+}
+SWITCH_OUT_QUERY = (
+    "ALTER TABLE {schema}.recording SWITCH PARTITION $PARTITION.{function}(%(archive_hour)s) "
+    "TO {schema}.recording_switch PARTITION $PARTITION.{function}(%(archive_hour)s)")
+
+
+def is_partitioned(conn: Connection) -> bool:
+    """Returns whether the recording table is partitioned by time (schema_performance.sql)."""
+    query = db.text("SELECT COUNT(*) FROM sys.partition_functions WHERE name = :function_name")
+    return bool(conn.execute(query, {'function_name': PARTITION_FUNCTION}).scalar())
+
+
+def split_hourly_partitions(conn: Connection, start: datetime, end: datetime) -> None:
+    """Adds an hourly partition boundary from start to end, before the table is seeded."""
+    boundary = start.replace(minute=0, second=0, microsecond=0)
+    while boundary <= end:
+        conn.exec_driver_sql("ALTER PARTITION SCHEME ps_recording_time NEXT USED [PRIMARY]")
+        conn.exec_driver_sql(
+            f"ALTER PARTITION FUNCTION {PARTITION_FUNCTION}() SPLIT RANGE (%(boundary)s)",
+            {'boundary': boundary})
+        boundary += timedelta(hours=1)
+    conn.commit()
+
+
+def seed_recordings(conn: Connection, schema: str, hours: int, end: datetime) -> int:
+    """
+    Inserts a synthetic recording a minute for every plant over the hours before end, and returns
+    how many were inserted.
+    """
+    plant_ids = list(conn.execute(db.text(f"SELECT id FROM {schema}.plant")).scalars())
+    times = [end - timedelta(minutes=minute) for minute in range(hours * 60, 0, -1)]
+    rng = np.random.default_rng(0)
+    rows = [{'plant_id': plant_id, 'soil_moisture': float(moisture),
+             'temperature': float(temperature), 'datetime': moment}
+            for moment in times for plant_id, moisture, temperature in zip(
+                plant_ids, rng.uniform(15, 100, len(plant_ids)),
+                rng.uniform(10, 20, len(plant_ids)))]
+
+    recording = db.table('recording', db.column('plant_id'), db.column('soil_moisture'),
+                         db.column('temperature'), db.column('datetime'), schema=schema)
+    try:
+        for start in range(0, len(rows), INSERT_BATCH_ROWS):
+            conn.execute(db.insert(recording).values(rows[start:start + INSERT_BATCH_ROWS]))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    return len(rows)
+
+
+def get_query_parameters(conn: Connection, schema: str, now: datetime) -> dict:
+    """Returns the parameters the queries are run with, like those of the pipelines."""
+    cutoff = now - timedelta(hours=24)
+    archive_hour = (cutoff - timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+    min_id, max_id = conn.execute(db.text(
+        f"SELECT MIN(id), MAX(id) FROM {schema}.recording WHERE datetime < :cutoff"),
+        {'cutoff': cutoff}).one()
+    newest_datetime, plant_id = conn.execute(db.text(
+        f"SELECT MAX(datetime), MIN(plant_id) FROM {schema}.recording")).one()
+    # As the dashboard's window refreshes: the rows since its newest, less its overlap (10 minutes)
+    delta_cutoff = (newest_datetime or now) - timedelta(minutes=10)
+    return {'cutoff': cutoff, 'min_id': min_id or 0, 'max_id': max_id or 0,
+            'stop_id': (min_id or 0) + 1000, 'delta_cutoff': delta_cutoff,
+            'plant_id': plant_id, 'now': now, 'archive_hour': archive_hour,
+            'archive_hour_end': archive_hour + timedelta(hours=1)}
+
+
+def get_estimated_plan(conn: Connection, statement: str, parameters: dict) -> str:
+    """Returns the estimated plan (showplan XML) of a statement, without running it."""
+    conn.exec_driver_sql("SET SHOWPLAN_XML ON")
+    try:
+        return conn.exec_driver_sql(statement, parameters).scalar()
+    finally:
+        conn.exec_driver_sql("SET SHOWPLAN_XML OFF")
+
+
+def time_statement(conn: Connection, statement: str, parameters: dict, changes_data: bool,
+                   repeats: int = REPEATS) -> dict:
+    """
+    Runs a statement repeats times, rolling back any changes each time; returns the rows it
+    returned (or affected) and its timings in milliseconds.
+    """
+    timings, rows = [], 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = conn.exec_driver_sql(statement, parameters)
+        rows = result.rowcount if changes_data or not result.returns_rows else len(result.all())
+        timings.append((time.perf_counter() - start) * 1000)
+        conn.rollback()
+    return {'rows': rows, 'median_ms': statistics.median(timings), 'timings_ms': timings}
+
+
+def capture(conn: Connection, schema: str, label: str, repeats: int = REPEATS) -> dict:
+    """Captures the plans and timings of every query; returns the timings written."""
+    partitioned = is_partitioned(conn)
+    parameters = get_query_parameters(conn, schema, datetime.now())
+    output_directory = path.join(OUTPUT_DIRECTORY, label)
+    makedirs(output_directory, exist_ok=True)
+
+    statements = {name: (query.format(schema=schema), changes_data)
+                  for name, (query, changes_data) in QUERIES.items()}
+    if partitioned:
+        statements['archive_switch_out'] = (
+            SWITCH_OUT_QUERY.format(schema=schema, function=PARTITION_FUNCTION), True)
+
+    results = {}
+    for name, (statement, changes_data) in statements.items():
+        if name != 'archive_switch_out':  # DDL has no plan
+            with open(path.join(output_directory, f'{name}.sqlplan'), 'w',
+                      encoding='utf-8') as plan_file:
+                plan_file.write(get_estimated_plan(conn, statement, parameters))
+        results[name] = time_statement(conn, statement, parameters, changes_data, repeats)
+
+    timings = {'label': label, 'partitioned': partitioned,
+               'table_rows': conn.execute(db.text(
+                   f"SELECT COUNT(*) FROM {schema}.recording")).scalar(),
+               'queries': results}
+    with open(path.join(output_directory, 'timings.json'), 'w', encoding='utf-8') as timings_file:
+        json.dump(timings, timings_file, indent=2)
+    return timings
+
+
+def print_comparison(timings: dict, baseline: dict) -> None:
+    """Prints the median timing of each query against that of the baseline."""
+    print(f"{'query':<24}{baseline['label']:>12}{timings['label']:>12}{'speedup':>10}")
+    for name, result in timings['queries'].items():
+        # Switching out is compared against deleting the same hour of rows
+        baseline_name = 'archive_delete_hour' if name == 'archive_switch_out' else name
+        baseline_ms = baseline['queries'][baseline_name]['median_ms']
+        print(f"{name:<24}{baseline_ms:>10.1f}ms{result['median_ms']:>10.1f}ms"
+              f"{baseline_ms / max(result['median_ms'], 1e-3):>9.1f}x")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--label', required=True, help='name of the schema being measured')
+    parser.add_argument('--seed', action='store_true',
+                        help='insert synthetic recordings first (into an empty recording table)')
+    parser.add_argument('--hours', type=int, default=SEED_HOURS, help='hours of recordings to seed')
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--baseline', help='label of earlier timings to compare against')
+    args = parser.parse_args()
+
+    db_schema = environ['DB_SCHEMA']
+    with get_database_engine().connect() as connection:
+        if args.seed:
+            seed_end = datetime.now()
+            if is_partitioned(connection):
+                split_hourly_partitions(connection, seed_end - timedelta(hours=args.hours),
+                                        seed_end + timedelta(hours=1))
+            print(f"Seeded {seed_recordings(connection, db_schema, args.hours, seed_end)} rows.")
+        captured = capture(connection, db_schema, args.label, args.repeats)
+
+    if args.baseline:
+        with open(path.join(OUTPUT_DIRECTORY, args.baseline, 'timings.json'),
+                  encoding='utf-8') as baseline_file:
+            print_comparison(captured, json.load(baseline_file))
+    else:
+        print(json.dumps(captured, indent=2))
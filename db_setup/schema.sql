@@ -1,7 +1,7 @@
 USE plants;
 GO
 
-DROP TABLE if exists s_beta.image, s_beta.watering, s_beta.duty, s_beta.recording, s_beta.botanist, s_beta.plant, s_beta.location;
+DROP TABLE if exists s_beta.image, s_beta.latest_recording, s_beta.watering, s_beta.duty, s_beta.recording, s_beta.botanist, s_beta.plant, s_beta.location;
 GO
 
 CREATE TABLE s_beta.recording (
@@ -17,6 +17,18 @@ ALTER TABLE
  s_beta.recording ADD CONSTRAINT "recording_id_primary" PRIMARY KEY("id");
 GO
 
+CREATE TABLE s_beta.latest_recording (
+    "plant_id" INT NOT NULL,
+    "soil_moisture" FLOAT NOT NULL,
+    "temperature" FLOAT NOT NULL,
+    "datetime" datetime2 NOT NULL
+);
+GO
+
+ALTER TABLE
+ s_beta.latest_recording ADD CONSTRAINT "latest_recording_plant_id_primary" PRIMARY KEY("plant_id");
+GO
+
 CREATE TABLE s_beta.plant(
     "id" INT IDENTITY(0,1),
     "name" VARCHAR(255),
@@ -114,6 +126,10 @@ ALTER TABLE
  s_beta.recording  ADD CONSTRAINT "recording_plant_id_foreign" FOREIGN KEY("plant_id") REFERENCES s_beta.plant("id");
 GO
 
+ALTER TABLE
+ s_beta.latest_recording ADD CONSTRAINT "latest_recording_plant_id_foreign" FOREIGN KEY("plant_id") REFERENCES s_beta.plant("id");
+GO
+
 ALTER TABLE
     s_beta.plant ADD CONSTRAINT "plant_location_id_foreign" FOREIGN KEY("location_id") REFERENCES s_beta.location("id");
 GO
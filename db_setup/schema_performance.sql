@@ -0,0 +1,205 @@
+USE plants;
+GO
+
+-- Performance variant of schema.sql: the same tables, with time indexes on recording and
+-- watering, and recording partitioned by hour so archival can switch old partitions out (see
+-- minute_pipeline/partitions.py) rather than deleting their rows. recording_switch is the table
+-- they're switched into; it must match recording exactly. Boundaries are added by the archival
+-- runs, or by running `python partitions.py` in minute_pipeline/ once this has been run.
+
+DROP TABLE if exists s_beta.image, s_beta.latest_recording, s_beta.watering, s_beta.duty, s_beta.recording, s_beta.recording_switch, s_beta.botanist, s_beta.plant, s_beta.location;
+GO
+
+IF EXISTS (SELECT 1 FROM sys.partition_schemes WHERE name = 'ps_recording_time')
+    DROP PARTITION SCHEME ps_recording_time;
+IF EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = 'pf_recording_time')
+    DROP PARTITION FUNCTION pf_recording_time;
+GO
+
+-- One partition to start with; partitions.maintain_boundaries splits hourly ones ahead of the data
+CREATE PARTITION FUNCTION pf_recording_time (datetime2) AS RANGE RIGHT FOR VALUES ();
+GO
+
+CREATE PARTITION SCHEME ps_recording_time AS PARTITION pf_recording_time ALL TO ([PRIMARY]);
+GO
+
+CREATE TABLE s_beta.recording (
+    "id" INT IDENTITY(1,1),
+    "plant_id" INT NOT NULL,
+    "soil_moisture" FLOAT NOT NULL,
+    "temperature" FLOAT NOT NULL,
+    "datetime" datetime2 NOT NULL
+) ON ps_recording_time("datetime");
+GO
+
+-- Every index includes "datetime" and is on the partition scheme, so partitions can be switched
+ALTER TABLE
+ s_beta.recording ADD CONSTRAINT "recording_id_primary" PRIMARY KEY NONCLUSTERED("id", "datetime")
+ ON ps_recording_time("datetime");
+GO
+
+CREATE CLUSTERED INDEX "recording_datetime" ON s_beta.recording ("datetime", "plant_id")
+ ON ps_recording_time("datetime");
+GO
+
+CREATE NONCLUSTERED INDEX "recording_plant_id_datetime" ON s_beta.recording ("plant_id", "datetime")
+ INCLUDE ("soil_moisture", "temperature") ON ps_recording_time("datetime");
+GO
+
+CREATE TABLE s_beta.recording_switch (
+    "id" INT IDENTITY(1,1),
+    "plant_id" INT NOT NULL,
+    "soil_moisture" FLOAT NOT NULL,
+    "temperature" FLOAT NOT NULL,
+    "datetime" datetime2 NOT NULL
+) ON ps_recording_time("datetime");
+GO
+
+ALTER TABLE
+ s_beta.recording_switch ADD CONSTRAINT "recording_switch_id_primary" PRIMARY KEY NONCLUSTERED("id", "datetime")
+ ON ps_recording_time("datetime");
+GO
+
+CREATE CLUSTERED INDEX "recording_switch_datetime" ON s_beta.recording_switch ("datetime", "plant_id")
+ ON ps_recording_time("datetime");
+GO
+
+CREATE NONCLUSTERED INDEX "recording_switch_plant_id_datetime" ON s_beta.recording_switch ("plant_id", "datetime")
+ INCLUDE ("soil_moisture", "temperature") ON ps_recording_time("datetime");
+GO
+
+CREATE TABLE s_beta.latest_recording (
+    "plant_id" INT NOT NULL,
+    "soil_moisture" FLOAT NOT NULL,
+    "temperature" FLOAT NOT NULL,
+    "datetime" datetime2 NOT NULL
+);
+GO
+
+ALTER TABLE
+ s_beta.latest_recording ADD CONSTRAINT "latest_recording_plant_id_primary" PRIMARY KEY("plant_id");
+GO
+
+CREATE TABLE s_beta.plant(
+    "id" INT IDENTITY(0,1),
+    "name" VARCHAR(255),
+    "scientific_name" VARCHAR(255),
+    "location_id" INT
+);
+GO
+
+ALTER TABLE
+    s_beta.plant ADD CONSTRAINT "plant_id_primary" PRIMARY KEY("id");
+GO
+
+CREATE TABLE s_beta.watering(
+    "id" INT IDENTITY(1,1),
+    "plant_id" INT NOT NULL,
+    "datetime" datetime2 NOT NULL
+);
+GO
+
+ALTER TABLE s_beta.watering
+    ADD CONSTRAINT "watering_id_primary" PRIMARY KEY("id");
+GO
+
+ALTER TABLE s_beta.watering
+    ADD CONSTRAINT "unique_watering_events" UNIQUE ("plant_id", "datetime");
+GO
+
+CREATE NONCLUSTERED INDEX "watering_datetime" ON s_beta.watering ("datetime");
+GO
+
+
+CREATE TABLE s_beta.botanist(
+    "id" INT IDENTITY(1,1),
+    "email" VARCHAR(350) NOT NULL,
+    "firstname" VARCHAR(100) NOT NULL,
+    "lastname" VARCHAR(100) NOT NULL,
+    "phone" VARCHAR(30) NOT NULL
+);
+GO
+
+ALTER TABLE
+    s_beta.botanist ADD CONSTRAINT "botanist_id_primary" PRIMARY KEY("id");
+GO
+
+BEGIN TRANSACTION;
+INSERT INTO s_beta.botanist ("email", "firstname", "lastname", "phone")
+VALUES
+('gertrude.jekyll@lnhm.co.uk','Gertrude','Jekyll','001-481-273-3691x127'),
+('carl.linnaeus@lnhm.co.uk','Carl','Linnaeus','(146)994-1635x35992'),
+('eliza.andrews@lnhm.co.uk','Eliza','Andrews','(846)669-6651x75948')
+;
+COMMIT;
+
+CREATE TABLE s_beta.location(
+    "id" INT IDENTITY(1,1),
+    "latitude" FLOAT NOT NULL,
+    "longitude" FLOAT NOT NULL,
+    "town" VARCHAR(100) NOT NULL,
+    "city" VARCHAR(100) NOT NULL,
+    "country_code" NCHAR(2) NOT NULL,
+    "continent" VARCHAR(50) NOT NULL
+);
+GO
+
+ALTER TABLE
+    s_beta.location ADD CONSTRAINT "location_id_primary" PRIMARY KEY("id");
+GO
+
+CREATE TABLE s_beta.duty(
+    "id" INT IDENTITY(1,1),
+    "botanist_id" INT NOT NULL,
+    "plant_id" INT NOT NULL,
+    "start" datetime2 NOT NULL DEFAULT(GETDATE()),
+    "end" datetime2
+);
+GO
+
+ALTER TABLE
+    s_beta.duty ADD CONSTRAINT "duty_id_primary" PRIMARY KEY("id");
+GO
+
+CREATE TABLE s_beta.image (
+    "id" INT IDENTITY(1,1),
+    "plant_id" INT NOT NULL,
+    "image_url" VARCHAR(500) NOT NULL,
+    "license" INT,
+    "license_name" VARCHAR(255),
+    "license_url" VARCHAR(255),
+);
+GO
+
+ALTER TABLE
+    s_beta.image ADD CONSTRAINT "image_id_primary" PRIMARY KEY("id");
+GO
+
+
+ALTER TABLE
+ s_beta.recording  ADD CONSTRAINT "recording_plant_id_foreign" FOREIGN KEY("plant_id") REFERENCES s_beta.plant("id");
+GO
+
+ALTER TABLE
+ s_beta.latest_recording ADD CONSTRAINT "latest_recording_plant_id_foreign" FOREIGN KEY("plant_id") REFERENCES s_beta.plant("id");
+GO
+
+ALTER TABLE
+    s_beta.plant ADD CONSTRAINT "plant_location_id_foreign" FOREIGN KEY("location_id") REFERENCES s_beta.location("id");
+GO
+
+ALTER TABLE
+    s_beta.watering ADD CONSTRAINT "watering_plant_id_foreign" FOREIGN KEY("plant_id") REFERENCES s_beta.plant("id");
+GO
+
+ALTER TABLE
+    s_beta.duty ADD CONSTRAINT "duty_plant_id_foreign" FOREIGN KEY("plant_id") REFERENCES s_beta.plant("id");
+GO
+
+ALTER TABLE
+    s_beta.duty ADD CONSTRAINT "duty_botanist_id_foreign" FOREIGN KEY("botanist_id") REFERENCES s_beta.botanist("id");
+GO
+
+ALTER TABLE
+ s_beta.image  ADD CONSTRAINT "image_plant_id_foreign" FOREIGN KEY("plant_id") REFERENCES s_beta.plant("id");
+GO
@@ -0,0 +1,39 @@
+"""
+Contains the database engine shared by every stage of the pipeline. The engine (and so its
+connection pool) is created once per process, so warm Lambda invocations reuse its connections
+rather than logging in to the database again.
+"""
+
+from functools import cache
+from os import environ
+
+import sqlalchemy as db
+
+import metrics
+import tables
+
+
+POOL_SIZE = 1
+MAX_OVERFLOW = 2
+POOL_RECYCLE = 1800  # Seconds; connections older than this are replaced before they're used
+
+
+@cache
+def get_database_engine() -> db.Engine:
+    """
+    Returns the pooled database engine, creating it on first use. Connections are pinged before
+    being handed out, so ones dropped while the Lambda was frozen are transparently replaced.
+    """
+    metrics.instrument_engines()
+    try:
+        return db.create_engine(
+            f"mssql+pymssql://{environ['DB_USER']}:{environ['DB_PASSWORD']}@{environ['DB_HOST']}:{environ['DB_PORT']}/{environ['DB_NAME']}?charset=utf8",
+            execution_options={'schema_translate_map': tables.get_schema_translate_map()},
+            pool_size=int(environ.get('DB_POOL_SIZE', POOL_SIZE)),
+            max_overflow=int(environ.get('DB_MAX_OVERFLOW', MAX_OVERFLOW)),
+            pool_recycle=int(environ.get('DB_POOL_RECYCLE', POOL_RECYCLE)),
+            pool_pre_ping=True
+        )
+    except Exception as e:
+        print(f"Error creating database engine: {e}")
+        raise e
@@ -1,31 +1,234 @@
 """Script to extract and clean API data."""
-import concurrent.futures
+import asyncio
+from collections import deque
+import time
 
-import logging
+import aiohttp
+import numpy as np
 import pandas as pd
-from requests import get
+
+import metrics
+from metrics import METRICS
 
 
 BASE_URL = 'https://data-eng-plants-api.herokuapp.com/plants/'
 NO_OF_PLANTS = 51
+MAX_CONCURRENT_REQUESTS = 100
+MAX_CONNECTIONS_PER_HOST = 100
+KEEPALIVE_TIMEOUT = 30
+EXTRACT_DEADLINE = 40  # Seconds; leaves the rest of the minute for load and archival
+LATENCY_WINDOW = 1000
+MIN_LATENCY_SAMPLES = 20
+DEFAULT_REQUEST_TIMEOUT = 10
+MIN_REQUEST_TIMEOUT = 2
+MAX_REQUEST_TIMEOUT = 30
+TIMEOUT_LATENCY_MULTIPLIER = 3
+HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_DELAY = 2
+MIN_HEDGE_DELAY = 0.1
+RECORD_FIELDS = ('plant_id', 'soil_moisture', 'temperature', 'recording_taken', 'last_watered')
+
+
+logger = metrics.set_up_logger()
+
+
+class LatencyTracker():
+    """
+    Keeps a rolling window of observed API request latencies (in seconds); a module-level tracker
+    persists across warm Lambda invocations, so timeouts adapt to how the API is behaving.
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW) -> None:
+        """Creates an empty tracker holding at most the given number of latencies."""
+        self.latencies = deque(maxlen=window)
+
+    def record(self, latency: float) -> None:
+        """Adds a request latency to the window."""
+        self.latencies.append(latency)
+
+    def percentile(self, q: float) -> float:
+        """Returns the q-th percentile latency, or None if too few requests have been seen."""
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        return float(np.percentile(self.latencies, q))
+
+
+REQUEST_LATENCIES = LatencyTracker()
+
 
+class RecordColumns():
+    """
+    Typed column arrays, preallocated with a row for every plant requested, which each plant's
+    compact record is written into as its response arrives: plant ids (int64) and measures
+    (float64), and the API's time strings, which transform parses a whole column at a time.
+    """
 
-def set_up_logger():
-    """Set up a logger, to log pipeline progress to the console."""
-    logging.basicConfig(level=logging.INFO,
-                        format='%(asctime)s - %(levelname)s - %(message)s')
-    return logging.getLogger('logger')
+    def __init__(self, size: int) -> None:
+        """Creates empty columns with room for the given number of records."""
+        self.plant_id = np.zeros(size, dtype=np.int64)
+        self.has_plant_id = np.zeros(size, dtype=bool)
+        self.soil_moisture = np.full(size, np.nan)
+        self.temperature = np.full(size, np.nan)
+        self.recording_taken = np.full(size, None, dtype=object)
+        self.last_watered = np.full(size, None, dtype=object)
+        self.rows = 0
 
+    def __len__(self) -> int:
+        """Returns how many records have been written."""
+        return self.rows
 
-def get_plant_data(plant_id: int) -> dict:
-    """Gets plant data from API using ID."""
-    logger = set_up_logger()
-    api_data = get(BASE_URL + str(plant_id), timeout=100).json()
+    def append(self, record: tuple) -> None:
+        """
+        Writes a compact record (see get_compact_record) into the next row; raises a ValueError or
+        TypeError, writing nothing, if its plant id or measures aren't numbers.
+        """
+        plant_id, soil_moisture, temperature, recording_taken, last_watered = record
+        values = (int(plant_id) if plant_id is not None else 0,
+                  float(soil_moisture) if soil_moisture is not None else np.nan,
+                  float(temperature) if temperature is not None else np.nan)
+
+        row = self.rows
+        self.plant_id[row], self.soil_moisture[row], self.temperature[row] = values
+        self.has_plant_id[row] = plant_id is not None
+        self.recording_taken[row] = recording_taken
+        self.last_watered[row] = last_watered
+        self.rows += 1
+
+
+def get_request_timeout(latencies: LatencyTracker = REQUEST_LATENCIES) -> float:
+    """Returns a per-request timeout derived from the observed p99 latency."""
+    p99_latency = latencies.percentile(99)
+    if p99_latency is None:
+        return DEFAULT_REQUEST_TIMEOUT
+    return min(max(p99_latency * TIMEOUT_LATENCY_MULTIPLIER, MIN_REQUEST_TIMEOUT),
+               MAX_REQUEST_TIMEOUT)
+
+
+def get_hedge_delay(latencies: LatencyTracker = REQUEST_LATENCIES) -> float:
+    """Returns how long to wait on a request before sending a duplicate of it."""
+    hedge_latency = latencies.percentile(HEDGE_PERCENTILE)
+    if hedge_latency is None:
+        return DEFAULT_HEDGE_DELAY
+    return max(hedge_latency, MIN_HEDGE_DELAY)
+
+
+async def get_plant_data(session: aiohttp.ClientSession, plant_id: int,
+                         timeout: float = DEFAULT_REQUEST_TIMEOUT) -> dict:
+    """Gets plant data from API using ID, through the shared session."""
+    METRICS.increment('api_requests')
+    start = time.perf_counter()
+    try:
+        async with session.get(BASE_URL + str(plant_id),
+                               timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            api_data = await response.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # One unreachable plant shouldn't lose the readings of every other plant
+        logger.info("Error fetching plant %s: %s", plant_id, e)
+        if isinstance(e, asyncio.TimeoutError):
+            # A censored sample: the request would have taken at least this long
+            REQUEST_LATENCIES.record(time.perf_counter() - start)
+        METRICS.increment('api_errors')
+        return {'plant_id': plant_id, 'error': str(e)}
+
+    latency = time.perf_counter() - start
+    REQUEST_LATENCIES.record(latency)
+    METRICS.observe('api_latency_seconds', latency)
     if 'error' in api_data:
         logger.info("Error: %s", api_data.get('error'))
     return api_data
 
 
+async def get_hedged_plant_data(session: aiohttp.ClientSession, plant_id: int,
+                                timeout: float, hedge_delay: float) -> dict:
+    """
+    Gets plant data from API using ID; if the request hasn't answered within hedge_delay seconds, a
+    duplicate is sent and whichever answers first without an error is used. If the first request
+    is still running when the call ends (it lost to the duplicate, or the call was cancelled at the
+    deadline), the time it has taken is recorded as a censored latency sample, so the slowest
+    requests aren't left out of the latencies timeouts and hedge delays are derived from.
+    """
+    start = time.perf_counter()
+    requests = [asyncio.create_task(get_plant_data(session, plant_id, timeout))]
+    try:
+        done, _ = await asyncio.wait(requests, timeout=hedge_delay)
+        if not done:
+            requests.append(asyncio.create_task(get_plant_data(session, plant_id, timeout)))
+            METRICS.increment('api_hedged_requests')
+
+        api_data = {}
+        for next_response in asyncio.as_completed(requests):
+            api_data = await next_response
+            if 'error' not in api_data:
+                break
+        return api_data
+
+    finally:
+        if not requests[0].done():
+            REQUEST_LATENCIES.record(time.perf_counter() - start)
+        for request in requests:
+            request.cancel()
+
+
+def get_compact_record(data: dict) -> tuple:
+    """
+    Returns just the fields of a plant's API data the pipeline uses, as a tuple; raises a TypeError
+    if the data isn't a JSON object.
+    """
+    if not isinstance(data, dict):
+        raise TypeError(f"Expected a JSON object, not {type(data).__name__}")
+    return tuple(data.get(key) for key in RECORD_FIELDS)
+
+
+async def get_all_plant_data(plant_ids, max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+                             deadline: float = EXTRACT_DEADLINE) -> tuple[RecordColumns, list[int]]:
+    """
+    Gets plant data for every given ID concurrently, over one pooled keep-alive session; at most
+    max_concurrency plants are requested at a time. Returns the record columns of every plant
+    answered within the deadline (in seconds), in the order they answered, and the ids of the
+    plants which weren't, or whose response couldn't be read (e.g. an HTML error page, or an empty
+    body).
+    """
+    plant_ids = list(plant_ids)
+    columns = RecordColumns(len(plant_ids))
+    timeout = get_request_timeout()
+    hedge_delay = get_hedge_delay()
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    connector = aiohttp.TCPConnector(limit=max_concurrency,
+                                     limit_per_host=min(max_concurrency, MAX_CONNECTIONS_PER_HOST),
+                                     keepalive_timeout=KEEPALIVE_TIMEOUT)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async def get_bounded_plant_data(plant_id: int) -> bool:
+            try:
+                # Waiting on the semaphore rather than the connector keeps queued requests from
+                # eating into their own timeout
+                async with semaphore:
+                    api_data = await get_hedged_plant_data(session, plant_id, timeout,
+                                                           hedge_delay)
+                columns.append(get_compact_record(api_data))
+                return True
+            except (ValueError, TypeError, KeyError) as e:
+                # One malformed response shouldn't lose the readings of every other plant
+                logger.info("Malformed response for plant %s: %s", plant_id, e)
+                METRICS.increment('api_errors')
+                return False
+
+        tasks = {asyncio.create_task(get_bounded_plant_data(plant_id)): plant_id
+                 for plant_id in plant_ids}
+        if not tasks:
+            return columns, []
+
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    return columns, sorted(plant_id for task, plant_id in tasks.items()
+                           if task not in done or not task.result())
+
+
 def get_recording_data(data: dict) -> dict:
     """Returns recording data as dictionary."""
     relevant_cols = ['plant_id', 'soil_moisture',
@@ -39,20 +242,59 @@ def get_watering_data(data: dict) -> dict:
     return {key: data.get(key) for key in relevant_cols}
 
 
-def extract():
-    """Function to extract all the moisture and temperature readings and save them to dataframes."""
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        all_data_list = list(executor.map(get_plant_data, range(NO_OF_PLANTS)))
+def get_dataframes(columns: RecordColumns) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Builds the recording and watering dataframes straight from the typed record columns, keeping
+    only the rows with every value they need.
+    """
+    rows = len(columns)
+    has_plant_id = columns.has_plant_id[:rows]
+    recording_taken = columns.recording_taken[:rows]
+    last_watered = columns.last_watered[:rows]
+    has_recording = (has_plant_id & ~np.isnan(columns.soil_moisture[:rows])
+                     & ~np.isnan(columns.temperature[:rows]) & ~pd.isna(recording_taken))
+    has_watering = has_plant_id & ~pd.isna(last_watered)
+
+    recording_df = pd.DataFrame({
+        'plant_id': columns.plant_id[:rows][has_recording],
+        'soil_moisture': columns.soil_moisture[:rows][has_recording],
+        'temperature': columns.temperature[:rows][has_recording],
+        'recording_taken': recording_taken[has_recording]
+    })
+    watering_df = pd.DataFrame({
+        'plant_id': columns.plant_id[:rows][has_watering],
+        'last_watered': last_watered[has_watering]
+    })
+
+    return recording_df, watering_df
+
+
+def extract_within_deadline(plant_ids=None, max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+                            deadline: float = EXTRACT_DEADLINE):
+    """
+    Function to extract the moisture and temperature readings of every plant answering within the
+    deadline (in seconds) and save them to dataframes; also returns the ids of skipped plants.
+    """
+    if plant_ids is None:
+        plant_ids = range(NO_OF_PLANTS)
 
-    df = pd.DataFrame(all_data_list)
+    columns, skipped_plant_ids = asyncio.run(
+        get_all_plant_data(plant_ids, max_concurrency, deadline))
+    if skipped_plant_ids:
+        METRICS.increment('plants_skipped', len(skipped_plant_ids))
+        logger.warning("Skipped %s plants, past the extraction deadline or with malformed "
+                       "responses: %s", len(skipped_plant_ids), skipped_plant_ids)
 
-    recordings = df[['plant_id', 'soil_moisture',
-                    'temperature', 'recording_taken']]
-    waterings = df[['plant_id', 'last_watered']]
+    recording_df, watering_df = get_dataframes(columns)
+    METRICS.increment('rows', len(recording_df), stage='extract')
 
-    recording_df = pd.DataFrame(recordings).dropna()
-    watering_df = pd.DataFrame(waterings).dropna()
+    return recording_df, watering_df, skipped_plant_ids
 
+
+def extract(plant_ids=None, max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+            deadline: float = EXTRACT_DEADLINE):
+    """Function to extract all the moisture and temperature readings and save them to dataframes."""
+    recording_df, watering_df, _ = extract_within_deadline(plant_ids, max_concurrency, deadline)
     return recording_df, watering_df
 
 
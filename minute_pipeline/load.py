@@ -1,55 +1,115 @@
 """File to load the clean recording and watering data into the short term database."""
-from os import environ
-
 from dotenv import load_dotenv
+import pandas as pd
 import sqlalchemy as db
 from sqlalchemy.engine.base import Connection
 
+from database import get_database_engine
+import tables
+
+
+RECORDING_COLUMNS = ['plant_id', 'soil_moisture', 'temperature', 'datetime']
+WATERING_COLUMNS = ['plant_id', 'datetime']
+LATEST_RECORDING_COLUMNS = ['plant_id', 'soil_moisture', 'temperature', 'datetime']
+INSERT_BATCH_SIZE = 1000
+
+
+def get_row_batches(data: pd.DataFrame, columns: list[str],
+                    batch_size: int = INSERT_BATCH_SIZE) -> list[list[tuple]]:
+    """Splits the given columns of a dataframe into batches of row tuples, built column-wise."""
+    rows = list(zip(*(data[column].tolist() for column in columns)))
+    return [rows[start:start + batch_size] for start in range(0, len(rows), batch_size)]
+
+
+def get_values_source(rows: list[tuple], table: db.Table, columns: list[str],
+                      name: str) -> db.Values:
+    """Returns a VALUES clause of the given rows, usable as a derived table in other queries."""
+    return db.values(*(db.column(column, table.c[column].type) for column in columns),
+                     name=name).data(rows)
+
+
+def upsert_latest_recordings(data, conn: Connection, table: db.Table) -> None:
+    """
+    Sets each plant's row of the latest_recording table to its latest recording in the data (one
+    row per plant), unless the table already holds a later one; doesn't commit.
+    """
+    latest = data.sort_values('datetime').drop_duplicates('plant_id', keep='last')
+    rows = get_row_batches(latest, LATEST_RECORDING_COLUMNS, batch_size=len(latest))[0]
+    new_latest = get_values_source(rows, table, LATEST_RECORDING_COLUMNS, 'new_latest')
 
-def get_database_engine():
-    """Returns the database engine."""
+    conn.execute(db.update(table).where(
+        (table.c.plant_id == new_latest.c.plant_id) &
+        (table.c.datetime <= new_latest.c.datetime)
+    ).values(soil_moisture=new_latest.c.soil_moisture, temperature=new_latest.c.temperature,
+             datetime=new_latest.c.datetime))
+
+    existing_plants = db.select(table.c.plant_id).where(table.c.plant_id == new_latest.c.plant_id)
+    conn.execute(db.insert(table).from_select(
+        LATEST_RECORDING_COLUMNS,
+        db.select(new_latest).where(~db.exists(existing_plants))))
+
+
+def upload_recordings(data, conn: Connection, table: db.Table,
+                      latest_table: db.Table = None) -> None:
+    """
+    Uploads recording data to the database, in batches of multi-row inserts; given the
+    latest_recording table, each plant's latest recording is upserted into it in the same
+    transaction.
+    """
     try:
-        engine = db.create_engine(
-            f"mssql+pymssql://{environ['DB_USER']}:{environ['DB_PASSWORD']}@{environ['DB_HOST']}:{environ['DB_PORT']}/{environ['DB_NAME']}?charset=utf8"
-        )
-        return engine
+        for rows in get_row_batches(data, RECORDING_COLUMNS):
+            new_recordings = get_values_source(rows, table, RECORDING_COLUMNS, 'new_recording')
+            conn.execute(db.insert(table).from_select(RECORDING_COLUMNS,
+                                                      db.select(new_recordings)))
+        if latest_table is not None and not data.empty:
+            upsert_latest_recordings(data, conn, latest_table)
+        conn.commit()
     except Exception as e:
-        print(f"Error creating database engine: {e}")
+        conn.rollback()
         raise e
 
 
-def upload_recordings(data, conn: Connection, table: db.Table) -> None:
-    """Uploads recording data to the database."""
-    data_dict = data.to_dict(orient='records')
+def upload_waterings(data, conn: Connection, table: db.Table) -> tuple[int, int]:
+    """
+    Uploads watering data to the database with one set-based insert per batch, anti-joined against
+    the waterings already in the table; returns how many were inserted and how many were duplicates.
+    """
+    if data.empty:
+        return 0, 0
+
+    inserted = 0
     try:
-        conn.execute(table.insert(), data_dict)
+        for rows in get_row_batches(data.drop_duplicates(subset=WATERING_COLUMNS),
+                                    WATERING_COLUMNS):
+            new_waterings = get_values_source(rows, table, WATERING_COLUMNS, 'new_watering')
+            existing_waterings = db.select(table.c.id).where(
+                (table.c.plant_id == new_waterings.c.plant_id) &
+                (table.c.datetime == new_waterings.c.datetime))
+            query = db.insert(table).from_select(
+                WATERING_COLUMNS,
+                db.select(new_waterings).where(~db.exists(existing_waterings)))
+            inserted += conn.execute(query).rowcount
         conn.commit()
     except Exception as e:
         conn.rollback()
         raise e
 
+    return inserted, len(data) - inserted
+
+
+def load(recordings, waterings, db_connection: Connection = None) -> tuple[int, int]:
+    """
+    Main function to run the whole load script, on the given connection (or one from the shared
+    engine's pool); returns how many waterings were inserted, and how many were already in the
+    database.
+    """
+    if db_connection is None:
+        load_dotenv()
+        with get_database_engine().connect() as pooled_connection:
+            return load(recordings, waterings, pooled_connection)
 
-def upload_waterings(data, conn: Connection, table: db.Table) -> None:
-    """Uploads watering data to the database."""
-    data_dict = data.to_dict(orient='records')
-    for watering in data_dict:
-        try:
-            query = db.insert(table).values(plant_id = watering['plant_id'], datetime = watering['datetime'])
-            conn.execute(query)
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-
-
-def load(recordings, waterings) -> None:
-    """Main function to run the whole load script."""
-    load_dotenv()
-    db_engine = get_database_engine()
-    db_connection = db_engine.connect()
-    db_metadata = db.MetaData(schema=environ['DB_SCHEMA'])
-    recording_table = db.Table(
-        "recording", db_metadata, autoload_with=db_engine)
-    watering_table = db.Table("watering", db_metadata, autoload_with=db_engine)
-    upload_recordings(recordings, db_connection, recording_table)
-    upload_waterings(waterings, db_connection, watering_table)
-    db_connection.close()
+    recording_table = tables.get_table('recording', db_connection.engine)
+    latest_recording_table = tables.get_table('latest_recording', db_connection.engine)
+    watering_table = tables.get_table('watering', db_connection.engine)
+    upload_recordings(recordings, db_connection, recording_table, latest_recording_table)
+    return upload_waterings(waterings, db_connection, watering_table)
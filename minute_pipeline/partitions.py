@@ -0,0 +1,184 @@
+"""
+Contains code to archive a table partitioned by time (see db_setup/schema_performance.sql) by
+partition switching rather than by deleting rows. Every partition holding only rows older than the
+archival cutoff is switched out into the table's switch table (a metadata-only change, whatever
+the number of rows), the switch table's rows are exported, and it's then truncated.
+
+The partition function has a boundary every PARTITION_HOURS hours. Boundaries are split
+for the next PARTITIONS_AHEAD partitions, so new rows always land in an empty partition, and the
+empty partitions left behind by archival are merged away.
+"""
+
+from datetime import datetime, timedelta
+from os import environ
+
+from dotenv import load_dotenv
+import pandas as pd
+import sqlalchemy as db
+from sqlalchemy.engine.base import Connection
+
+from database import get_database_engine
+import tables
+
+
+PARTITION_FUNCTION = 'pf_recording_time'
+PARTITION_SCHEME = 'ps_recording_time'
+PARTITION_FILEGROUP = 'PRIMARY'
+PARTITIONED_TABLES = ['recording']
+SWITCH_TABLE_SUFFIX = '_switch'
+# Hourly, like archival, so rows are still kept in the database for 24-25 (not up to 48) hours
+PARTITION_HOURS = 1
+PARTITIONS_AHEAD = 48
+
+
+def is_switch_out_enabled(table_name: str) -> bool:
+    """
+    Returns whether the table is archived by partition switching, i.e. it's partitioned and the
+    ARCHIVE_SWITCH_OUT environment variable is set.
+    """
+    return table_name in PARTITIONED_TABLES and bool(environ.get('ARCHIVE_SWITCH_OUT'))
+
+
+def get_partition_boundary(moment: datetime, hours: int = PARTITION_HOURS) -> datetime:
+    """Returns the latest partition boundary at or before the given moment."""
+    day = datetime.combine(moment.date(), datetime.min.time())
+    return day + timedelta(hours=(moment - day) // timedelta(hours=hours) * hours)
+
+
+def get_boundaries_to_split(boundaries: list[datetime], now: datetime,
+                            hours: int = PARTITION_HOURS,
+                            ahead: int = PARTITIONS_AHEAD) -> list[datetime]:
+    """
+    Returns the boundaries (ascending) missing from the next ahead partitions after now; only ones
+    after every existing boundary are returned, as splitting those never has to move rows.
+    """
+    newest = max(boundaries, default=None)
+    start = get_partition_boundary(now, hours)
+    return [boundary for boundary in (start + timedelta(hours=hours * step)
+                                      for step in range(1, ahead + 1))
+            if newest is None or boundary > newest]
+
+
+def get_boundaries_to_merge(boundaries: list[datetime], cutoff: datetime) -> list[datetime]:
+    """
+    Returns the boundaries before the cutoff (a boundary), so the empty partitions left by archival
+    are merged into the first; the cutoff boundary itself is kept, as the partition after it holds
+    rows.
+    """
+    return sorted(boundary for boundary in boundaries if boundary < cutoff)
+
+
+def get_switch_table(table_name: str) -> db.Table:
+    """Returns the switch table of a partitioned table: a table with the same columns."""
+    table = tables.get_table(table_name)
+    return table.to_metadata(db.MetaData(), name=f'{table_name}{SWITCH_TABLE_SUFFIX}')
+
+
+def get_boundaries(connection: Connection) -> list[datetime]:
+    """Returns the boundaries of the partition function, ascending."""
+    try:
+        query = db.text(
+            "SELECT CAST(prv.value AS datetime2) FROM sys.partition_range_values AS prv "
+            "JOIN sys.partition_functions AS pf ON pf.function_id = prv.function_id "
+            "WHERE pf.name = :function_name ORDER BY prv.boundary_id")
+        return list(connection.execute(query, {'function_name': PARTITION_FUNCTION}).scalars())
+
+    except Exception as e:
+        raise e
+
+
+def get_switchable_partitions(connection: Connection, table_name: str,
+                              cutoff: datetime) -> list[int]:
+    """
+    Returns the numbers of the table's partitions which hold rows, all of which are older than the
+    cutoff (so their upper boundary is at or before it).
+    """
+    try:
+        query = db.text(
+            "SELECT p.partition_number FROM sys.partitions AS p "
+            "JOIN sys.indexes AS i ON i.object_id = p.object_id AND i.index_id = p.index_id "
+            "JOIN sys.partition_schemes AS ps ON ps.data_space_id = i.data_space_id "
+            "JOIN sys.partition_range_values AS prv "
+            "ON prv.function_id = ps.function_id AND prv.boundary_id = p.partition_number "
+            "WHERE p.object_id = OBJECT_ID(:table_name) AND p.index_id IN (0, 1) "
+            "AND p.rows > 0 AND CAST(prv.value AS datetime2) <= :cutoff "
+            "ORDER BY p.partition_number")
+        return list(connection.execute(query, {
+            'table_name': f"{environ['DB_SCHEMA']}.{table_name}", 'cutoff': cutoff}).scalars())
+
+    except Exception as e:
+        raise e
+
+
+def switch_out_partitions(connection: Connection, table_name: str,
+                          partition_numbers: list[int]) -> None:
+    """
+    Switches the table's given partitions into the same partitions of its switch table (which must
+    be empty), in one transaction.
+    """
+    schema = environ['DB_SCHEMA']
+    try:
+        for partition_number in partition_numbers:
+            connection.exec_driver_sql(
+                f"ALTER TABLE {schema}.{table_name} SWITCH PARTITION {int(partition_number)} TO "
+                f"{schema}.{table_name}{SWITCH_TABLE_SUFFIX} PARTITION {int(partition_number)}")
+        connection.commit()
+    except Exception as e:
+        connection.rollback()
+        raise e
+
+
+def get_switched_out_records(connection: Connection, table_name: str) -> pd.DataFrame:
+    """Retrieves every row switched out of the table (those in its switch table)."""
+    try:
+        response = connection.execute(db.select(get_switch_table(table_name)))
+        return pd.DataFrame(response.fetchall(), columns=list(response.keys()))
+
+    except Exception as e:
+        raise e
+
+
+def truncate_switch_table(connection: Connection, table_name: str) -> None:
+    """Empties the table's switch table (deallocating its pages, rather than deleting rows)."""
+    try:
+        connection.exec_driver_sql(
+            f"TRUNCATE TABLE {environ['DB_SCHEMA']}.{table_name}{SWITCH_TABLE_SUFFIX}")
+        connection.commit()
+    except Exception as e:
+        connection.rollback()
+        raise e
+
+
+def maintain_boundaries(connection: Connection, cutoff: datetime, now: datetime = None) -> dict:
+    """
+    Merges the boundaries before the cutoff (whose partitions archival has emptied) and splits the
+    missing ones ahead of now; returns how many of each there were.
+    """
+    now = now or datetime.now()
+    boundaries = get_boundaries(connection)
+    to_merge = get_boundaries_to_merge(boundaries, get_partition_boundary(cutoff))
+    to_split = get_boundaries_to_split(boundaries, now)
+
+    try:
+        for boundary in to_merge:
+            connection.exec_driver_sql(
+                f"ALTER PARTITION FUNCTION {PARTITION_FUNCTION}() MERGE RANGE (%(boundary)s)",
+                {'boundary': boundary})
+        for boundary in to_split:
+            connection.exec_driver_sql(
+                f"ALTER PARTITION SCHEME {PARTITION_SCHEME} NEXT USED [{PARTITION_FILEGROUP}]")
+            connection.exec_driver_sql(
+                f"ALTER PARTITION FUNCTION {PARTITION_FUNCTION}() SPLIT RANGE (%(boundary)s)",
+                {'boundary': boundary})
+        connection.commit()
+    except Exception as e:
+        connection.rollback()
+        raise e
+
+    return {'merged': len(to_merge), 'split': len(to_split)}
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    with get_database_engine().connect() as db_connection:
+        print(maintain_boundaries(db_connection, datetime.now() - timedelta(hours=24)))
@@ -1,42 +1,154 @@
 """File to combine the extract and loading into RDS and S3 scripts, to run the pipeline in a lambda function."""
-import logging
+from os import environ
+
 from dotenv import load_dotenv
 
-from extract import extract
+from database import get_database_engine
+from extract import extract_within_deadline, EXTRACT_DEADLINE
 from transform import transform
 from load import load
+from metrics import METRICS, set_up_logger
+import profiling
 from rds_to_s3 import update_rds_and_s3
+import sharding
+from stage_runner import Stage, run_due_stages
+
+
+DEFAULT_WORKERS = 4
+ARCHIVE_CADENCE = 3600  # Seconds; rows are kept in the database for 24-25 hours
+ARCHIVE_BUDGET = 50  # Seconds; less than the minute between ticks
+
+
+def get_archive_stage(db_connection=None) -> Stage:
+    """
+    Returns the stage moving old data to S3 storage, run every ARCHIVE_CADENCE seconds (default
+    hourly) on the given connection (or one from the pool).
+    """
+    return Stage('archive', lambda outputs: update_rds_and_s3(db_connection),
+                 cadence=int(environ.get('ARCHIVE_CADENCE', ARCHIVE_CADENCE)),
+                 budget=int(environ.get('ARCHIVE_BUDGET', ARCHIVE_BUDGET)))
+
+
+def run_pipeline(plant_ids: list[int] = None, archive: bool = True,
+                 extract_deadline: float = EXTRACT_DEADLINE, time_left: float = None) -> dict:
+    """
+    Extracts the plant data (of the plants answering within extract_deadline seconds) and loads it
+    into the short term database, then, if it's due (and archive isn't False), moves data over
+    24hours old into S3 storage; returns the number of rows loaded, the ids of any plants skipped
+    and each stage's wall time. time_left is how many seconds the invocation has left, if known.
+    """
+    load_dotenv()
+    logger = set_up_logger()
 
+    # One pooled connection is shared by loading and archival
+    with get_database_engine().connect() as db_connection:
+        stages = [
+            Stage('extract', lambda outputs: extract_within_deadline(
+                plant_ids, deadline=extract_deadline), budget=extract_deadline),
+            Stage('transform', lambda outputs: transform(*outputs['extract'][:2])),
+            Stage('load', lambda outputs: load(*outputs['transform'], db_connection))
+        ]
+        if archive:
+            stages.append(get_archive_stage(db_connection))
 
-def set_up_logger():
-    """Set up a logger, to log pipeline progress to the console."""
-    logging.basicConfig(level=logging.INFO,
-                        format='%(asctime)s - %(levelname)s - %(message)s')
-    return logging.getLogger('logger')
+        outputs, timings = run_due_stages(stages, time_left)
 
+    transformed_recordings, _ = outputs['transform']
+    inserted_waterings, duplicate_waterings = outputs['load']
+    METRICS.increment('rows', len(transformed_recordings), stage='load', table='recording')
+    METRICS.increment('rows', inserted_waterings, stage='load', table='watering')
+    logger.info("Plant data has been loaded into the short term database "
+                "(%s new waterings, %s duplicates).", inserted_waterings, duplicate_waterings)
+    if 'archive' in outputs:
+        logger.info("Old plant data has been moved to S3 storage (%s).", outputs['archive'])
+        count_archived_rows(outputs['archive'])
 
-def run_pipeline():
-    """Extracts the plant data, loads it into the short term database and moves data over 24hours old into S3 storage."""
+    return {'plant_count': len(plant_ids) if plant_ids is not None else None,
+            'recordings': len(transformed_recordings),
+            'waterings': inserted_waterings,
+            'duplicate_waterings': duplicate_waterings,
+            'skipped_plant_ids': outputs['extract'][2],
+            'stages': timings}
+
+
+def run_coordinator(event: dict, context=None) -> dict:
+    """
+    Splits the plant ids described by the event's shard over the requested number of workers,
+    invokes a worker invocation of this function for each, archives old data (if due) once every
+    worker has loaded, and returns the per-shard row counts.
+    """
     load_dotenv()
     logger = set_up_logger()
 
-    recordings, waterings = extract()
-    logger.info("All plant data has been extracted from the API.")
+    plant_ids = sharding.get_shard_plant_ids(event.get('shard'))
+    shards = sharding.split_plant_ids(plant_ids, event.get('workers', DEFAULT_WORKERS))
+
+    function_name = environ.get('WORKER_FUNCTION_NAME') or getattr(context, 'function_name', None)
+    if not function_name:
+        raise ValueError("Coordinator mode needs WORKER_FUNCTION_NAME outside of Lambda.")
+    shard_results = sharding.invoke_shard_workers(
+        sharding.create_lambda_client(), function_name, shards, event.get('extract_deadline'))
+
+    for shard_result in shard_results:
+        if 'error' in shard_result:
+            logger.error("Shard failed: %s", shard_result['error'])
+    logger.info("%s shards have been loaded into the short term database.", len(shards))
+
+    timings = {}
+    if event.get('archive', True):
+        outputs, timings = run_due_stages([get_archive_stage()], get_time_left(context))
+        if 'archive' in outputs:
+            logger.info("Old plant data has been moved to S3 storage (%s).", outputs['archive'])
+            count_archived_rows(outputs['archive'])
+
+    return {'plant_count': len(plant_ids),
+            'shards': shard_results,
+            'recordings': sum(result.get('recordings', 0) for result in shard_results),
+            'waterings': sum(result.get('waterings', 0) for result in shard_results),
+            'duplicate_waterings': sum(result.get('duplicate_waterings', 0)
+                                       for result in shard_results),
+            'skipped_plant_ids': sorted(plant_id for result in shard_results
+                                        for plant_id in result.get('skipped_plant_ids', [])),
+            'stages': timings}
+
+
+def count_archived_rows(archived: dict) -> None:
+    """Adds the rows of each table archived to the invocation's metrics."""
+    for table_name, rows in archived.items():
+        METRICS.increment('rows', rows, stage='archive', table=table_name)
+
 
-    transformed_recordings, transformed_waterings = transform(
-        recordings, waterings)
-    logger.info("All plant data has been transformed.")
+def get_time_left(context=None) -> float:
+    """Returns how many seconds the Lambda invocation has left, or None if not run in Lambda."""
+    if context is None:
+        return None
+    return context.get_remaining_time_in_millis() / 1000
 
-    load(transformed_recordings, transformed_waterings)
-    logger.info("Plant data has been loaded into the short term database.")
 
-    update_rds_and_s3()
-    logger.info("Old plant data has been moved to S3 storage.")
+@profiling.profiled('minute_pipeline')
+def handler(event=None, context=None) -> dict:
+    """
+    Function to run the whole pipeline script as a Lambda function. The event may hold a "shard"
+    (see sharding.get_shard_plant_ids) restricting which plants are fetched, and "archive": false
+    to skip moving old data to S3; with "mode": "coordinator" the run is instead fanned out over
+    "workers" concurrent invocations. "extract_deadline" overrides how many seconds extraction may
+    take before the plants yet to answer are skipped. Archival only runs when due (see
+    stage_runner). The invocation's metrics (see metrics) are printed as JSON lines at the end.
+    """
+    event = event or {}
+    mode = event.get('mode', 'worker')
 
+    try:
+        if mode == 'coordinator':
+            return run_coordinator(event, context)
 
-def handler(event=None, context=None) -> None:
-    """Function to run the whole pipeline script as a Lambda function."""
-    run_pipeline()
+        return run_pipeline(sharding.get_shard_plant_ids(event.get('shard')),
+                            archive=event.get('archive', True),
+                            extract_deadline=event.get('extract_deadline', EXTRACT_DEADLINE),
+                            time_left=get_time_left(context))
+    finally:
+        METRICS.emit(pipeline='minute_pipeline', mode=mode,
+                     request_id=getattr(context, 'aws_request_id', None))
 
 
 if __name__ == "__main__":
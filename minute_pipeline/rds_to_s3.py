@@ -1,43 +1,65 @@
 """
-Contains code to retrieve watering/recording data older than 24hrs from the database, append it to
-the relevant files in s3 (automatically creates if none exist), and delete from the db.
+Contains code to retrieve watering/recording data older than 24hrs from the database, write it to
+s3 as new append-only part files (compacted later by the daily pipeline), and delete from the db in
+small batches by id (or, for tables partitioned by time, by switching out whole partitions; see
+partitions.py), recording progress in s3 so an interrupted run can be resumed.
 """
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import json
 from os import environ
 import pandas as pd
 
 from boto3 import client
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 import sqlalchemy as db
 from sqlalchemy.engine.base import Connection
 
+import archive_files
+from database import get_database_engine
+import manifest
+import metrics
+import partitions
+import tables
+
 
 load_dotenv()
 
+DELETE_BATCH_SIZE = 1000  # Ids per delete; well under the 5,000 locks at which MSSQL escalates
+ARCHIVE_STATE_PREFIX = 'archive_state'
 
 
-def get_database_engine():
-    """Returns the database engine."""
+def get_archive_id_range(table_name: str, db_engine: db.Engine, connection: Connection,
+                         datetime_cutoff: datetime) -> tuple[int, int]:
+    """
+    Returns the lowest and highest ids of the records older than the cutoff in the db table with
+    given name (watering/recording), or None if there are none.
+    """
     try:
-        engine = db.create_engine(
-            f"mssql+pymssql://{environ['DB_USER']}:{environ['DB_PASSWORD']}@{environ['DB_HOST']}:{environ['DB_PORT']}/{environ['DB_NAME']}?charset=utf8"
-        )
-        return engine
+        table = tables.get_table(table_name, db_engine)
+        query = db.select(db.func.min(table.columns.id), db.func.max(table.columns.id)).where(
+            table.columns.datetime < datetime_cutoff)
+        min_id, max_id = connection.execute(query).one()
+        if min_id is None:
+            return None
+        return min_id, max_id
+
     except Exception as e:
-        print(f"Error creating database engine: {e}")
         raise e
 
 
-def get_old_records(table_name: str, db_engine: db.Engine, connection: Connection, metadata,
-                    datetime_cutoff: datetime):
+def get_old_records(table_name: str, db_engine: db.Engine, connection: Connection,
+                    datetime_cutoff: datetime, min_id: int, max_id: int):
     """
-    Retrieves records older than 24 hours (by attribute 'datetime') from db table with given name
-    (watering/recording).
+    Retrieves the records older than the cutoff (by attribute 'datetime') with ids in the given
+    (inclusive) range from db table with given name (watering/recording). Rows are never updated,
+    and later inserts get higher ids, so these are exactly the rows the batched delete removes.
     """
     try:
-        table = db.Table(table_name, metadata, autoload_with=db_engine)
-        query = db.select(table).where(table.columns.datetime < datetime_cutoff)
+        table = tables.get_table(table_name, db_engine)
+        query = db.select(table).where(table.columns.id.between(min_id, max_id),
+                                       table.columns.datetime < datetime_cutoff)
         response = connection.execute(query)
         results = response.fetchall()
         return pd.DataFrame(results)
@@ -46,87 +68,210 @@ def get_old_records(table_name: str, db_engine: db.Engine, connection: Connectio
         raise e
 
 
-def get_day_bucket_keys(s3_client: client, folder_path: str, day: int,
-                    bucket_name: str = environ['BUCKET_NAME']) -> list:
+def get_part_key(data_type: str, day: date, run_time: datetime, archive_format: str = 'csv') -> str:
     """
-    Returns list of keys within a given s3 bucket ending in '_{yesterday}.csv, with a prefix matching
-    the given folder_path.
+    Returns the key of a new part file of data_type for the given day; every archival run writes its
+    own immutable part, named after the time of the run.
     """
-    objects = s3_client.list_objects(Bucket=bucket_name, Prefix=folder_path).get('Contents')
-    if objects:
-        return [obj['Key'] for obj in objects if f'{day}.csv' in obj['Key']]
-    return []
+    return (f'{day.year}/{day.month}/{data_type}_{day.day}/'
+            f'{run_time:%Y%m%d%H%M%S%f}.{archive_format}')
 
 
-def get_current_csv_data(data_type: str, s3_client: client, date: datetime, bucket_name:
-                         str = environ['BUCKET_NAME']) -> pd.DataFrame:
+def upload_parts_to_s3(data_type: str, df: pd.DataFrame, s3_client, run_time: datetime,
+                       bucket_name: str = environ['BUCKET_NAME'],
+                       archive_format: str = None) -> dict:
     """
-    Downloads relevant files of specified data_type (watering/recording) from S3 to local, and
-    then returns it as a pandas dataframe.
+    Uploads pandas dataframe of data_type to s3 as new part files (sorted by plant and time), one
+    for each day the data covers, in the given format (by default ARCHIVE_FORMAT); returns the
+    manifest entries of the files written, by key. Each csv file's plant offsets are saved in its
+    index object (see archive_files).
     """
+    if df.empty:
+        return {}
 
-    folder_path = f'{date.year}/{date.month}'
-    keys = get_day_bucket_keys(s3_client, folder_path, date.day)
-    type_keys = [key for key in keys if data_type in key]
-    if type_keys:
-        type_key = type_keys[0]
-        response = s3_client.get_object(Bucket=bucket_name, Key = type_key)
-        try:
-            return pd.read_csv(response.get("Body"))
-        except pd.errors.EmptyDataError:
-            # Prevents code crashing if a csv exists in s3 but is empty
-            pass
-
-    return pd.DataFrame()
+    archive_format = archive_format or archive_files.get_archive_format()
+    df = df.sort_values(['plant_id', 'datetime'])
+    entries = {}
+    for day, day_df in df.groupby(df['datetime'].dt.date):
+        key = get_part_key(data_type, day, run_time, archive_format)
+        plant_offsets = {}
+        if archive_format == 'csv':
+            file_body = archive_files.get_indexed_csv_body(day_df, plant_offsets)
+        else:
+            file_body = archive_files.get_file_body(day_df, archive_format)
+        response = s3_client.put_object(Body = file_body, Bucket = bucket_name, Key = key,
+                                        Metadata = archive_files.SORTED_METADATA)
+        indexed = archive_files.save_plant_offsets(s3_client, bucket_name, key, response['ETag'],
+                                                   plant_offsets)
+        entries[key] = manifest.get_file_entry(key, len(day_df), len(file_body), response['ETag'],
+                                               day_df['datetime'].min(), day_df['datetime'].max(),
+                                               indexed)
+    return entries
 
 
-def upload_to_s3(data_type: str, df: pd.DataFrame, s3_client,
-                 date: datetime, bucket_name: str = environ['BUCKET_NAME']):
-    """Uploads pandas dataframe of data_type to appropriate csv in s3 bucket."""
-    s3_client.put_object(Body = df.to_csv(index=False), Bucket = bucket_name,
-                         Key = f'{date.year}/{date.month}/{data_type}_{date.day}.csv')
-
-
-
-def delete_oldest_records(table_name: str, db_engine: db.Engine, connection: Connection, metadata,
-                          datetime_cutoff: datetime):
+def delete_old_records_batch(table_name: str, db_engine: db.Engine, connection: Connection,
+                             datetime_cutoff: datetime, start_id: int, stop_id: int) -> int:
     """
-    Deletes records older than 24 hours (by attribute 'datetime') from db table with given name
-    (watering/recording).
+    Deletes the records older than the cutoff with ids from start_id up to (not including) stop_id
+    from db table with given name (watering/recording), in its own transaction; returns how many
+    were deleted. Keeping each delete to a short seek on the primary key means it only locks the
+    rows it removes, rather than escalating to a table lock which would block loading.
     """
     try:
-        table = db.Table(table_name, metadata, autoload=True,
-                         autoload_with=db_engine)
-        query = db.delete(table).where(table.columns.datetime < datetime_cutoff)
-        connection.execute(query)
+        table = tables.get_table(table_name, db_engine)
+        query = db.delete(table).where(table.columns.id >= start_id,
+                                       table.columns.id < stop_id,
+                                       table.columns.datetime < datetime_cutoff)
+        deleted = connection.execute(query).rowcount
         connection.commit()
+        return deleted
     except Exception as e:
         raise e
 
 
-def update_rds_and_s3():
+def get_archive_state_key(data_type: str) -> str:
+    """Returns the key of the object recording the progress of archiving data_type."""
+    return f'{ARCHIVE_STATE_PREFIX}/{data_type}.json'
+
+
+def load_archive_state(s3_client, data_type: str, bucket_name: str) -> dict:
+    """Returns the progress of an unfinished archival of data_type, or None if there isn't one."""
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=get_archive_state_key(data_type))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise e
+    return json.loads(response['Body'].read())
+
+
+def save_archive_state(s3_client, data_type: str, state: dict, bucket_name: str):
+    """Records the progress of archiving data_type, so a run cut short can be resumed."""
+    s3_client.put_object(Body=json.dumps(state), Bucket=bucket_name,
+                         Key=get_archive_state_key(data_type))
+
+
+def archive_old_records(data_type: str, connection: Connection, s3_client,
+                        datetime_cutoff: datetime, run_time: datetime,
+                        batch_size: int = DELETE_BATCH_SIZE,
+                        bucket_name: str = environ['BUCKET_NAME']) -> int:
     """
-    Gets any records from watering and recording tables in df older than 24hours, combines with
-    the csv files in s3 bucket for current day (if any exist), and saves the result as csvs in the
-    bucket with a name ending in _{yesterday}.csv.
+    Moves the records of data_type older than the cutoff from the db to s3: the range of their ids
+    is selected once, exactly those rows are exported as part files, and they're then deleted in
+    batches of at most batch_size ids. Progress is saved to s3 after every step, so if a run is
+    cut short the next one finishes the same range (with the same cutoff and part keys) before
+    starting another. Returns how many rows were deleted.
     """
-    literal_day_ago = (datetime.now() - timedelta(hours = 24))
+    db_engine = connection.engine
+    state = load_archive_state(s3_client, data_type, bucket_name)
 
-    db_engine = get_database_engine()
-    db_connection = db_engine.connect()
-    db_metadata = db.MetaData(schema=environ['DB_SCHEMA'])
+    if state is None:
+        id_range = get_archive_id_range(data_type, db_engine, connection, datetime_cutoff)
+        if id_range is None:
+            return 0
+        state = {'min_id': id_range[0], 'max_id': id_range[1], 'next_id': id_range[0],
+                 'cutoff': datetime_cutoff.isoformat(), 'run_time': run_time.isoformat(),
+                 'exported': False}
+        save_archive_state(s3_client, data_type, state, bucket_name)
 
-    s3_client = client("s3",
-                       aws_access_key_id=environ['AWS_ACCESS_KEY_ID_'],
-                       aws_secret_access_key=environ['AWS_SECRET_ACCESS_KEY_'])
+    datetime_cutoff = datetime.fromisoformat(state['cutoff'])
 
-    for data_type in ['recording', 'watering']:
-        df = get_old_records(data_type, db_engine, db_connection, db_metadata, literal_day_ago)
-        df = pd.concat([get_current_csv_data(data_type, s3_client, literal_day_ago), df])
-        upload_to_s3(data_type, df, s3_client, literal_day_ago)
-        delete_oldest_records(data_type, db_engine, db_connection, db_metadata, literal_day_ago)
+    if not state['exported']:
+        df = get_old_records(data_type, db_engine, connection, datetime_cutoff,
+                             state['min_id'], state['max_id'])
+        # Parts are named after the run which selected the range, so a re-export overwrites them
+        entries = upload_parts_to_s3(data_type, df, s3_client,
+                                     datetime.fromisoformat(state['run_time']), bucket_name)
+        manifest.update_manifest(s3_client, bucket_name, added=entries)
+        state['exported'] = True
+        save_archive_state(s3_client, data_type, state, bucket_name)
+
+    deleted = 0
+    for start_id in range(state['next_id'], state['max_id'] + 1, batch_size):
+        stop_id = min(start_id + batch_size, state['max_id'] + 1)
+        deleted += delete_old_records_batch(data_type, db_engine, connection, datetime_cutoff,
+                                            start_id, stop_id)
+        state['next_id'] = stop_id
+        if stop_id <= state['max_id']:
+            save_archive_state(s3_client, data_type, state, bucket_name)
 
-    db_connection.close()
+    s3_client.delete_object(Bucket=bucket_name, Key=get_archive_state_key(data_type))
+    return deleted
+
+
+def archive_switched_out_records(data_type: str, connection: Connection, s3_client,
+                                 datetime_cutoff: datetime, run_time: datetime,
+                                 bucket_name: str = environ['BUCKET_NAME']) -> int:
+    """
+    Moves the records of data_type from partitions wholly older than the cutoff to s3, for a table
+    partitioned by time: the partitions are switched out into its switch table (metadata-only),
+    whose rows are exported as part files before it's truncated, and the partition boundaries are
+    then maintained. As with archive_old_records, progress is saved to s3, so a run cut short is
+    finished (with the same cutoff and part keys) by the next; one left unfinished by
+    archive_old_records is finished by that instead. Returns how many rows were archived.
+    """
+    state = load_archive_state(s3_client, data_type, bucket_name)
+    if state is not None and 'min_id' in state:
+        return archive_old_records(data_type, connection, s3_client, datetime_cutoff, run_time,
+                                   bucket_name=bucket_name)
+
+    if state is None:
+        state = {'cutoff': partitions.get_partition_boundary(datetime_cutoff).isoformat(),
+                 'run_time': run_time.isoformat(), 'exported': False, 'rows': 0}
+        save_archive_state(s3_client, data_type, state, bucket_name)
+
+    datetime_cutoff = datetime.fromisoformat(state['cutoff'])
+
+    if not state['exported']:
+        partition_numbers = partitions.get_switchable_partitions(connection, data_type,
+                                                                 datetime_cutoff)
+        partitions.switch_out_partitions(connection, data_type, partition_numbers)
+        df = partitions.get_switched_out_records(connection, data_type)
+        entries = upload_parts_to_s3(data_type, df, s3_client,
+                                     datetime.fromisoformat(state['run_time']), bucket_name)
+        manifest.update_manifest(s3_client, bucket_name, added=entries)
+        state['exported'] = True
+        state['rows'] = len(df)
+        save_archive_state(s3_client, data_type, state, bucket_name)
+
+    partitions.truncate_switch_table(connection, data_type)
+    partitions.maintain_boundaries(connection, datetime_cutoff, run_time)
+
+    s3_client.delete_object(Bucket=bucket_name, Key=get_archive_state_key(data_type))
+    return state['rows']
+
+
+def update_rds_and_s3(db_connection: Connection = None, batch_size: int = None) -> dict:
+    """
+    Moves any records from watering and recording tables older than 24hours to new part files
+    (csv or parquet, see archive_files) in the s3 bucket (under {year}/{month}/{data_type}_{day}/),
+    deleting them from the db in batches of batch_size ids (by default ARCHIVE_DELETE_BATCH_SIZE),
+    or switching out their partitions if the table is archived that way (see
+    partitions.is_switch_out_enabled). Runs on the given connection, or one from the shared engine's
+    pool; returns how many rows of each type were archived.
+    """
+    if db_connection is None:
+        with get_database_engine().connect() as pooled_connection:
+            return update_rds_and_s3(pooled_connection, batch_size)
+
+    run_time = datetime.now()
+    literal_day_ago = (run_time - timedelta(hours = 24))
+    batch_size = batch_size or int(environ.get('ARCHIVE_DELETE_BATCH_SIZE', DELETE_BATCH_SIZE))
+
+    s3_client = metrics.instrument_s3_client(
+        client("s3",
+               aws_access_key_id=environ['AWS_ACCESS_KEY_ID_'],
+               aws_secret_access_key=environ['AWS_SECRET_ACCESS_KEY_']))
+
+    archived = {}
+    for data_type in ['recording', 'watering']:
+        if partitions.is_switch_out_enabled(data_type):
+            archived[data_type] = archive_switched_out_records(data_type, db_connection, s3_client,
+                                                               literal_day_ago, run_time)
+        else:
+            archived[data_type] = archive_old_records(data_type, db_connection, s3_client,
+                                                      literal_day_ago, run_time, batch_size)
+    return archived
 
 
 if __name__ == "__main__":
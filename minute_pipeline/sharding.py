@@ -0,0 +1,120 @@
+"""
+Contains code to work out which plant IDs a minute pipeline invocation is responsible for, and to
+fan a minute run out over several concurrent invocations of the pipeline Lambda function.
+"""
+
+import concurrent.futures
+import json
+from os import environ
+
+from boto3 import client
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+import sqlalchemy as db
+
+from database import get_database_engine
+from extract import NO_OF_PLANTS
+import tables
+
+
+WORKER_WAIT_TIMEOUT = 50  # Seconds; under the minute between scheduled runs, so they don't overlap
+
+
+def get_db_plant_ids() -> list[int]:
+    """Retrieves all plant ids from the plant table in the db, in ascending order."""
+    db_engine = get_database_engine()
+    with db_engine.connect() as db_connection:
+        plant_table = tables.get_table('plant', db_engine)
+        query = db.select(plant_table.c.id).order_by(plant_table.c.id)
+        return list(db_connection.execute(query).scalars())
+
+
+def get_shard_plant_ids(shard: dict = None) -> list[int]:
+    """
+    Returns the plant ids described by a shard from the event payload. Supported shard types:
+    - {"type": "range", "start": 0, "stop": 51}
+    - {"type": "modulo", "index": 0, "count": 4} (every count-th plant id, from offset index)
+    - {"type": "list", "plant_ids": [0, 1, 2]}
+    - {"type": "discover"} (every plant id in the plant table)
+    Range and modulo shards cover range(NO_OF_PLANTS) unless given a "stop", and modulo shards can
+    instead split the plant table with "source": "plant_table". No shard means every plant.
+    """
+    if not shard:
+        return list(range(NO_OF_PLANTS))
+
+    shard_type = shard.get('type')
+
+    if shard_type == 'range':
+        return list(range(shard.get('start', 0), shard.get('stop', NO_OF_PLANTS)))
+
+    if shard_type == 'modulo':
+        if shard.get('source') == 'plant_table':
+            plant_ids = get_db_plant_ids()
+        else:
+            plant_ids = range(shard.get('stop', NO_OF_PLANTS))
+        return [plant_id for plant_id in plant_ids
+                if plant_id % shard['count'] == shard['index']]
+
+    if shard_type == 'list':
+        return [int(plant_id) for plant_id in shard['plant_ids']]
+
+    if shard_type == 'discover':
+        return get_db_plant_ids()
+
+    raise ValueError(f"Unknown shard type: {shard_type}")
+
+
+def split_plant_ids(plant_ids: list[int], workers: int) -> list[list[int]]:
+    """Splits plant ids round-robin into (at most) the given number of non-empty shards."""
+    shards = [plant_ids[i::workers] for i in range(workers)]
+    return [shard for shard in shards if shard]
+
+
+def create_lambda_client():
+    """
+    Creates a client that connects to lambda on AWS, which waits for a worker for at most
+    WORKER_WAIT_TIMEOUT seconds, so a coordinator never runs into the next minute's, and never
+    retries an invocation: a retried worker would load its plants' recordings twice, as they have
+    no unique key. A worker not answering in time carries on, and is reported as an error.
+    """
+    return client("lambda",
+                  aws_access_key_id=environ['AWS_ACCESS_KEY_ID_'],
+                  aws_secret_access_key=environ['AWS_SECRET_ACCESS_KEY_'],
+                  config=Config(read_timeout=int(environ.get('WORKER_WAIT_TIMEOUT',
+                                                             WORKER_WAIT_TIMEOUT)),
+                                retries={'total_max_attempts': 1}))
+
+
+def invoke_shard_worker(lambda_client, function_name: str, plant_ids: list[int],
+                        extract_deadline: float = None) -> dict:
+    """
+    Synchronously invokes the pipeline function as a worker for the given plant ids, and returns
+    its response (the row counts it loaded, or the error it raised).
+    """
+    event = {'shard': {'type': 'list', 'plant_ids': plant_ids}, 'archive': False}
+    if extract_deadline is not None:
+        event['extract_deadline'] = extract_deadline
+
+    try:
+        response = lambda_client.invoke(
+            FunctionName=function_name,
+            InvocationType='RequestResponse',
+            Payload=json.dumps(event))
+    except (BotoCoreError, ClientError) as e:
+        return {'plant_count': len(plant_ids), 'error': str(e)}
+
+    payload = json.loads(response['Payload'].read() or 'null')
+
+    if response.get('FunctionError'):
+        return {'plant_count': len(plant_ids), 'error': payload}
+    return payload
+
+
+def invoke_shard_workers(lambda_client, function_name: str, shards: list[list[int]],
+                         extract_deadline: float = None) -> list[dict]:
+    """Invokes one worker per shard concurrently and returns each of their responses, in order."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards) or 1) as executor:
+        return list(executor.map(
+            lambda plant_ids: invoke_shard_worker(lambda_client, function_name, plant_ids,
+                                                  extract_deadline),
+            shards))
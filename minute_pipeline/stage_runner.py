@@ -0,0 +1,210 @@
+"""
+Contains a small runner for the stages of a pipeline tick. Each stage declares how often it needs
+running (its cadence, in seconds) and how long it may take (its budget, in seconds); each tick, the
+runner skips the stages which aren't yet due, using the time each last ran (kept in s3, so it
+persists between invocations), and times every stage it runs.
+
+A stage with a cadence is only run under a lease, taken with a conditional write to s3 before it
+starts and given up once its run has been recorded; a tick starting while an earlier one is still
+running the stage skips it, rather than running it a second time alongside.
+"""
+
+from datetime import datetime, timedelta
+import json
+import logging
+from os import environ
+import time
+
+from boto3 import client
+from botocore.exceptions import ClientError
+
+import metrics
+
+
+CADENCE_SLACK = 5  # Seconds; absorbs jitter in when each scheduled tick starts
+STAGE_STATE_KEY = 'stage_state/minute_pipeline.json'
+LEASE_PREFIX = 'stage_state/leases'
+DEFAULT_LEASE_SECONDS = 540  # The pipeline function's timeout, for runs without a known time left
+CONDITION_FAILED_CODES = ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409')
+
+logger = logging.getLogger('logger')
+
+
+class Stage():
+    """
+    A named step of a tick. Its run function is passed the outputs of the stages run before it (by
+    name), and returns its own output. A stage without a cadence runs on every tick.
+    """
+
+    def __init__(self, name: str, run, cadence: float = 0, budget: float = None) -> None:
+        """Creates a stage running the given function, at most every cadence seconds."""
+        self.name = name
+        self.run = run
+        self.cadence = cadence
+        self.budget = budget
+
+    def is_due(self, last_run: datetime, now: datetime) -> bool:
+        """Returns whether the stage should run now, given when it last ran (or None if never)."""
+        if not self.cadence or last_run is None:
+            return True
+        return (now - last_run).total_seconds() >= self.cadence - CADENCE_SLACK
+
+
+def create_s3_client():
+    """Creates a client that connects to s3 on AWS."""
+    return metrics.instrument_s3_client(
+        client("s3",
+               aws_access_key_id=environ['AWS_ACCESS_KEY_ID_'],
+               aws_secret_access_key=environ['AWS_SECRET_ACCESS_KEY_']))
+
+
+def load_stage_state(s3_client, bucket_name: str) -> dict:
+    """Returns the time (as an ISO string) each stage with a cadence last ran, by stage name."""
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=STAGE_STATE_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return {}
+        raise e
+    return json.loads(response['Body'].read())
+
+
+def save_stage_state(s3_client, state: dict, bucket_name: str):
+    """Saves the time each stage with a cadence last ran."""
+    s3_client.put_object(Body=json.dumps(state), Bucket=bucket_name, Key=STAGE_STATE_KEY)
+
+
+class StageLeases():
+    """
+    The leases of the stages with a cadence, kept in s3 at LEASE_PREFIX/{stage name}.json. A lease
+    is taken with a conditional put (so only one of two runs racing for it gets it) and lasts until
+    the run holding it ends, at the latest; it's given up with a conditional delete, so a lease
+    taken over after expiring is never given up by its previous holder.
+    """
+
+    def __init__(self, s3_client, bucket_name: str, seconds: float = DEFAULT_LEASE_SECONDS) -> None:
+        """Creates an object taking leases lasting the given number of seconds in the bucket."""
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.seconds = seconds
+        self.held = {}
+
+    def get_key(self, stage_name: str) -> str:
+        """Returns the key of the stage's lease."""
+        return f'{LEASE_PREFIX}/{stage_name}.json'
+
+    def acquire(self, stage_name: str, now: datetime) -> bool:
+        """Takes the stage's lease, returning False if another run holds a live one."""
+        key = self.get_key(stage_name)
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise e
+            condition = {'IfNoneMatch': '*'}
+        else:
+            lease = json.loads(response['Body'].read())
+            if datetime.fromisoformat(lease['expires']) > now:
+                return False
+            condition = {'IfMatch': response['ETag']}
+
+        lease = {'expires': (now + timedelta(seconds=self.seconds)).isoformat()}
+        try:
+            response = self.s3_client.put_object(Body=json.dumps(lease), Bucket=self.bucket_name,
+                                                 Key=key, **condition)
+        except ClientError as e:
+            if e.response['Error']['Code'] in CONDITION_FAILED_CODES:
+                return False
+            raise e
+        self.held[stage_name] = response['ETag']
+        return True
+
+    def release_all(self) -> None:
+        """Gives up every lease held, unless it has since been taken over."""
+        for stage_name, etag in self.held.items():
+            try:
+                self.s3_client.delete_object(Bucket=self.bucket_name,
+                                             Key=self.get_key(stage_name), IfMatch=etag)
+            except ClientError as e:
+                if e.response['Error']['Code'] not in CONDITION_FAILED_CODES:
+                    raise e
+        self.held = {}
+
+
+def run_stages(stages: list[Stage], state: dict, now: datetime = None,
+               time_left: float = None, leases: StageLeases = None) -> tuple[dict, dict]:
+    """
+    Runs each stage that's due, in order, recording in state when each stage with a cadence ran.
+    A due stage with a cadence whose budget is more than the time left (in seconds, if given) is
+    put off, staying due for the next tick; given leases, one whose lease another run holds is
+    skipped. Returns the outputs of the stages run, and whether each stage ran and how long it
+    took, by stage name.
+    """
+    now = now or datetime.now()
+    start = time.perf_counter()
+    outputs = {}
+    timings = {}
+
+    for stage in stages:
+        last_run = state.get(stage.name)
+        if not stage.is_due(last_run and datetime.fromisoformat(last_run), now):
+            timings[stage.name] = {'ran': False, 'reason': 'not due'}
+            continue
+
+        if (stage.cadence and stage.budget is not None and time_left is not None
+                and stage.budget > time_left - (time.perf_counter() - start)):
+            logger.warning("Stage %s put off, as its budget is more than the time left.",
+                           stage.name)
+            timings[stage.name] = {'ran': False, 'reason': 'over budget'}
+            metrics.METRICS.increment('stages_put_off', stage=stage.name)
+            continue
+
+        if stage.cadence and leases is not None and not leases.acquire(stage.name, now):
+            logger.info("Stage %s skipped, as another run holds its lease.", stage.name)
+            timings[stage.name] = {'ran': False, 'reason': 'leased'}
+            continue
+
+        stage_start = time.perf_counter()
+        outputs[stage.name] = stage.run(outputs)
+        seconds = time.perf_counter() - stage_start
+        metrics.METRICS.observe('stage_seconds', seconds, stage=stage.name)
+
+        logger.info("Stage %s took %.3f seconds.", stage.name, seconds)
+        if stage.budget is not None and seconds > stage.budget:
+            logger.warning("Stage %s took longer than its %s second budget.",
+                           stage.name, stage.budget)
+        timings[stage.name] = {'ran': True, 'seconds': round(seconds, 3)}
+
+        if stage.cadence:
+            state[stage.name] = now.isoformat()
+
+    return outputs, timings
+
+
+def run_due_stages(stages: list[Stage], time_left: float = None, s3_client=None,
+                   bucket_name: str = None) -> tuple[dict, dict]:
+    """
+    Runs the stages that are due (see run_stages). If any stage has a cadence, the time each last
+    ran is loaded from and saved back to the bucket (by default BUCKET_NAME), and those stages are
+    run under leases (see StageLeases), given up only once their run has been saved.
+    """
+    if not any(stage.cadence for stage in stages):
+        return run_stages(stages, {}, time_left=time_left)
+
+    s3_client = s3_client or create_s3_client()
+    bucket_name = bucket_name or environ['BUCKET_NAME']
+
+    state = load_stage_state(s3_client, bucket_name)
+    last_state = dict(state)
+    # A lease lasts as long as this invocation can, so it can't outlive its holder for long
+    leases = StageLeases(s3_client, bucket_name,
+                         time_left if time_left is not None else DEFAULT_LEASE_SECONDS)
+    try:
+        return run_stages(stages, state, time_left=time_left, leases=leases)
+    finally:
+        # Stages that finished before any failure still count as run
+        try:
+            if state != last_state:
+                save_stage_state(s3_client, state, bucket_name)
+        finally:
+            leases.release_all()
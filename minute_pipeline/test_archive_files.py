@@ -0,0 +1,206 @@
+"""Unit tests for archive_files.py"""
+from io import BytesIO
+import json
+from unittest.mock import MagicMock
+
+from botocore.exceptions import ClientError
+import pandas as pd
+import pytest
+
+from archive_files import (get_archive_format, get_file_body, get_indexed_csv_body,
+                           read_archive_file, filter_df, S3RangeFile, get_index_key,
+                           save_plant_offsets, load_plant_offsets)
+
+
+@pytest.fixture
+def recordings():
+    """Returns a few recordings of two plants, out of order, with times as text."""
+    return pd.DataFrame({'id': [3, 1, 2],
+                         'plant_id': [2, 1, 1],
+                         'soil_moisture': [30.5, 10.5, 20.5],
+                         'temperature': [13.0, 11.0, 12.0],
+                         'datetime': ['2023-12-10 00:03:00', '2023-12-10 00:01:00',
+                                      '2023-12-10 00:02:00']})
+
+
+def get_s3_client_mock(body: bytes, etag: str = '"etag"', plant_offsets: dict = None) -> MagicMock:
+    """
+    Returns a mock s3 client serving the given body, honouring byte ranges and IfMatch, and the
+    index object of its plant_offsets, if given.
+    """
+    s3_client_mock = MagicMock()
+
+    def get_object(Bucket, Key, Range=None, IfMatch=None):
+        if Key.endswith('.index.json'):
+            if plant_offsets is None:
+                raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+            return {'Body': BytesIO(json.dumps({'etag': etag,
+                                                'plant_offsets': plant_offsets}).encode())}
+        if IfMatch is not None and IfMatch != etag:
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'GetObject')
+        data = body
+        if Range:
+            start, end = Range.removeprefix('bytes=').split('-')
+            data = body[int(start):int(end) + 1]
+        return {'Body': BytesIO(data)}
+
+    s3_client_mock.get_object.side_effect = get_object
+    s3_client_mock.head_object.return_value = {'ContentLength': len(body)}
+    return s3_client_mock
+
+
+def test_get_archive_format_default_and_invalid(monkeypatch):
+    """Test files are csv unless ARCHIVE_FORMAT says otherwise, and unknown formats are refused."""
+    monkeypatch.delenv('ARCHIVE_FORMAT', raising=False)
+    assert get_archive_format() == 'csv'
+
+    monkeypatch.setenv('ARCHIVE_FORMAT', 'Parquet')
+    assert get_archive_format() == 'parquet'
+
+    monkeypatch.setenv('ARCHIVE_FORMAT', 'xlsx')
+    with pytest.raises(ValueError):
+        get_archive_format()
+
+
+def test_parquet_file_typed_and_sorted(recordings):
+    """Test parquet files are read back with typed columns, in plant and time order."""
+    s3_client_mock = get_s3_client_mock(get_file_body(recordings, 'parquet'))
+
+    result = read_archive_file(s3_client_mock, '2023/12/recording.parquet', 'test')
+
+    assert list(result['id']) == [1, 2, 3]
+    assert pd.api.types.is_datetime64_dtype(result['datetime'])
+    assert result['soil_moisture'].dtype == 'float64'
+
+
+@pytest.mark.parametrize('ranged', [False, True])
+def test_parquet_file_projection_and_filters(recordings, ranged):
+    """Test only the columns and rows asked for are read, whether or not reads are ranged."""
+    s3_client_mock = get_s3_client_mock(get_file_body(recordings, 'parquet'))
+
+    result = read_archive_file(s3_client_mock, '2023/12/recording.parquet', 'test',
+                               columns=['soil_moisture', 'datetime'],
+                               filters=[('plant_id', '=', 1),
+                                        ('datetime', '>=', pd.Timestamp('2023-12-10 00:02'))],
+                               ranged=ranged)
+
+    assert list(result.columns) == ['soil_moisture', 'datetime']
+    assert list(result['soil_moisture']) == [20.5]
+
+
+def test_csv_file_projection_and_filters(recordings):
+    """Test csv files are projected and filtered the same way as parquet files."""
+    s3_client_mock = get_s3_client_mock(get_file_body(recordings, 'csv').encode())
+
+    result = read_archive_file(s3_client_mock, '2023/12/recording.csv', 'test',
+                               columns=['soil_moisture', 'datetime'],
+                               filters=[('plant_id', '=', 1),
+                                        ('datetime', '>=', pd.Timestamp('2023-12-10 00:02'))])
+
+    assert list(result.columns) == ['soil_moisture', 'datetime']
+    assert list(result['soil_moisture']) == [20.5]
+
+
+def test_csv_file_other_datetime_formats():
+    """Test csv files with datetimes not in the pipelines' format are still read, and typed."""
+    body = (b'plant_id,temperature,datetime\n'
+            b'1,11,2023-12-10 00:01:00.500\n'
+            b'2,12,2023-12-10T00:02:00\n')
+
+    result = read_archive_file(get_s3_client_mock(body), '2023/12/recording_10.csv', 'test')
+
+    assert list(result['datetime']) == [pd.Timestamp('2023-12-10 00:01:00.5'),
+                                        pd.Timestamp('2023-12-10 00:02:00')]
+    assert result['temperature'].dtype == 'float64'
+
+
+def test_indexed_csv_file_reads_only_plant_ranges(recordings):
+    """Test a plant's rows are read from an indexed csv file with just its byte range."""
+    plant_offsets = {}
+    body = get_indexed_csv_body(recordings.sort_values(['plant_id', 'datetime']), plant_offsets)
+    s3_client_mock = get_s3_client_mock(body, plant_offsets=plant_offsets)
+
+    result = read_archive_file(s3_client_mock, '2023/12/recording_10.csv', 'test',
+                               filters=[('plant_id', '=', 2)], ranged=True, indexed=True)
+
+    assert list(result['id']) == [3]
+    keys = [call.kwargs['Key'] for call in s3_client_mock.get_object.call_args_list]
+    assert keys[0] == '2023/12/recording_10.csv.index.json'
+    ranges = [call.kwargs['Range'] for call in s3_client_mock.get_object.call_args_list[1:]]
+    assert ranges[1] == f"bytes={plant_offsets['2'][0]}-{plant_offsets['2'][1] - 1}"
+    assert plant_offsets['2'][1] == len(body)
+
+
+def test_indexed_csv_file_without_index_read_whole(recordings):
+    """Test a csv file whose index object is missing, or isn't indexed, is read whole."""
+    body = recordings.to_csv(index=False).encode()
+    s3_client_mock = get_s3_client_mock(body)
+
+    result = read_archive_file(s3_client_mock, '2023/12/recording_10.csv', 'test',
+                               filters=[('plant_id', '=', 2)], ranged=True, indexed=True)
+    read_archive_file(s3_client_mock, '2023/12/recording_10.csv', 'test',
+                      filters=[('plant_id', '=', 2)], ranged=True)
+
+    assert list(result['id']) == [3]
+    assert [call.kwargs.get('Range') for call in s3_client_mock.get_object.call_args_list] == [
+        None, None, None]
+
+
+def test_plant_offsets_saved_with_etag():
+    """Test plant offsets round trip through the index object, only for the same ETag."""
+    s3_client_mock = MagicMock()
+    plant_offsets = {'1': [10, 20]}
+
+    assert not save_plant_offsets(s3_client_mock, 'test', '2023/12/recording_10.csv', '"etag"',
+                                  {})
+    assert save_plant_offsets(s3_client_mock, 'test', '2023/12/recording_10.csv', '"etag"',
+                              plant_offsets)
+    put_kwargs = s3_client_mock.put_object.call_args.kwargs
+    assert put_kwargs['Key'] == get_index_key('2023/12/recording_10.csv')
+    s3_client_mock.get_object.return_value = {'Body': BytesIO(put_kwargs['Body'].encode())}
+    assert load_plant_offsets(s3_client_mock, 'test', '2023/12/recording_10.csv',
+                              '"etag"') == plant_offsets
+    s3_client_mock.get_object.return_value = {'Body': BytesIO(put_kwargs['Body'].encode())}
+    assert load_plant_offsets(s3_client_mock, 'test', '2023/12/recording_10.csv',
+                              '"other"') is None
+
+
+@pytest.mark.parametrize('archive_format', ['csv', 'parquet'])
+def test_read_archive_file_conditional_on_etag(recordings, archive_format):
+    """Test every ranged read is conditional on the ETag, so a replaced file fails the read."""
+    plant_offsets = {}
+    df = recordings.sort_values(['plant_id', 'datetime'])
+    body = (get_indexed_csv_body(df, plant_offsets) if archive_format == 'csv'
+            else get_file_body(df, 'parquet'))
+    s3_client_mock = get_s3_client_mock(body, etag='"new"', plant_offsets=plant_offsets)
+    key = f'2023/12/recording-20231212001500-1a2b3c4d.{archive_format}'
+
+    with pytest.raises(ClientError):
+        read_archive_file(s3_client_mock, key, 'test', filters=[('plant_id', '=', 2)],
+                          ranged=True, size=len(body), indexed=True, etag='"old"')
+
+    s3_client_mock.get_object.reset_mock()
+    result = read_archive_file(s3_client_mock, key, 'test', filters=[('plant_id', '=', 2)],
+                               ranged=True, size=len(body), indexed=True, etag='"new"')
+    assert list(result['id']) == [3]
+    assert all(call.kwargs['IfMatch'] == '"new"'
+               for call in s3_client_mock.get_object.call_args_list
+               if call.kwargs['Key'] == key)
+
+
+def test_filter_df_in():
+    """Test 'in' filters keep the rows with any of the values."""
+    df = pd.DataFrame({'plant_id': [1, 2, 3]})
+
+    assert list(filter_df(df, [('plant_id', 'in', [1, 3])])['plant_id']) == [1, 3]
+
+
+def test_s3_range_file_reads_ranges():
+    """Test the range file seeks and reads like a file, requesting only the bytes read."""
+    s3_client_mock = get_s3_client_mock(b'0123456789')
+    range_file = S3RangeFile(s3_client_mock, 'test', 'key')
+
+    range_file.seek(-4, 2)
+    assert range_file.read(2) == b'67'
+    assert s3_client_mock.get_object.call_args.kwargs['Range'] == 'bytes=6-7'
+    assert range_file.read() == b'89'
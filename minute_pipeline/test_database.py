@@ -0,0 +1,18 @@
+"""Unit tests for database.py"""
+from unittest.mock import patch
+
+from database import get_database_engine
+
+
+@patch('database.db.create_engine')
+def test_get_database_engine_created_once(mock_create_engine, monkeypatch):
+    """Test the engine is only created once, and pings connections before handing them out."""
+    for variable in ['DB_USER', 'DB_PASSWORD', 'DB_HOST', 'DB_PORT', 'DB_NAME', 'DB_SCHEMA']:
+        monkeypatch.setenv(variable, 'test')
+    get_database_engine.cache_clear()
+
+    assert get_database_engine() is get_database_engine()
+    assert mock_create_engine.call_count == 1
+    assert mock_create_engine.call_args.kwargs['pool_pre_ping'] is True
+
+    get_database_engine.cache_clear()
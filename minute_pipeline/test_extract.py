@@ -1,5 +1,11 @@
 """Unit tests for extract.py"""
-from extract import get_recording_data, get_watering_data
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from extract import (BASE_URL, LatencyTracker, RecordColumns, extract, get_all_plant_data,
+                     get_dataframes, get_hedged_plant_data, get_plant_data, get_recording_data,
+                     get_request_timeout, get_watering_data)
 
 
 def test_get_recording_data_one_valid_keys():
@@ -21,3 +27,178 @@ def test_get_watering_data_no_data():
     data = {}
     assert get_watering_data(data) == {
         'plant_id': None, 'last_watered': None}
+
+
+def get_record_columns(records: list[tuple]) -> RecordColumns:
+    """Returns record columns holding the given compact records."""
+    columns = RecordColumns(len(records))
+    for record in records:
+        columns.append(record)
+    return columns
+
+
+class FakeResponse:
+    """Stand-in for an aiohttp response, usable as an async context manager."""
+
+    def __init__(self, data):
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def json(self, content_type=None):
+        if isinstance(self.data, Exception):
+            raise self.data
+        return self.data
+
+
+def test_get_plant_data_uses_session():
+    """Test the plant data is requested through the given session."""
+    session = MagicMock()
+    session.get.return_value = FakeResponse({'plant_id': 3, 'temperature': 12})
+
+    result = asyncio.run(get_plant_data(session, 3, timeout=5))
+
+    assert result == {'plant_id': 3, 'temperature': 12}
+    assert session.get.call_args.args == (BASE_URL + '3',)
+    assert session.get.call_args.kwargs['timeout'].total == 5
+
+
+@patch('extract.get_all_plant_data', new_callable=AsyncMock)
+def test_extract_drops_incomplete_rows(mock_get_all_plant_data):
+    """Test plants missing values are dropped from the returned dataframes."""
+    mock_get_all_plant_data.return_value = (get_record_columns(
+        [(1, 30, 12, 'test', 'test'), (2, None, None, None, None)]), [])
+
+    recording_df, watering_df = extract(plant_ids=[1, 2], max_concurrency=5, deadline=10)
+
+    mock_get_all_plant_data.assert_called_once_with([1, 2], 5, 10)
+    assert list(recording_df['plant_id']) == [1]
+    assert list(watering_df['plant_id']) == [1]
+
+
+def test_get_request_timeout_from_latencies():
+    """Test the request timeout follows the observed latencies, within its bounds."""
+    latencies = LatencyTracker()
+    assert get_request_timeout(latencies) == 10
+
+    for _ in range(100):
+        latencies.record(1)
+    assert get_request_timeout(latencies) == 3
+
+    for _ in range(100):
+        latencies.record(60)
+    assert get_request_timeout(latencies) == 30
+
+
+@patch('extract.REQUEST_LATENCIES', new_callable=LatencyTracker)
+@patch('extract.get_plant_data')
+def test_get_hedged_plant_data_uses_first_response(mock_get_plant_data, mock_latencies):
+    """Test a slow request is hedged, and the faster duplicate's response is used."""
+    delays = [1, 0]
+
+    async def fake_get_plant_data(session, plant_id, timeout):
+        delay = delays.pop(0)
+        await asyncio.sleep(delay)
+        return {'plant_id': plant_id, 'delay': delay}
+
+    mock_get_plant_data.side_effect = fake_get_plant_data
+
+    result = asyncio.run(get_hedged_plant_data(MagicMock(), 4, timeout=5, hedge_delay=0.01))
+
+    assert result == {'plant_id': 4, 'delay': 0}
+    assert mock_get_plant_data.call_count == 2
+    # The slow request that lost to its duplicate is still recorded, as a censored sample
+    assert len(mock_latencies.latencies) == 1
+    assert mock_latencies.latencies[0] >= 0.01
+
+
+@patch('extract.REQUEST_LATENCIES', new_callable=LatencyTracker)
+@patch('extract.get_plant_data')
+def test_get_hedged_plant_data_records_cancelled_request(mock_get_plant_data, mock_latencies):
+    """Test a request cancelled at the deadline records how long it had taken."""
+
+    async def fake_get_plant_data(session, plant_id, timeout):
+        await asyncio.sleep(10)
+
+    mock_get_plant_data.side_effect = fake_get_plant_data
+
+    async def run_until_deadline():
+        try:
+            await asyncio.wait_for(
+                get_hedged_plant_data(MagicMock(), 4, timeout=20, hedge_delay=5), timeout=0.05)
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(run_until_deadline())
+
+    assert len(mock_latencies.latencies) == 1
+    assert mock_latencies.latencies[0] >= 0.05
+
+
+@patch('extract.get_hedged_plant_data')
+def test_get_all_plant_data_skips_plants_past_deadline(mock_get_hedged_plant_data):
+    """Test plants not answered within the deadline are skipped and reported."""
+
+    async def fake_get_hedged_plant_data(session, plant_id, timeout, hedge_delay):
+        if plant_id == 2:
+            await asyncio.sleep(10)
+        return {'plant_id': plant_id}
+
+    mock_get_hedged_plant_data.side_effect = fake_get_hedged_plant_data
+
+    columns, skipped = asyncio.run(get_all_plant_data([1, 2, 3], deadline=0.1))
+
+    assert sorted(columns.plant_id[:len(columns)]) == [1, 3]
+    assert skipped == [2]
+
+
+@patch('extract.get_hedged_plant_data')
+def test_get_all_plant_data_skips_malformed_responses(mock_get_hedged_plant_data):
+    """
+    Test plants whose response isn't a JSON object (an HTML error page, an empty body or a list),
+    or whose measures aren't numbers, are skipped and reported, and the other plants' readings
+    kept.
+    """
+    responses = {
+        1: {'plant_id': 1, 'soil_moisture': 30.5, 'temperature': 12.0,
+            'recording_taken': '2023-12-20 14:03:04',
+            'last_watered': 'Wed, 20 Dec 2023 14:03:04 GMT'},
+        2: json.JSONDecodeError('Expecting value', '<html>503</html>', 0),
+        3: None,
+        4: [],
+        5: {'plant_id': 5, 'soil_moisture': 'wet', 'temperature': 12.0}}
+    session = MagicMock()
+    session.get.side_effect = lambda url, timeout: FakeResponse(
+        responses[int(url.removeprefix(BASE_URL))])
+
+    async def fake_get_hedged_plant_data(_, plant_id, timeout, hedge_delay):
+        return await get_plant_data(session, plant_id, timeout)
+
+    mock_get_hedged_plant_data.side_effect = fake_get_hedged_plant_data
+
+    columns, skipped = asyncio.run(get_all_plant_data([1, 2, 3, 4, 5], deadline=5))
+
+    assert len(columns) == 1
+    assert (columns.plant_id[0], columns.soil_moisture[0]) == (1, 30.5)
+    assert columns.last_watered[0] == 'Wed, 20 Dec 2023 14:03:04 GMT'
+    assert skipped == [2, 3, 4, 5]
+
+
+def test_get_dataframes_typed_columns():
+    """Test the dataframes are typed, and only keep records with every value they need."""
+    records = [(1, 30.5, 12.0, '2023-12-20 14:03:04', 'Wed, 20 Dec 2023 14:03:04 GMT'),
+               (2, None, None, None, 'Wed, 20 Dec 2023 13:03:04 GMT'),
+               (None, None, None, None, None)]
+
+    recording_df, watering_df = get_dataframes(get_record_columns(records))
+
+    assert list(recording_df['plant_id']) == [1]
+    assert recording_df['soil_moisture'].dtype == 'float64'
+    assert list(watering_df['plant_id']) == [1, 2]
+    assert watering_df['plant_id'].dtype == 'int64'
+    assert list(watering_df['last_watered']) == ['Wed, 20 Dec 2023 14:03:04 GMT',
+                                                 'Wed, 20 Dec 2023 13:03:04 GMT']
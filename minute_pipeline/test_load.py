@@ -1,10 +1,13 @@
 """Unit tests for load.py"""
+from datetime import datetime
 from os import environ
 from unittest.mock import MagicMock
 import pandas as pd
 from sqlalchemy import Table, MetaData
+from sqlalchemy.dialects import mssql
 
-from load import upload_recordings, upload_waterings
+from load import get_row_batches, upload_recordings, upload_waterings
+import tables
 
 environ['DB_NAME'] = 'test'
 environ['DB_SCHEMA'] = 'test'
@@ -14,28 +17,76 @@ def test_upload_recordings_correct_calls():
     """Test the correct number of calls occur with two lines of data."""
     data = pd.DataFrame([
         {'plant_id': 1, 'soil_moisture': 30, 'temperature': 25,
-            'recording_taken': 'test'},
+            'datetime': 'test'},
         {'plant_id': 1, 'soil_moisture': 30, 'temperature': 25,
-         'recording_taken': 'test0'}
+         'datetime': 'test0'}
     ])
-    db_metadata = MetaData()
-    table = Table("test", db_metadata)
     conn = MagicMock()
     mock_execute = conn.execute
     mock_commit = conn.commit
-    upload_recordings(data, conn, table)
+    upload_recordings(data, conn, tables.recording)
     assert mock_execute.call_count == 1
     assert mock_commit.call_count == 1
 
 
 def test_upload_waterings_correct_calls_empty_data():
-    """Test the correct number of calls occur with empty data."""
+    """Test no statements are run with empty data."""
     data = pd.DataFrame([])
     conn = MagicMock()
     mock_execute = conn.execute
     mock_commit = conn.commit
     db_metadata = MetaData()
     table = Table("test", db_metadata)
-    upload_waterings(data, conn, table)
-    assert mock_execute.call_count == 1
-    assert mock_commit.call_count == 1
+    assert upload_waterings(data, conn, table) == (0, 0)
+    assert mock_execute.call_count == 0
+    assert mock_commit.call_count == 0
+
+
+def test_upload_waterings_one_statement_counts_duplicates():
+    """Test waterings are inserted in one statement, and rows not inserted are counted as duplicates."""
+    data = pd.DataFrame([
+        {'plant_id': 1, 'datetime': 'test'},
+        {'plant_id': 1, 'datetime': 'test'},
+        {'plant_id': 2, 'datetime': 'test'},
+        {'plant_id': 3, 'datetime': 'test'}
+    ])
+    conn = MagicMock()
+    conn.execute.return_value.rowcount = 1
+
+    assert upload_waterings(data, conn, tables.watering) == (1, 3)
+    assert conn.execute.call_count == 1
+    assert conn.commit.call_count == 1
+
+
+def test_get_row_batches_splits_rows():
+    """Test rows are built from the given columns and split into batches of the given size."""
+    data = pd.DataFrame({'plant_id': [1, 2, 3], 'temperature': [20.0, 21.0, 22.0],
+                         'other': ['a', 'b', 'c']})
+    assert get_row_batches(data, ['plant_id', 'temperature'], batch_size=2) == [
+        [(1, 20.0), (2, 21.0)], [(3, 22.0)]]
+
+
+
+def test_upload_recordings_upserts_latest_recordings():
+    """
+    Test each plant's latest recording is upserted (updated unless older, else inserted) in the
+    same transaction as the recordings.
+    """
+    data = pd.DataFrame({'plant_id': [1, 1, 2], 'soil_moisture': [11.0, 12.0, 21.0],
+                         'temperature': [15.0, 16.0, 25.0],
+                         'datetime': [datetime(2023, 12, 10, 12, 1), datetime(2023, 12, 10, 12, 0),
+                                      datetime(2023, 12, 10, 12, 0)]})
+    conn = MagicMock()
+    upload_recordings(data, conn, tables.recording, tables.latest_recording)
+
+    assert conn.execute.call_count == 3
+    assert conn.commit.call_count == 1
+    update, insert = (call.args[0].compile(dialect=mssql.dialect())
+                      for call in conn.execute.call_args_list[1:])
+    assert str(update).startswith('UPDATE latest_recording SET')
+    assert 'latest_recording.datetime <= new_latest.datetime' in str(update)
+    assert str(insert).startswith('INSERT INTO latest_recording')
+    assert 'NOT (EXISTS' in str(insert)
+    params = list(insert.params.values())
+    assert sorted(zip(*[iter(params)] * 4)) == [(1, 11.0, 15.0, datetime(2023, 12, 10, 12, 1)),
+                                                (2, 21.0, 25.0, datetime(2023, 12, 10, 12, 0))]
@@ -0,0 +1,88 @@
+"""Unit tests for manifest.py"""
+from datetime import datetime
+from io import BytesIO
+import json
+from unittest.mock import MagicMock
+
+from botocore.exceptions import ClientError
+import pytest
+
+from manifest import (get_file_entry, update_manifest, get_keys_for_range, get_folder_keys,
+                      get_earliest_datetime)
+
+
+def get_entry(key: str, first_day: int, last_day: int) -> dict:
+    """Returns the entry of a file with rows from the first to the last given day of 12/2023."""
+    return get_file_entry(key, 10, 100, '"etag"', datetime(2023, 12, first_day),
+                          datetime(2023, 12, last_day, 23))
+
+
+@pytest.fixture
+def archive_manifest():
+    """Returns a manifest of a month file and a day's part files."""
+    return {'files': {
+        '2023/12/recording.csv': get_entry('2023/12/recording.csv', 1, 9),
+        '2023/12/recording_10/1.parquet': get_entry('2023/12/recording_10/1.parquet', 10, 10),
+        '2023/12/watering_10/1.parquet': get_entry('2023/12/watering_10/1.parquet', 10, 10),
+        '2023/1/recording.csv': get_entry('2023/1/recording.csv', 1, 1)
+    }}
+
+
+def test_get_file_entry_data_type():
+    """Test the data type is taken from month, day and part keys alike."""
+    assert get_entry('2023/12/watering.csv', 1, 1)['data_type'] == 'watering'
+    assert get_entry('2023/12/recording_3.csv', 1, 1)['data_type'] == 'recording'
+    assert get_entry('2023/12/recording_3/1.parquet', 1, 1)['data_type'] == 'recording'
+    assert get_entry('2023/12/watering-20231212001500-1a2b3c4d.parquet', 1, 1)[
+        'data_type'] == 'watering'
+    assert get_entry('rollups/1h/recording/2023/12-20231212001500-1a2b3c4d.csv', 1, 1)[
+        'data_type'] == 'recording'
+
+
+def test_get_keys_for_range(archive_manifest):
+    """Test only the files of the type with rows in the range are returned."""
+    result = get_keys_for_range(archive_manifest, 'recording', datetime(2023, 12, 10),
+                                datetime(2023, 12, 11))
+
+    assert result == ['2023/12/recording_10/1.parquet']
+
+
+def test_get_folder_keys_exact_month(archive_manifest):
+    """Test the keys of a month don't include those of months sharing its first digit."""
+    assert get_folder_keys(archive_manifest, '2023/1') == ['2023/1/recording.csv']
+
+
+def test_get_earliest_datetime(archive_manifest):
+    """Test the earliest datetime is found, and None for an empty archive."""
+    archive_manifest['files']['2023/1/recording.csv']['rows'] = 0
+
+    assert get_earliest_datetime(archive_manifest) == datetime(2023, 12, 1)
+    assert get_earliest_datetime({'files': {}}) is None
+
+
+def test_update_manifest_retries_on_conflict(archive_manifest):
+    """Test an update that loses a race with another writer is redone on the new manifest."""
+    s3_client_mock = MagicMock()
+    s3_client_mock.get_object.side_effect = lambda Bucket, Key: {
+        'Body': BytesIO(json.dumps(archive_manifest).encode()), 'ETag': '"v1"'}
+    s3_client_mock.put_object.side_effect = [
+        ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'PutObject'), {}]
+
+    result = update_manifest(s3_client_mock, 'test', removed=['2023/1/recording.csv'])
+
+    assert s3_client_mock.put_object.call_count == 2
+    assert s3_client_mock.put_object.call_args.kwargs['IfMatch'] == '"v1"'
+    assert '2023/1/recording.csv' not in result['files']
+
+
+def test_update_manifest_creates_manifest():
+    """Test the first update only succeeds if no other writer has created the manifest."""
+    s3_client_mock = MagicMock()
+    s3_client_mock.get_object.side_effect = ClientError(
+        {'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+
+    result = update_manifest(s3_client_mock, 'test',
+                             added={'2023/12/watering.csv': get_entry('2023/12/watering.csv', 1, 2)})
+
+    assert list(result['files']) == ['2023/12/watering.csv']
+    assert s3_client_mock.put_object.call_args.kwargs['IfNoneMatch'] == '*'
@@ -0,0 +1,113 @@
+"""Unit tests for metrics.py"""
+import json
+
+import boto3
+import pytest
+import sqlalchemy as db
+
+from metrics import Metrics, METRICS, instrument_engines, instrument_s3_client
+
+
+def get_line(lines: list[dict], metric: str, **dimensions) -> dict:
+    """Returns the line of the metric with the given dimensions."""
+    return next(line for line in lines
+                if line['metric'] == metric and line['dimensions'] == dimensions)
+
+
+def test_counters_sum_per_series():
+    """Test counters add up separately for each name and set of dimensions."""
+    metrics = Metrics()
+    metrics.increment('rows', 51, stage='extract')
+    metrics.increment('rows', 49, stage='load')
+    metrics.increment('rows', 2, stage='load')
+    metrics.increment('api_errors')
+
+    lines = metrics.get_metric_lines(pipeline='minute_pipeline')
+
+    assert get_line(lines, 'rows', stage='extract')['value'] == 51
+    assert get_line(lines, 'rows', stage='load')['value'] == 51
+    assert get_line(lines, 'api_errors') == {'pipeline': 'minute_pipeline', 'metric': 'api_errors',
+                                             'type': 'counter', 'dimensions': {}, 'value': 1}
+
+
+def test_histograms_give_percentiles_and_buckets():
+    """Test histograms give the count, sum, extremes, percentiles and bucket counts."""
+    metrics = Metrics()
+    for latency in [0.01, 0.2, 0.2, 3, 12]:
+        metrics.observe('api_latency_seconds', latency)
+
+    line = get_line(metrics.get_metric_lines(), 'api_latency_seconds')
+
+    assert line['type'] == 'histogram'
+    assert (line['count'], line['sum'], line['min'], line['max']) == (5, 15.41, 0.01, 12)
+    assert line['p50'] == 0.2
+    assert line['buckets'] == {'0.05': 1, '0.1': 0, '0.25': 2, '0.5': 0, '1': 0, '2.5': 0,
+                               '5': 1, '10': 0, 'inf': 1}
+
+
+def test_time_stage_observes_failed_stages():
+    """Test a stage's duration is observed even when it raises."""
+    metrics = Metrics()
+
+    with pytest.raises(ValueError):
+        with metrics.time_stage('load'):
+            raise ValueError('Database unavailable')
+
+    assert get_line(metrics.get_metric_lines(), 'stage_seconds', stage='load')['count'] == 1
+
+
+def test_emit_prints_json_lines_and_resets(capsys):
+    """Test emit prints one JSON line per metric, then starts afresh."""
+    metrics = Metrics()
+    metrics.increment('rows', 10, stage='load')
+    metrics.observe('stage_seconds', 0.5, stage='load')
+
+    lines = metrics.emit(pipeline='minute_pipeline')
+
+    printed = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert printed == lines
+    assert len(printed) == 2
+    assert metrics.get_metric_lines() == []
+
+
+def test_instrument_engines_counts_round_trips():
+    """Test statements and commits on engines' connections are counted, once instrumented."""
+    METRICS.reset()
+    instrument_engines()
+    instrument_engines()
+    engine = db.create_engine('sqlite://')
+
+    with engine.connect() as connection:
+        connection.execute(db.text('SELECT 1'))
+        connection.execute(db.text('SELECT 2'))
+        connection.commit()
+
+    assert get_line(METRICS.get_metric_lines(), 'db_round_trips')['value'] == 3
+    METRICS.reset()
+
+
+def test_instrument_s3_client_counts_requests_and_bytes():
+    """Test requests made with an instrumented s3 client are counted by operation, with bytes."""
+    METRICS.reset()
+    s3_client = instrument_s3_client(boto3.client(
+        's3', region_name='eu-west-2', aws_access_key_id='test', aws_secret_access_key='test'))
+
+    events = s3_client.meta.events
+    put_object = s3_client.meta.service_model.operation_model('PutObject')
+    get_object = s3_client.meta.service_model.operation_model('GetObject')
+    # The events botocore emits around each request (a Stubber would answer before them)
+    events.emit('before-call.s3.PutObject', model=put_object, context={},
+                params={'Body': b'id,plant', 'Bucket': 'test', 'Key': '2023/12/recording.csv'})
+    events.emit('after-call.s3.PutObject', model=put_object, context={},
+                http_response=None, parsed={'ETag': '"1"'})
+    events.emit('before-call.s3.GetObject', model=get_object, context={},
+                params={'Bucket': 'test', 'Key': '2023/12/recording.csv'})
+    events.emit('after-call.s3.GetObject', model=get_object, context={},
+                http_response=None, parsed={'ContentLength': 7})
+
+    lines = METRICS.get_metric_lines()
+    assert get_line(lines, 's3_requests', operation='PutObject')['value'] == 1
+    assert get_line(lines, 's3_requests', operation='GetObject')['value'] == 1
+    assert get_line(lines, 's3_bytes_sent', operation='PutObject')['value'] == 8
+    assert get_line(lines, 's3_bytes_received', operation='GetObject')['value'] == 7
+    METRICS.reset()
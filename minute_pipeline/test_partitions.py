@@ -0,0 +1,61 @@
+"""Unit tests for partitions.py"""
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from partitions import (is_switch_out_enabled, get_partition_boundary, get_boundaries_to_split,
+                        get_boundaries_to_merge, get_switch_table, switch_out_partitions)
+import tables
+
+
+def test_is_switch_out_enabled_only_for_partitioned_tables(monkeypatch):
+    """Test switching out is only used for partitioned tables, once it's been turned on."""
+    monkeypatch.delenv('ARCHIVE_SWITCH_OUT', raising=False)
+    assert not is_switch_out_enabled('recording')
+
+    monkeypatch.setenv('ARCHIVE_SWITCH_OUT', '1')
+    assert is_switch_out_enabled('recording')
+    assert not is_switch_out_enabled('watering')
+
+
+def test_get_partition_boundary_floors_to_partition():
+    """Test moments are floored to the start of their partition."""
+    moment = datetime(2023, 12, 10, 12, 34, 56)
+    assert get_partition_boundary(moment) == datetime(2023, 12, 10, 12)
+    assert get_partition_boundary(moment, hours=24) == datetime(2023, 12, 10)
+
+
+def test_get_boundaries_to_split_only_after_newest():
+    """Test only the missing boundaries after the newest existing one are split."""
+    now = datetime(2023, 12, 10, 12, 30)
+    assert get_boundaries_to_split([], now, ahead=2) == [datetime(2023, 12, 10, 13),
+                                                         datetime(2023, 12, 10, 14)]
+    assert get_boundaries_to_split([datetime(2023, 12, 10, 13)], now, ahead=2) == [
+        datetime(2023, 12, 10, 14)]
+    assert get_boundaries_to_split([datetime(2023, 12, 10, 15)], now, ahead=2) == []
+
+
+def test_get_boundaries_to_merge_keeps_cutoff():
+    """Test the boundaries before the cutoff are merged, but not the cutoff itself."""
+    boundaries = [datetime(2023, 12, 10, hour) for hour in range(10, 14)]
+    assert get_boundaries_to_merge(boundaries, datetime(2023, 12, 10, 12)) == [
+        datetime(2023, 12, 10, 10), datetime(2023, 12, 10, 11)]
+
+
+def test_get_switch_table_same_columns():
+    """Test the switch table has the partitioned table's columns."""
+    switch_table = get_switch_table('recording')
+    assert switch_table.name == 'recording_switch'
+    assert list(switch_table.columns.keys()) == list(tables.recording.columns.keys())
+
+
+def test_switch_out_partitions_one_transaction(monkeypatch):
+    """Test each partition is switched to the same partition of the switch table, then committed."""
+    monkeypatch.setenv('DB_SCHEMA', 'test')
+    connection = MagicMock()
+    switch_out_partitions(connection, 'recording', [2, 3])
+
+    statements = [call.args[0] for call in connection.exec_driver_sql.call_args_list]
+    assert statements == [
+        'ALTER TABLE test.recording SWITCH PARTITION 2 TO test.recording_switch PARTITION 2',
+        'ALTER TABLE test.recording SWITCH PARTITION 3 TO test.recording_switch PARTITION 3']
+    assert connection.commit.call_count == 1
@@ -0,0 +1,127 @@
+"""Unit tests for profiling.py"""
+import concurrent.futures
+import logging
+import pstats
+import threading
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+
+import profiling
+
+
+def add_up(n: int) -> int:
+    """Returns the sum of the numbers below n."""
+    return sum(range(n))
+
+
+def test_profiled_returns_function_when_disabled(monkeypatch):
+    """Test profiling switched off leaves the function as it is."""
+    monkeypatch.delenv('PROFILE', raising=False)
+
+    assert profiling.profiled('minute_pipeline')(add_up) is add_up
+
+
+def test_profiled_saves_profile_to_directory(monkeypatch, tmp_path):
+    """Test a profiled call returns its result and saves its stats and allocations."""
+    monkeypatch.setenv('PROFILE', 'true')
+    monkeypatch.setenv('PROFILE_DIRECTORY', str(tmp_path))
+    monkeypatch.delenv('PROFILE_OUTPUT', raising=False)
+
+    assert profiling.profiled('minute_pipeline')(add_up)(1000) == 499500
+
+    [run_directory] = (tmp_path / 'minute_pipeline').iterdir()
+    assert sorted(file.name for file in run_directory.iterdir()) == [
+        'allocations.txt', 'stats.prof', 'stats.txt']
+    stats = pstats.Stats(str(run_directory / 'stats.prof'))
+    assert any(function == 'add_up' for _, _, function in stats.stats)
+    assert 'add_up' in (run_directory / 'stats.txt').read_text()
+    assert (run_directory / 'allocations.txt').read_text().startswith('Peak traced memory')
+
+
+def test_profiled_saves_profile_of_failed_call(monkeypatch, tmp_path):
+    """Test a call which raises is still profiled, and its error isn't hidden."""
+    monkeypatch.setenv('PROFILE', '1')
+    monkeypatch.setenv('PROFILE_DIRECTORY', str(tmp_path))
+    monkeypatch.delenv('PROFILE_OUTPUT', raising=False)
+
+    @profiling.profiled('daily_pipeline')
+    def fail():
+        raise ValueError('API unavailable')
+
+    with pytest.raises(ValueError):
+        fail()
+
+    assert len(list((tmp_path / 'daily_pipeline').iterdir())) == 1
+
+
+@patch('profiling.client')
+def test_save_profile_to_s3(mock_client, monkeypatch):
+    """Test profiles are written to the archive bucket under the run id with PROFILE_OUTPUT=s3."""
+    monkeypatch.setenv('PROFILE_OUTPUT', 's3')
+    monkeypatch.setenv('BUCKET_NAME', 'test')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID_', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY_', 'test')
+
+    location = profiling.save_profile('dashboard/20231201120000-1a2b3c4d',
+                                      {'stats.txt': b'stats', 'allocations.txt': b'memory'})
+
+    assert location == 's3://test/profiles/dashboard/20231201120000-1a2b3c4d'
+    keys = [call.kwargs['Key'] for call in mock_client.return_value.put_object.call_args_list]
+    assert keys == ['profiles/dashboard/20231201120000-1a2b3c4d/stats.txt',
+                    'profiles/dashboard/20231201120000-1a2b3c4d/allocations.txt']
+
+
+@patch('profiling.save_profile', side_effect=OSError('Read-only file system'))
+def test_profiled_call_survives_failed_save(mock_save, monkeypatch, caplog):
+    """Test a profile which can't be saved doesn't fail the call, and is logged as a warning."""
+    monkeypatch.setenv('PROFILE', 'yes')
+
+    assert profiling.profiled('minute_pipeline')(add_up)(10) == 45
+    mock_save.assert_called_once()
+    assert [(record.levelno, record.getMessage()) for record in caplog.records] == [
+        (logging.WARNING, 'Error saving profile of minute_pipeline: Read-only file system')]
+
+
+def test_profiled_concurrent_calls(monkeypatch, tmp_path):
+    """Test a call made while another is profiled runs unprofiled, and neither call fails."""
+    monkeypatch.setenv('PROFILE', 'true')
+    monkeypatch.setenv('PROFILE_DIRECTORY', str(tmp_path))
+    monkeypatch.delenv('PROFILE_OUTPUT', raising=False)
+    started, finish = threading.Event(), threading.Event()
+
+    @profiling.profiled('dashboard')
+    def wait_then_add_up(n: int) -> int:
+        started.set()
+        finish.wait(5)
+        return add_up(n)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(wait_then_add_up, 10)
+        started.wait(5)
+        second = executor.submit(wait_then_add_up, 100)
+        assert second.result(5) == 4950
+        finish.set()
+        assert first.result(5) == 45
+
+    assert len(list((tmp_path / 'dashboard').iterdir())) == 1
+    assert not tracemalloc.is_tracing()
+    assert profiling.profiled('dashboard')(add_up)(10) == 45
+    assert len(list((tmp_path / 'dashboard').iterdir())) == 2
+
+
+def test_profiled_call_while_tracing(monkeypatch, tmp_path):
+    """Test a call made while tracemalloc is already tracing runs unprofiled, leaving it tracing."""
+    monkeypatch.setenv('PROFILE', 'true')
+    monkeypatch.setenv('PROFILE_DIRECTORY', str(tmp_path))
+    monkeypatch.delenv('PROFILE_OUTPUT', raising=False)
+
+    tracemalloc.start()
+    try:
+        assert profiling.profiled('minute_pipeline')(add_up)(10) == 45
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+    assert not (tmp_path / 'minute_pipeline').exists()
@@ -1,24 +1,172 @@
 """Unit tests for rds_to_s3.py"""
+from datetime import date, datetime
+from io import BytesIO
+import json
 from unittest.mock import MagicMock
 
-from rds_to_s3 import get_day_bucket_keys
+from botocore.exceptions import ClientError
+import pandas as pd
+import pytest
+import sqlalchemy as db
 
+import partitions
+from rds_to_s3 import (get_part_key, upload_parts_to_s3, archive_old_records,
+                       archive_switched_out_records, get_archive_state_key)
+import tables
 
-def test_get_day_bucket_keys_valid():
-    """Testing the correct keys are returned."""
+
+CUTOFF = datetime(2023, 12, 10, 12)
+
+
+@pytest.fixture
+def s3_objects():
+    """Returns the objects of a fake bucket, by key."""
+    return {}
+
+
+@pytest.fixture
+def s3_client_mock(s3_objects):
+    """Returns a mock s3 client storing objects in s3_objects."""
+    s3_client_mock = MagicMock()
+
+    def get_object(Bucket, Key):
+        if Key not in s3_objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        body = s3_objects[Key]
+        return {'Body': BytesIO(body if isinstance(body, bytes) else body.encode()),
+                'ETag': str(hash(body))}
+
+    def put_object(Body, Bucket, Key, **kwargs):
+        s3_objects[Key] = Body
+        return {'ETag': str(hash(Body))}
+
+    s3_client_mock.get_object.side_effect = get_object
+    s3_client_mock.put_object.side_effect = put_object
+    s3_client_mock.delete_object.side_effect = lambda Bucket, Key: s3_objects.pop(Key)
+    return s3_client_mock
+
+
+@pytest.fixture
+def db_connection():
+    """Returns a connection to a database holding five old waterings and one new one."""
+    db_engine = db.create_engine('sqlite://')
+    tables.metadata.create_all(db_engine)
+    with db_engine.connect() as connection:
+        connection.execute(db.insert(tables.watering), [
+            {'plant_id': plant_id, 'datetime': datetime(2023, 12, 10, plant_id)}
+            for plant_id in [1, 2, 3, 13, 4, 5]])
+        connection.commit()
+        yield connection
+
+
+def get_watering_ids(connection) -> list[int]:
+    """Returns the ids of the waterings left in the database."""
+    return list(connection.execute(db.select(tables.watering.c.id)).scalars())
+
+
+def test_get_part_key_valid():
+    """Testing the part key is in the folder for its type and day, named after the run time."""
+    result = get_part_key('recording', date(2023, 12, 10), datetime(2023, 12, 11, 9, 30, 5))
+
+    assert result == '2023/12/recording_10/20231211093005000000.csv'
+
+
+def test_upload_parts_to_s3_one_part_per_day():
+    """Testing a part (and its index) is written for each day of data, and nothing for no data."""
     s3_client_mock = MagicMock()
+    s3_client_mock.put_object.return_value = {'ETag': '"etag"'}
+    df = pd.DataFrame({'plant_id': [2, 1, 1],
+                       'datetime': pd.to_datetime(['2023-12-09 23:59', '2023-12-10 00:01',
+                                                   '2023-12-09 23:58'])})
+
+    result = upload_parts_to_s3('watering', df, s3_client_mock, datetime(2023, 12, 11), 'test')
+
+    assert list(result) == ['2023/12/watering_9/20231211000000000000.csv',
+                            '2023/12/watering_10/20231211000000000000.csv']
+    assert result['2023/12/watering_9/20231211000000000000.csv']['rows'] == 2
+    assert result['2023/12/watering_9/20231211000000000000.csv']['indexed']
+    index_keys = [call.kwargs['Key'] for call in s3_client_mock.put_object.call_args_list
+                  if call.kwargs['Key'].endswith('.index.json')]
+    assert index_keys == ['2023/12/watering_9/20231211000000000000.csv.index.json',
+                          '2023/12/watering_10/20231211000000000000.csv.index.json']
+    assert s3_client_mock.put_object.call_count == 4
+    assert upload_parts_to_s3('watering', pd.DataFrame(), s3_client_mock,
+                              datetime(2023, 12, 11), 'test') == {}
+
+
+def test_upload_parts_to_s3_parquet_parts():
+    """Testing parts are written as parquet files when asked for."""
+    s3_client_mock = MagicMock()
+    df = pd.DataFrame({'plant_id': [1], 'datetime': pd.to_datetime(['2023-12-09 23:59'])})
+
+    result = upload_parts_to_s3('watering', df, s3_client_mock, datetime(2023, 12, 11), 'test',
+                                'parquet')
+
+    assert list(result) == ['2023/12/watering_9/20231211000000000000.parquet']
+    assert s3_client_mock.put_object.call_args.kwargs['Body'][:4] == b'PAR1'
+
+
+def test_archive_old_records_exports_and_deletes_in_batches(db_connection, s3_client_mock,
+                                                           s3_objects):
+    """Testing exactly the old rows are exported and deleted, batch by batch, and no state is left."""
+    result = archive_old_records('watering', db_connection, s3_client_mock, CUTOFF,
+                                 datetime(2023, 12, 11), batch_size=2, bucket_name='test')
+
+    assert result == 5
+    assert get_watering_ids(db_connection) == [4]
+    part_key = '2023/12/watering_10/20231211000000000000.csv'
+    part = pd.read_csv(BytesIO(s3_objects[part_key]))
+    assert list(part['id']) == [1, 2, 3, 5, 6]
+    assert get_archive_state_key('watering') not in s3_objects
+    entry = json.loads(s3_objects['manifest.json'])['files'][part_key]
+    assert (entry['rows'], entry['max_datetime']) == (5, '2023-12-10T05:00:00')
+
+
+def test_archive_old_records_resumes_unfinished_run(db_connection, s3_client_mock, s3_objects):
+    """Testing an interrupted run's range is finished, without exporting it again."""
+    s3_objects[get_archive_state_key('watering')] = json.dumps(
+        {'min_id': 1, 'max_id': 3, 'next_id': 3, 'cutoff': CUTOFF.isoformat(),
+         'run_time': '2023-12-11T00:00:00', 'exported': True})
+
+    result = archive_old_records('watering', db_connection, s3_client_mock, CUTOFF,
+                                 datetime(2023, 12, 11), batch_size=2, bucket_name='test')
+
+    assert result == 1
+    assert get_watering_ids(db_connection) == [1, 2, 4, 5, 6]
+    assert s3_client_mock.put_object.call_count == 0
+
+
+def test_archive_old_records_nothing_to_archive(db_connection, s3_client_mock):
+    """Testing nothing is written when no rows are old enough."""
+    result = archive_old_records('watering', db_connection, s3_client_mock, datetime(2023, 1, 1),
+                                 datetime(2023, 12, 11), bucket_name='test')
+
+    assert result == 0
+    assert s3_client_mock.put_object.call_count == 0
 
-    day = 10
 
-    s3_client_mock.list_objects.return_value = {
-        'Contents': [
-            {'Key': 'test/file.csv'},
-            {'Key': 'test/file_10.csv'},
-            {'Key': 'test/file_9.csv'},
-        ]
-    }
+def test_archive_switched_out_records_exports_switch_table(s3_client_mock, s3_objects,
+                                                          monkeypatch):
+    """Testing the partitions before the (floored) cutoff are switched out, exported and emptied."""
+    calls = []
+    monkeypatch.setattr(partitions, 'get_switchable_partitions',
+                        lambda connection, table_name, cutoff: calls.append(cutoff) or [2])
+    monkeypatch.setattr(partitions, 'switch_out_partitions',
+                        lambda connection, table_name, numbers: calls.append(numbers))
+    monkeypatch.setattr(partitions, 'get_switched_out_records', lambda connection, table_name:
+                        pd.DataFrame({'id': [1, 2], 'plant_id': [1, 2],
+                                      'soil_moisture': [30.0, 31.0], 'temperature': [20.0, 21.0],
+                                      'datetime': [datetime(2023, 12, 10, 11, 15)] * 2}))
+    monkeypatch.setattr(partitions, 'truncate_switch_table',
+                        lambda connection, table_name: calls.append('truncate'))
+    monkeypatch.setattr(partitions, 'maintain_boundaries',
+                        lambda connection, cutoff, now: calls.append('maintain'))
 
-    result = get_day_bucket_keys(s3_client_mock, 'test', day, 'test')
+    result = archive_switched_out_records('recording', MagicMock(), s3_client_mock,
+                                          datetime(2023, 12, 10, 12, 30), datetime(2023, 12, 11),
+                                          bucket_name='test')
 
-    assert result == ['test/file_10.csv']
-    assert s3_client_mock.list_objects.call_count == 1
+    assert result == 2
+    assert calls == [datetime(2023, 12, 10, 12), [2], 'truncate', 'maintain']
+    assert '2023/12/recording_10/20231211000000000000.csv' in s3_objects
+    assert get_archive_state_key('recording') not in s3_objects
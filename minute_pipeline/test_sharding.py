@@ -0,0 +1,82 @@
+"""Unit tests for sharding.py"""
+import io
+import json
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ReadTimeoutError
+import pytest
+
+from sharding import (get_shard_plant_ids, split_plant_ids, invoke_shard_worker,
+                      create_lambda_client)
+
+
+def test_get_shard_plant_ids_range():
+    """Test a range shard returns every id from start up to (not including) stop."""
+    assert get_shard_plant_ids({'type': 'range', 'start': 3, 'stop': 6}) == [3, 4, 5]
+
+
+def test_get_shard_plant_ids_modulo():
+    """Test a modulo shard returns every count-th id from its index."""
+    shard = {'type': 'modulo', 'index': 1, 'count': 4, 'stop': 12}
+    assert get_shard_plant_ids(shard) == [1, 5, 9]
+
+
+@patch('sharding.get_db_plant_ids')
+def test_get_shard_plant_ids_modulo_plant_table(mock_get_db_plant_ids):
+    """Test a modulo shard over the plant table splits the discovered ids."""
+    mock_get_db_plant_ids.return_value = [2, 3, 7, 10]
+    shard = {'type': 'modulo', 'index': 0, 'count': 2, 'source': 'plant_table'}
+    assert get_shard_plant_ids(shard) == [2, 10]
+
+
+def test_get_shard_plant_ids_unknown_type():
+    """Test an unknown shard type is rejected."""
+    with pytest.raises(ValueError):
+        get_shard_plant_ids({'type': 'test'})
+
+
+def test_split_plant_ids_no_empty_shards():
+    """Test plant ids are split round-robin, without empty shards when there are few ids."""
+    assert split_plant_ids([0, 1, 2, 3, 4], 2) == [[0, 2, 4], [1, 3]]
+    assert split_plant_ids([0, 1], 4) == [[0], [1]]
+
+
+def test_invoke_shard_worker_function_error():
+    """Test a worker that raised is reported as an error for its shard."""
+    lambda_client = MagicMock()
+    lambda_client.invoke.return_value = {
+        'FunctionError': 'Unhandled',
+        'Payload': io.BytesIO(json.dumps({'errorMessage': 'test'}).encode())
+    }
+
+    result = invoke_shard_worker(lambda_client, 'test', [1, 2])
+
+    assert result == {'plant_count': 2, 'error': {'errorMessage': 'test'}}
+
+
+def test_invoke_shard_worker_botocore_error():
+    """Test a worker whose invocation timed out is reported as an error, not raised."""
+    lambda_client = MagicMock()
+    lambda_client.invoke.side_effect = ReadTimeoutError(endpoint_url='test')
+
+    result = invoke_shard_worker(lambda_client, 'test', [1, 2, 3])
+
+    assert result['plant_count'] == 3
+    assert 'error' in result
+
+
+@patch.dict('os.environ', {'AWS_ACCESS_KEY_ID_': 'test', 'AWS_SECRET_ACCESS_KEY_': 'test',
+                           'AWS_DEFAULT_REGION': 'eu-west-2', 'WORKER_WAIT_TIMEOUT': '45'})
+def test_create_lambda_client_never_retries():
+    """Test the client waits for the worker at most the wait timeout, and makes only one attempt."""
+    config = create_lambda_client().meta.config
+
+    assert config.read_timeout == 45
+    assert config.retries['total_max_attempts'] == 1
+
+
+@patch.dict('os.environ', {'AWS_ACCESS_KEY_ID_': 'test', 'AWS_SECRET_ACCESS_KEY_': 'test',
+                           'AWS_DEFAULT_REGION': 'eu-west-2'})
+def test_create_lambda_client_waits_less_than_a_minute():
+    """Test a coordinator stops waiting for its workers before the next scheduled run starts."""
+    assert create_lambda_client().meta.config.read_timeout < 60
@@ -0,0 +1,132 @@
+"""Unit tests for stage_runner.py"""
+from datetime import datetime
+from io import BytesIO
+import json
+from unittest.mock import MagicMock
+
+from botocore.exceptions import ClientError
+
+from stage_runner import Stage, StageLeases, run_stages, run_due_stages
+
+
+NOW = datetime(2023, 12, 11, 10, 0, 1)
+
+
+def test_stage_is_due():
+    """Test stages without a cadence are always due, and others once their cadence has passed."""
+    hourly_stage = Stage('archive', None, cadence=3600)
+
+    assert Stage('load', None).is_due(datetime(2023, 12, 11, 9, 59), NOW)
+    assert hourly_stage.is_due(None, NOW)
+    assert hourly_stage.is_due(datetime(2023, 12, 11, 9, 0, 3), NOW)
+    assert not hourly_stage.is_due(datetime(2023, 12, 11, 9, 30), NOW)
+
+
+def test_run_stages_passes_outputs_and_skips_stages_not_due():
+    """Test each stage gets the outputs before it, and stages not due don't run."""
+    archive = MagicMock()
+    stages = [Stage('extract', lambda outputs: 2),
+              Stage('load', lambda outputs: outputs['extract'] * 3),
+              Stage('archive', archive, cadence=3600)]
+    state = {'archive': '2023-12-11T09:30:00'}
+
+    outputs, timings = run_stages(stages, state, NOW)
+
+    assert outputs == {'extract': 2, 'load': 6}
+    assert timings['load']['ran'] and not timings['archive']['ran']
+    archive.assert_not_called()
+    assert state == {'archive': '2023-12-11T09:30:00'}
+
+
+def test_run_stages_records_last_run_and_defers_over_budget():
+    """Test stages with a cadence are recorded when run, and put off if they won't fit."""
+    state = {}
+
+    run_stages([Stage('archive', lambda outputs: None, cadence=3600, budget=60)], state, NOW)
+    assert state == {'archive': NOW.isoformat()}
+
+    _, timings = run_stages([Stage('compact', lambda outputs: None, cadence=60, budget=60)],
+                            state, NOW, time_left=30)
+    assert timings['compact'] == {'ran': False, 'reason': 'over budget'}
+    assert 'compact' not in state
+
+
+def test_run_due_stages_loads_and_saves_state():
+    """Test the last run times are read from s3, and written back when a stage has run."""
+    s3_client_mock = MagicMock()
+    s3_client_mock.get_object.side_effect = ClientError(
+        {'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+
+    run_due_stages([Stage('archive', lambda outputs: None, cadence=3600)],
+                   s3_client=s3_client_mock, bucket_name='test')
+
+    saved_state = json.loads(s3_client_mock.put_object.call_args.kwargs['Body'])
+    assert list(saved_state) == ['archive']
+
+
+def test_run_due_stages_no_state_without_cadences():
+    """Test s3 isn't touched when every stage runs every tick."""
+    s3_client_mock = MagicMock()
+    s3_client_mock.get_object.return_value = {'Body': BytesIO(b'{}')}
+
+    outputs, _ = run_due_stages([Stage('extract', lambda outputs: 1)], s3_client=s3_client_mock,
+                                bucket_name='test')
+
+    assert outputs == {'extract': 1}
+    s3_client_mock.get_object.assert_not_called()
+
+
+def get_lease_response(expires: str) -> dict:
+    """Returns a get_object response holding a lease expiring at the given time."""
+    return {'Body': BytesIO(json.dumps({'expires': expires}).encode()), 'ETag': '"1"'}
+
+
+def test_run_stages_skips_stage_leased_by_another_run():
+    """Test a stage whose lease another run holds isn't run, and its last run isn't recorded."""
+    s3_client_mock = MagicMock()
+    s3_client_mock.get_object.return_value = get_lease_response('2023-12-11T10:05:00')
+    archive = MagicMock()
+    state = {}
+
+    _, timings = run_stages([Stage('archive', archive, cadence=3600)], state, NOW,
+                            leases=StageLeases(s3_client_mock, 'test'))
+
+    assert timings['archive'] == {'ran': False, 'reason': 'leased'}
+    archive.assert_not_called()
+    s3_client_mock.put_object.assert_not_called()
+    assert state == {}
+
+
+def test_stage_leases_take_over_expired_lease_conditionally():
+    """Test an expired lease is replaced only if it's unchanged, and lost races are refused."""
+    s3_client_mock = MagicMock()
+    s3_client_mock.get_object.return_value = get_lease_response('2023-12-11T09:59:00')
+    leases = StageLeases(s3_client_mock, 'test', seconds=60)
+
+    assert leases.acquire('archive', NOW)
+    put_kwargs = s3_client_mock.put_object.call_args.kwargs
+    assert put_kwargs['IfMatch'] == '"1"'
+    assert json.loads(put_kwargs['Body']) == {'expires': '2023-12-11T10:01:01'}
+
+    s3_client_mock.get_object.return_value = get_lease_response('2023-12-11T09:59:00')
+    s3_client_mock.put_object.side_effect = ClientError(
+        {'Error': {'Code': 'PreconditionFailed'}}, 'PutObject')
+    assert not leases.acquire('compact', NOW)
+
+
+def test_run_due_stages_releases_lease_after_saving_state():
+    """Test a new lease is created only if there's none, and given up after the state is saved."""
+    s3_client_mock = MagicMock()
+    s3_client_mock.get_object.side_effect = ClientError(
+        {'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+    s3_client_mock.put_object.return_value = {'ETag': '"2"'}
+
+    run_due_stages([Stage('archive', lambda outputs: None, cadence=3600)],
+                   s3_client=s3_client_mock, bucket_name='test')
+
+    lease_put, state_put = s3_client_mock.put_object.call_args_list
+    assert lease_put.kwargs['Key'] == 'stage_state/leases/archive.json'
+    assert lease_put.kwargs['IfNoneMatch'] == '*'
+    assert state_put.kwargs['Key'] == 'stage_state/minute_pipeline.json'
+    s3_client_mock.delete_object.assert_called_once_with(
+        Bucket='test', Key='stage_state/leases/archive.json', IfMatch='"2"')
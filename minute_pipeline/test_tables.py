@@ -0,0 +1,26 @@
+"""Unit tests for tables.py"""
+import sqlalchemy as db
+
+import tables
+
+
+def test_get_table_declared_by_default(monkeypatch):
+    """Test the declared table is returned, without touching the database, by default."""
+    monkeypatch.delenv('REFLECT_TABLES', raising=False)
+    db_engine = db.create_engine('sqlite://')
+
+    assert tables.get_table('recording', db_engine) is tables.recording
+
+
+def test_get_table_reflects_once(monkeypatch):
+    """Test a reflected table is cached, so the database is only inspected the first time."""
+    monkeypatch.setenv('REFLECT_TABLES', '1')
+    monkeypatch.setenv('DB_SCHEMA', 'main')
+    db_engine = db.create_engine('sqlite://')
+    tables.metadata.create_all(db_engine)
+
+    reflected_table = tables.get_table('watering', db_engine)
+    db_engine.dispose()
+
+    assert list(reflected_table.columns.keys()) == ['id', 'plant_id', 'datetime']
+    assert tables.get_table('watering', db_engine) is reflected_table
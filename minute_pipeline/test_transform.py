@@ -18,3 +18,14 @@ def test_transform_function():
 
     expected_watering_columns = ['datetime', 'another_column']
     assert list(waterings.columns) == expected_watering_columns
+
+
+def test_transform_parses_api_time_formats():
+    """Test the API's recording and watering time formats are parsed to naive datetimes."""
+    recording_df = pd.DataFrame({'recording_taken': ['2023-12-20 14:03:04']})
+    watering_df = pd.DataFrame({'last_watered': ['Wed, 20 Dec 2023 13:54:32 GMT']})
+
+    recordings, waterings = transform(recording_df, watering_df)
+
+    assert recordings['datetime'][0] == pd.Timestamp('2023-12-20 14:03:04')
+    assert waterings['datetime'][0] == pd.Timestamp('2023-12-20 13:54:32')
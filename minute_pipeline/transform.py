@@ -2,12 +2,27 @@
 import pandas as pd
 
 
+RECORDING_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+WATERING_TIME_FORMAT = '%a, %d %b %Y %H:%M:%S %Z'
+
+
+def parse_datetimes(times: pd.Series, time_format: str) -> pd.Series:
+    """
+    Parses a column of datetime strings with the format the API uses, only falling back to
+    (much slower) per-value format inference if any don't match it.
+    """
+    try:
+        return pd.to_datetime(times, format=time_format)
+    except ValueError:
+        return pd.to_datetime(times)
+
+
 def transform(recording_df, watering_df):
     """Cleans the extracted data frames."""
-    recording_df['recording_taken'] = pd.to_datetime(
-        recording_df['recording_taken'])
+    recording_df['recording_taken'] = parse_datetimes(
+        recording_df['recording_taken'], RECORDING_TIME_FORMAT)
     recording_df = recording_df.rename(columns={'recording_taken': 'datetime'})
-    watering_df['last_watered'] = pd.to_datetime(
-        watering_df['last_watered']).dt.tz_localize(None)
+    watering_df['last_watered'] = parse_datetimes(
+        watering_df['last_watered'], WATERING_TIME_FORMAT).dt.tz_localize(None)
     watering_df = watering_df.rename(columns={'last_watered': 'datetime'})
     return recording_df, watering_df
@@ -127,7 +127,7 @@ resource "aws_lambda_function" "data_management_lambda" {
             BUCKET_NAME=var.BUCKET_NAME
         }
     }
-    timeout = 10
+    timeout = 300
   }
 
 
@@ -194,6 +194,28 @@ resource "aws_lambda_function" "pipeline-lambda" {
 }
 
 
+# Allow the pipeline lambda to invoke itself, as its coordinator mode does for each shard
+
+resource "aws_iam_role_policy" "lambda-invoke-pipeline" {
+  name   = "lambda-invoke-pipeline"
+  role   = aws_iam_role.lambda-role.name
+  policy = jsonencode({
+    "Statement": [
+      {
+        "Action": [
+          "lambda:InvokeFunction",
+        ],
+        "Effect": "Allow",
+        "Resource": [
+          aws_lambda_function.pipeline-lambda.arn,
+          "${aws_lambda_function.pipeline-lambda.arn}:*",
+        ],
+      }
+    ]
+  })
+}
+
+
 # EventBridge Schedule that runs the pipeline lambda every minute
 
 resource "aws_scheduler_schedule" "pipeline-event" {